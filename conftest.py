@@ -0,0 +1 @@
+# Lets the tests under tests/ import the application as `src.*` when pytest is run from the repository root
@@ -1,26 +1,12 @@
-from langchain.agents import Tool
-from langchain.chains import LLMChain
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain.prompts import PromptTemplate
-from src.utils.tidb_connector import execute_query
-import json
-from dotenv import load_dotenv
-import os
-
-# Load environment variables from .env file
-load_dotenv()
+from src.utils.llm import DEFAULT_MODEL, LLM, PromptChain, PromptTemplate, response_text
+from src.utils.bond_queries import QUERY_PARTS, QUERY_SCHEMA
+from src.utils.pagination import fetch_page
+from src.utils.schemas import parse_structured
 
 class BondDirectoryAgent:
     def __init__(self, api_key=None):
         # Initialize LLM
-        self.llm = ChatGoogleGenerativeAI(
-            model="gemini-2.0-flash",
-            google_api_key=os.getenv("GAI_PS"),
-            temperature=0
-        )
-        
-        # Initialize previous results variable
-        self.prev_res = ""
+        self.llm = LLM(model=DEFAULT_MODEL, temperature=0, api_key=api_key, name="bond_directory")
         
         # Create master prompt - NOTE THE DOUBLE BRACES FOR JSON EXAMPLES
         template = """You are a Bond Directory Agent that helps users find information about bonds.
@@ -51,6 +37,7 @@ class BondDirectoryAgent:
         - tds_amount (decimal): Tax deducted at source
         - remaining_principal (decimal): Principal amount remaining after this payment
         - state (string): Status of the cash flow (e.g., "active", "paid")
+        - source (string): "actual" for published schedules, "projected" for schedules generated from the coupon terms
         - created_at (string): Timestamp when the record was created
         - updated_at (string): Timestamp when the record was last updated
         
@@ -87,6 +74,7 @@ class BondDirectoryAgent:
         - interest_amount_min (number): Minimum interest amount (>=)
         - interest_amount_max (number): Maximum interest amount (<=)
         - state (string): Status of the cash flow (e.g., "active", "paid") (=)
+        - source (string): "actual" or "projected" (=)
         
         User query: {query}
         {prev_res}
@@ -100,7 +88,9 @@ class BondDirectoryAgent:
         - table: The table to query (either "bond_details" or "cashflows")
         - columns: Array of column names to retrieve
         - filters: Object with filter conditions
-        - limit: Maximum number of results (default 10)
+        - limit: Maximum number of results (default 10, at most 100 per page)
+        - sort (optional): "isin" (default) or "maturity_date" for bond_details, "cash_flow_date" for cashflows
+        - cursor (optional): The "next_cursor" token of an earlier result, to fetch the next page of the same query
         - compound: Boolean indicating if a follow-up query is needed (e.g., first get bond details, then get cashflows)
         6. If compound is true, also include a "next_query" object with:
         - table: The table to query next
@@ -145,17 +135,21 @@ class BondDirectoryAgent:
         
         self.prompt = PromptTemplate(template=template, input_variables=["query", "prev_res"])
         
-        # Update to use newer style (avoid deprecation warning)
-        from langchain_core.runnables import RunnableSequence
-        self.chain = RunnableSequence(self.prompt, self.llm)
+        self.chain = PromptChain(self.prompt, self.llm, json_mode=True)
     
-    def process_query(self, query):
-        """Process a bond directory query and return a response."""
+    def process_query(self, query, prev_res=""):
+        """
+        Process a bond directory query and return a response.
+
+        Args:
+            prev_res (str): Results of an earlier lookup in the same request, as JSON text,
+                given to the model as context
+        """
         try:
             # Add previous results to context if available
             prev_res_context = ""
-            if self.prev_res:
-                prev_res_context = f"\nResults from previous Query: {self.prev_res}"
+            if prev_res:
+                prev_res_context = f"\nResults from previous Query: {prev_res}"
             
             # Get query JSON from LLM - updated to new style
             response = self.chain.invoke({"query": query, "prev_res": prev_res_context})
@@ -163,33 +157,13 @@ class BondDirectoryAgent:
             # Debug the response
             print(f"DEBUG - Response type: {type(response)}")
             
-            # Extract content from response - handle different response formats
-            json_str = None
-            if hasattr(response, "content"):
-                json_str = response.content
-            elif isinstance(response, dict) and "text" in response:
-                json_str = response["text"]
-            elif isinstance(response, str):
-                json_str = response
-            else:
-                # For AIMessage or other LangChain message types
-                json_str = str(response)
-            
+            json_str = response_text(response)
             print(f"DEBUG - Extracted JSON: {json_str}")
             
-            # Clean up the markdown code block formatting
-            if json_str.startswith("```"):
-                # Extract just the JSON part between the code block markers
-                lines = json_str.split("\n")
-                # Remove first line (```json) and last line (```
-                clean_lines = lines[1:-1] if len(lines) > 2 else lines
-                json_str = "\n".join(clean_lines)
-            
-            # Parse the JSON response
-            query_params = json.loads(json_str)
-            
-            # Reset previous results
-            self.prev_res = ""
+            # Parse and validate against the known tables, columns and filters
+            query_params = parse_structured(
+                json_str, QUERY_SCHEMA.validate, self.llm, component="bond_directory", task="bond directory query"
+            )
             
             # Execute the optimized query
             if query_params.get("table") == "bond_details":
@@ -201,9 +175,6 @@ class BondDirectoryAgent:
             print("RES: ", result)           
             # Check if compound query is needed
             if query_params.get("compound", False) and "next_query" in query_params:
-                # Store the first result
-                self.prev_res = json.dumps(result)
-                
                 # Get the next query parameters from the model's response
                 second_query_params = query_params.get("next_query", {})
                 
@@ -244,266 +215,27 @@ class BondDirectoryAgent:
             return {"error": f"Error processing query: {str(e)}"}
     
     def execute_optimized_query(self, query_params):
-        """Execute an optimized TiDB query for bond_details table."""
-        try:
-            # Extract parameters
-            table = "bond_details"  # Ensure we're querying the correct table
-            columns = query_params.get("columns", ["isin", "company_name"])
-            filters = query_params.get("filters", {})
-            limit = query_params.get("limit", 10)
-            
-            # Ensure limit is applied
-            if not limit or limit > 100:
-                limit = 5
-            
-            # Build column list for SQL with comprehensive mappings
-            column_mapping = {
-                # Coupon details
-                "coupon_rate": "JSON_EXTRACT(coupon_details, '$.coupensVo.couponDetails.couponRate') as coupon_rate",
-                "coupon_type": "JSON_EXTRACT(coupon_details, '$.coupensVo.couponDetails.couponType') as coupon_type",
-                "coupon_frequency": "JSON_EXTRACT(coupon_details, '$.coupensVo.couponDetails.interestPaymentFrequency') as coupon_frequency",
-                "coupon_basis": "JSON_EXTRACT(coupon_details, '$.coupensVo.couponDetails.couponBasis') as coupon_basis",
-                
-                # Instrument details
-                "face_value": "JSON_EXTRACT(instrument_details, '$.instrumentsVo.instruments.faceValue') as face_value",
-                "secured": "JSON_EXTRACT(instrument_details, '$.instrumentsVo.instruments.secured') as secured",
-                "instrument_description": "JSON_EXTRACT(instrument_details, '$.instrumentsVo.instruments.instrumentDesc') as instrument_description",
-                "mode_of_issue": "JSON_EXTRACT(instrument_details, '$.instrumentsVo.instruments.modeOfIssue') as mode_of_issue",
-                "tenure_years": "JSON_EXTRACT(instrument_details, '$.instrumentsVo.instruments.tenureYears') as tenure_years",
-                "tenure_months": "JSON_EXTRACT(instrument_details, '$.instrumentsVo.instruments.tenureMonths') as tenure_months",
-                "tenure_days": "JSON_EXTRACT(instrument_details, '$.instrumentsVo.instruments.tenureDays') as tenure_days",
-                "series": "JSON_EXTRACT(instrument_details, '$.instrumentsVo.instruments.series') as series",
-                "tax_free": "JSON_EXTRACT(instrument_details, '$.instrumentsVo.instruments.taxFree') as tax_free",
-                
-                # Issuer details
-                "issuer_type": "JSON_EXTRACT(issuer_details, '$.issuerTypeOwner') as issuer_type",
-                "sector": "JSON_EXTRACT(issuer_details, '$.sector') as sector",
-                "industry": "JSON_EXTRACT(issuer_details, '$.industry') as industry",
-                "cin": "JSON_EXTRACT(issuer_details, '$.cin') as cin",
-                "lei": "JSON_EXTRACT(issuer_details, '$.lei') as lei",
-                
-                # Credit rating details
-                "credit_rating": "JSON_EXTRACT(credit_rating_details, '$.currentRatings.currentRating') as credit_rating",
-                "rating_outlook": "JSON_EXTRACT(credit_rating_details, '$.currentRatings.outlook') as rating_outlook",
-                "rating_agency": "JSON_EXTRACT(credit_rating_details, '$.currentRatings.creditRatingAgencyName') as rating_agency",
-                "rating_date": "JSON_EXTRACT(credit_rating_details, '$.currentRatings.creditRatingDate') as rating_date",
-                
-                # Listing details
-                "listing_exchange": "JSON_EXTRACT(listing_details, '$.listingDetails.exchangeName') as listing_exchange",
-                "listing_date": "JSON_EXTRACT(listing_details, '$.listingDetails.listingDate') as listing_date",
-                "listing_status": "JSON_EXTRACT(listing_details, '$.listingStatus') as listing_status",
-                
-                # Redemption details
-                "redemption_type": "JSON_EXTRACT(redemption_details, '$.redemptionType') as redemption_type",
-                "put_option": "JSON_EXTRACT(redemption_details, '$.putIndicator') as put_option",
-                "call_option": "JSON_EXTRACT(redemption_details, '$.callIndicator') as call_option",
-                "maturity_type": "JSON_EXTRACT(redemption_details, '$.maturityType') as maturity_type",
-                
-                # Trustee details
-                "debenture_trustee": "JSON_EXTRACT(key_contacts_details, '$.debtTrusteeName') as debenture_trustee",
-                "registrar": "JSON_EXTRACT(key_contacts_details, '$.registrar') as registrar",
-                "registrar_contact": "JSON_EXTRACT(key_contacts_details, '$.regContact') as registrar_contact",
-                "trustee_contact": "JSON_EXTRACT(key_contacts_details, '$.debtTrusteeContact') as trustee_contact",
-                "trustee_address": "JSON_EXTRACT(key_contacts_details, '$.debtTrusteeAddr') as trustee_address"
-            }
-            
-            sql_columns = []
-            for col in columns:
-                if col in column_mapping:
-                    sql_columns.append(column_mapping[col])
-                else:
-                    sql_columns.append(col)
-            
-            # Build WHERE clause
-            conditions = []
-            params = []
-            
-            for key, value in filters.items():
-                # ISIN and company name filters
-                if key == "isin":
-                    if isinstance(value, list):
-                        placeholders = ', '.join(['%s'] * len(value))
-                        conditions.append(f"isin IN ({placeholders})")
-                        params.extend(value)
-                    else:
-                        conditions.append("isin = %s")
-                        params.append(value)
-                
-                # Maturity date filters
-                elif key == "maturity_after":
-                    conditions.append("maturity_date >= %s")
-                    params.append(value)
-                elif key == "maturity_before":
-                    conditions.append("maturity_date <= %s")
-                    params.append(value)
-                elif key == "maturity_equals":
-                    conditions.append("maturity_date = %s")
-                    params.append(value)
-                
-                # Coupon rate filters
-                elif key == "coupon_rate_min":
-                    conditions.append("JSON_EXTRACT(coupon_details, '$.coupensVo.couponDetails.couponRate') >= %s")
-                    params.append(value)
-                elif key == "coupon_rate_max":
-                    conditions.append("JSON_EXTRACT(coupon_details, '$.coupensVo.couponDetails.couponRate') <= %s")
-                    params.append(value)
-                elif key == "coupon_rate_equals":
-                    conditions.append("JSON_EXTRACT(coupon_details, '$.coupensVo.couponDetails.couponRate') = %s")
-                    params.append(value)
-                
-                # Secured status filter
-                elif key == "secured":
-                    conditions.append("JSON_EXTRACT(instrument_details, '$.instrumentsVo.instruments.secured') = %s")
-                    params.append(value)
-                
-                # Issuer type, sector, industry filters
-                elif key == "issuer_type":
-                    conditions.append("JSON_EXTRACT(issuer_details, '$.issuerTypeOwner') = %s")
-                    params.append(value)
-                elif key == "sector":
-                    conditions.append("JSON_EXTRACT(issuer_details, '$.sector') = %s")
-                    params.append(value)
-                elif key == "industry":
-                    conditions.append("JSON_EXTRACT(issuer_details, '$.industry') = %s")
-                    params.append(value)
-
-                # Credit rating filters
-                elif key == "credit_rating_min":
-                    conditions.append("JSON_EXTRACT(credit_rating_details, '$.currentRatings.currentRating') >= %s")
-                    params.append(value)
-                elif key == "credit_rating_equals":
-                    conditions.append("JSON_EXTRACT(credit_rating_details, '$.currentRatings.currentRating') = %s")
-                    params.append(value)
-                
-                # Face value filters
-                elif key == "face_value_min":
-                    conditions.append("JSON_EXTRACT(instrument_details, '$.instrumentsVo.instruments.faceValue') >= %s")
-                    params.append(value)
-                elif key == "face_value_max":
-                    conditions.append("JSON_EXTRACT(instrument_details, '$.instrumentsVo.instruments.faceValue') <= %s")
-                    params.append(value)
-                elif key == "face_value_equals":
-                    conditions.append("JSON_EXTRACT(instrument_details, '$.instrumentsVo.instruments.faceValue') = %s")
-                    params.append(value)
-                
-                # Listing exchange filter
-                elif key == "listing_exchange":
-                    conditions.append("JSON_EXTRACT(listing_details, '$.listingDetails.exchangeName') = %s")
-                    params.append(value)
-                
-                # Issue size filters
-                elif key == "issue_size_min":
-                    conditions.append("issue_size >= %s")
-                    params.append(value)
-                elif key == "issue_size_max":
-                    conditions.append("issue_size <= %s")
-                    params.append(value)
-                elif key == "issue_size_equals":
-                    conditions.append("issue_size = %s")
-                    params.append(value)
-            
-            # Build the SQL query
-            sql = f"SELECT {', '.join(sql_columns)} FROM tap_bonds.{table}"
-            if conditions:
-                sql += " WHERE " + " AND ".join(conditions)
-            sql += f" LIMIT {limit}"
-            
-            # Execute the query
-            result = execute_query(sql, tuple(params))
-            return result
-            
-        except Exception as e:
-            return {"error": f"Error executing query: {str(e)}"}
+        """Execute an optimized TiDB query for bond_details table, returning one page of results."""
+        return self._execute_page("bond_details", query_params)
 
     def execute_optimized_query2(self, query_params):
-        """Execute an optimized TiDB query for cashflows table."""
+        """Execute an optimized TiDB query for cashflows table, returning one page of results."""
+        return self._execute_page("cashflows", query_params)
+
+    def _execute_page(self, table, query_params):
         try:
-            # Extract parameters
-            table = "cashflows"  # Ensure we're querying the correct table
-            columns = query_params.get("columns", ["id", "isin", "cash_flow_date"])
             filters = query_params.get("filters", {})
-            limit = query_params.get("limit", 10)
-            
-            # Ensure limit is applied
-            if not limit or limit > 100:
-                limit = 10
-            
-            # For cashflows table, we don't need JSON extraction
-            sql_columns = columns
-            
-            # Build WHERE clause
-            conditions = []
-            params = []
-            
-            for key, value in filters.items():
-                # ISIN filter
-                if key == "isin":
-                    if isinstance(value, list):
-                        placeholders = ', '.join(['%s'] * len(value))
-                        conditions.append(f"isin IN ({placeholders})")
-                        params.extend(value)
-                    else:
-                        conditions.append("isin = %s")
-                        params.append(value)
-                
-                # Cash flow date filters
-                elif key == "cash_flow_date_after":
-                    conditions.append("cash_flow_date >= %s")
-                    params.append(value)
-                elif key == "cash_flow_date_before":
-                    conditions.append("cash_flow_date <= %s")
-                    params.append(value)
-                elif key == "cash_flow_date_equals":
-                    conditions.append("cash_flow_date = %s")
-                    params.append(value)
-                
-                # Amount filters
-                elif key == "cash_flow_amount_min":
-                    conditions.append("cash_flow_amount >= %s")
-                    params.append(value)
-                elif key == "cash_flow_amount_max":
-                    conditions.append("cash_flow_amount <= %s")
-                    params.append(value)
-                elif key == "cash_flow_amount_equals":
-                    conditions.append("cash_flow_amount = %s")
-                    params.append(value)
-                
-                # Principal amount filters
-                elif key == "principal_amount_min":
-                    conditions.append("principal_amount >= %s")
-                    params.append(value)
-                elif key == "principal_amount_max":
-                    conditions.append("principal_amount <= %s")
-                    params.append(value)
-                elif key == "principal_amount_equals":
-                    conditions.append("principal_amount = %s")
-                    params.append(value)
-                
-                # Interest amount filters
-                elif key == "interest_amount_min":
-                    conditions.append("interest_amount >= %s")
-                    params.append(value)
-                elif key == "interest_amount_max":
-                    conditions.append("interest_amount <= %s")
-                    params.append(value)
-                elif key == "interest_amount_equals":
-                    conditions.append("interest_amount = %s")
-                    params.append(value)
-                
-                # State filter
-                elif key == "state":
-                    conditions.append("state = %s")
-                    params.append(value)
-            
-            # Build the SQL query
-            sql = f"SELECT {', '.join(sql_columns)} FROM tap_bonds.{table}"
-            if conditions:
-                sql += " WHERE " + " AND ".join(conditions)
-            sql += f" ORDER BY cash_flow_date LIMIT {limit}"
-
-            result = execute_query(sql, params)
-
-            return result
+            sql_columns, conditions, params = QUERY_PARTS[table](query_params.get("columns"), filters)
+            
+            # Keyset pagination: "limit" is capped at MAX_PAGE_SIZE and "next_cursor" fetches the following page
+            return fetch_page(
+                table, sql_columns, conditions, params,
+                filters=filters,
+                sort=query_params.get("sort"),
+                cursor=query_params.get("cursor"),
+                limit=query_params.get("limit"),
+                cache=True,
+            )
             
         except Exception as e:
             return {"error": f"Error executing query: {str(e)}"}
@@ -1,21 +1,10 @@
-from langchain.chains import LLMChain
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain.prompts import PromptTemplate
-import json
-import os
-from dotenv import load_dotenv
-
-# Load environment variables from .env file
-load_dotenv()
+from src.utils.llm import DEFAULT_MODEL, LLM, PromptChain, PromptTemplate
+from src.utils import json_codec
 
 class BondFinderAgent:
     def __init__(self, api_key=None):
         # Initialize LLM
-        self.llm = ChatGoogleGenerativeAI(
-            model="gemini-2.0-flash",
-            google_api_key=os.getenv("GAI_PS", api_key),
-            temperature=0
-        )
+        self.llm = LLM(model=DEFAULT_MODEL, temperature=0, api_key=api_key, name="bond_finder")
         
         # Create master prompt with limit instructions
         template = """You are a Bond Finder Agent that helps users discover and compare bonds across different platforms. Your goal is to identify the best investment opportunities based on yield, risk, and other factors.
@@ -62,9 +51,7 @@ class BondFinderAgent:
         
         self.prompt = PromptTemplate(template=template, input_variables=["query", "bond_data", "limit"])
         
-        # Update to use newer style (avoid deprecation warning)
-        from langchain_core.runnables import RunnableSequence
-        self.chain = RunnableSequence(self.prompt, self.llm)
+        self.chain = PromptChain(self.prompt, self.llm)
 
     def process_query(self, query, bond_data, limit=4):
         """Process a bond finder query and return recommendations.
@@ -77,7 +64,7 @@ class BondFinderAgent:
         try:
             # Format bond data if it's not already a string
             if not isinstance(bond_data, str):
-                bond_data_str = json.dumps(bond_data, indent=2)
+                bond_data_str = json_codec.dumps(bond_data, indent=2)
             else:
                 bond_data_str = bond_data
             
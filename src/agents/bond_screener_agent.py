@@ -1,23 +1,56 @@
-from langchain.agents import Tool
-from langchain.chains import LLMChain
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain.prompts import PromptTemplate
+from src.utils.llm import DEFAULT_MODEL, LLM, PromptChain, PromptTemplate, response_text
+from src.utils.text_index import TEXT_FILTER_FIELDS, get_text_index
+from src.utils.bond_queries import COMPANY_COLUMNS, COMPANY_JSON_COLUMNS
+from src.utils.filter_compiler import Filter, FilterCompiler, as_number, range_filters
+from src.utils.pagination import SORT_KEYS, fetch_page
+from src.utils.schemas import QuerySchema, TableSchema, parse_structured
 from src.utils.tidb_connector import execute_query
-import json
-from dotenv import load_dotenv
-import os
 
-# Load environment variables from .env file
-load_dotenv()
+def _metric(name):
+    return "JSON_EXTRACT(key_metrics, '$.\"" + name + "\"')"
+
+COMPANY_FILTERS = FilterCompiler({
+    # String field exact and partial matches
+    "company_name": Filter("company_name"),
+    "company_name_contains": Filter("company_name", "contains"),
+    "company_industry": Filter("company_industry"),
+    "company_industry_contains": Filter("company_industry", "contains"),
+    
+    # Text field contains searches (LIKE fallback when the text index is not built)
+    **{key: Filter(column, "contains") for key, column in TEXT_FILTER_FIELDS.items()},
+    
+    # JSON field searches
+    **{f"{column}_contains": Filter(column, "contains")
+       for column in ("key_metrics", "income_statement", "balance_sheet", "cashflow", "lenders_profile",
+                      "key_personnel", "borrowers_profile", "shareholding_profile")},
+    
+    # Specific JSON field extractions and comparisons
+    **range_filters("eps", _metric("EPS"), as_number),
+    **range_filters("debt_equity", _metric("Debt/Equity"), as_number),
+    **range_filters("current_ratio", _metric("Current ratio"), as_number),
+})
+
+# What the model may ask for; anything else is sent back for repair instead of reaching the SQL
+QUERY_SCHEMA = QuerySchema(
+    tables=[
+        TableSchema(
+            "company_insights",
+            columns=COMPANY_COLUMNS + COMPANY_JSON_COLUMNS,
+            column_prefixes=COMPANY_JSON_COLUMNS,
+            filter_compiler=COMPANY_FILTERS,
+            sort_keys=SORT_KEYS["company_insights"],
+        ),
+    ],
+    default_table="company_insights",
+)
 
 class BondScreenerAgent:
+    # Upper bound on ranked text index hits pushed into the SQL IN list
+    max_text_hits = 500
+
     def __init__(self, api_key=None):
         # Initialize LLM
-        self.llm = ChatGoogleGenerativeAI(
-            model="gemini-2.0-flash",
-            google_api_key=os.getenv("GAI_PS"),
-            temperature=0
-        )
+        self.llm = LLM(model=DEFAULT_MODEL, temperature=0, api_key=api_key, name="bond_screener")
         
         # Create master prompt
         template = """You are a Bond Screener Agent that helps users analyze companies that issue bonds.
@@ -60,6 +93,8 @@ class BondScreenerAgent:
           - pros_contains: Search within company pros
           - cons_contains: Search within company cons
           - news_contains: Search within company news and events
+          Text searches match whole words, "quoted phrases" match exactly and a trailing * matches a prefix (e.g. "renew*").
+          Matching companies are returned most relevant first.
         
         User query: {query}
         
@@ -70,8 +105,12 @@ class BondScreenerAgent:
         4. Format the query as a JSON object with these fields:
            - table: The table to query (here "company_insights")
            - columns: Array of column names to retrieve
+             To fetch only part of a JSON column use "column.Key" (e.g. "key_metrics.EPS", "key_metrics.Debt/Equity")
+             instead of the whole column
            - filters: Object with filter conditions
            - limit: Maximum number of results must be <= 5
+           - sort (optional): "company_name" (text searches are always ordered by relevance)
+           - cursor (optional): The "next_cursor" token of an earlier result, to fetch the next page of the same query
         
         Example 1 - Company lookup:
         {{
@@ -86,7 +125,7 @@ class BondScreenerAgent:
         Example 2 - Industry search:
         {{
             "table": "company_insights",
-            "columns": ["company_name", "company_industry", "key_metrics"],
+            "columns": ["company_name", "company_industry", "key_metrics.EPS", "key_metrics.Current ratio"],
             "filters": {{
                 "company_industry": "Finance"
             }},
@@ -98,9 +137,7 @@ class BondScreenerAgent:
         
         self.prompt = PromptTemplate(template=template, input_variables=["query"])
         
-        # Update to use newer style (avoid deprecation warning)
-        from langchain_core.runnables import RunnableSequence
-        self.chain = RunnableSequence(self.prompt, self.llm)
+        self.chain = PromptChain(self.prompt, self.llm, json_mode=True)
     
     def process_query(self, query):
         """Process a bond screener query and return a response."""
@@ -111,29 +148,13 @@ class BondScreenerAgent:
             # Debug the response
             print(f"DEBUG - Response type: {type(response)}")
             
-            # Extract content from response
-            json_str = None
-            if hasattr(response, "content"):
-                json_str = response.content
-            elif isinstance(response, dict) and "text" in response:
-                json_str = response["text"]
-            elif isinstance(response, str):
-                json_str = response
-            else:
-                json_str = str(response)
-            
+            json_str = response_text(response)
             print(f"DEBUG - Extracted JSON: {json_str}")
             
-            # Clean up the markdown code block formatting
-            if json_str.startswith("```"):
-                # Extract just the JSON part between the code block markers
-                lines = json_str.split("\n")
-                # Remove first line (```json) and last line (```
-                clean_lines = lines[1:-1] if len(lines) > 2 else lines
-                json_str = "\n".join(clean_lines)
-            
-            # Parse the JSON response
-            query_params = json.loads(json_str)
+            # Parse and validate against the known columns and filters
+            query_params = parse_structured(
+                json_str, QUERY_SCHEMA.validate, self.llm, component="bond_screener", task="bond screener query"
+            )
             
             # Execute the optimized query
             result = self.execute_optimized_query(query_params)
@@ -149,133 +170,104 @@ class BondScreenerAgent:
             table = "company_insights"  # Ensure we're querying the correct table
             columns = query_params.get("columns", ["company_name", "company_industry"])
             filters = query_params.get("filters", {})
-            limit = query_params.get("limit", 5)
             
-            # Ensure limit is applied
-            if not limit or limit > 100:
-                limit = 5
+            # Build column list for SQL, projecting JSON sub-keys server side
+            sql_columns, select_params, json_columns = self.build_projection(columns)
             
-            # Build column list for SQL
-            sql_columns = columns
+            # Text searches are answered by the BM25 index once it has been built
+            text_index = get_text_index()
+            text_queries = []
+            if len(text_index) > 0:
+                text_queries = [(TEXT_FILTER_FIELDS[key], str(value)) for key, value in filters.items()
+                                if key in TEXT_FILTER_FIELDS and value is not None]
+                sql_filters = {key: value for key, value in filters.items() if key not in TEXT_FILTER_FIELDS}
+            else:
+                sql_filters = filters
             
             # Build WHERE clause
-            conditions = []
-            params = []
-            
-            for key, value in filters.items():
-                # String field exact matches
-                if key == "company_name" and not key.endswith("_contains"):
-                    conditions.append("company_name = %s")
-                    params.append(value)
-                elif key == "company_name_contains" or (key == "company_name" and key.endswith("_contains")):
-                    conditions.append("company_name LIKE %s")
-                    params.append(f"%{value}%")
-                elif key == "company_industry" and not key.endswith("_contains"):
-                    conditions.append("company_industry = %s")
-                    params.append(value)
-                elif key == "company_industry_contains" or (key == "company_industry" and key.endswith("_contains")):
-                    conditions.append("company_industry LIKE %s")
-                    params.append(f"%{value}%")
-                
-                # Text field contains searches
-                elif key == "description_contains":
-                    conditions.append("description LIKE %s")
-                    params.append(f"%{value}%")
-                elif key == "pros_contains":
-                    conditions.append("pros LIKE %s")
-                    params.append(f"%{value}%")
-                elif key == "cons_contains":
-                    conditions.append("cons LIKE %s")
-                    params.append(f"%{value}%")
-                elif key == "news_contains":
-                    conditions.append("news_and_events LIKE %s")
-                    params.append(f"%{value}%")
-                
-                # JSON field searches
-                elif key == "key_metrics_contains":
-                    conditions.append("key_metrics LIKE %s")
-                    params.append(f"%{value}%")
-                elif key == "income_statement_contains":
-                    conditions.append("income_statement LIKE %s")
-                    params.append(f"%{value}%")
-                elif key == "balance_sheet_contains":
-                    conditions.append("balance_sheet LIKE %s")
-                    params.append(f"%{value}%")
-                elif key == "cashflow_contains":
-                    conditions.append("cashflow LIKE %s")
-                    params.append(f"%{value}%")
-                elif key == "lenders_profile_contains":
-                    conditions.append("lenders_profile LIKE %s")
-                    params.append(f"%{value}%")
-                elif key == "key_personnel_contains":
-                    conditions.append("key_personnel LIKE %s")
-                    params.append(f"%{value}%")
-                elif key == "borrowers_profile_contains":
-                    conditions.append("borrowers_profile LIKE %s")
-                    params.append(f"%{value}%")
-                elif key == "shareholding_profile_contains":
-                    conditions.append("shareholding_profile LIKE %s")
-                    params.append(f"%{value}%")
-                
-                # Specific JSON field extractions and comparisons
-                elif key.startswith("eps_"):
-                    field_path = "$..[?(@.EPS)]"
-                    if key == "eps_min":
-                        conditions.append("JSON_EXTRACT(key_metrics, %s) >= %s")
-                        params.append(field_path, value)
-                    elif key == "eps_max":
-                        conditions.append("JSON_EXTRACT(key_metrics, %s) <= %s")
-                        params.append(field_path, value)
-                    elif key == "eps_equals":
-                        conditions.append("JSON_EXTRACT(key_metrics, %s) = %s")
-                        params.append(field_path, value)
-                
-                elif key.startswith("debt_equity_"):
-                    field_path = "$..[?(@.Debt/Equity)]"
-                    if key == "debt_equity_min":
-                        conditions.append("JSON_EXTRACT(key_metrics, %s) >= %s")
-                        params.append(field_path, value)
-                    elif key == "debt_equity_max":
-                        conditions.append("JSON_EXTRACT(key_metrics, %s) <= %s")
-                        params.append(field_path, value)
-                    elif key == "debt_equity_equals":
-                        conditions.append("JSON_EXTRACT(key_metrics, %s) = %s")
-                        params.append(field_path, value)
-                
-                elif key.startswith("current_ratio_"):
-                    field_path = "$..[?(@.Current ratio)]"
-                    if key == "current_ratio_min":
-                        conditions.append("JSON_EXTRACT(key_metrics, %s) >= %s")
-                        params.append(field_path, value)
-                    elif key == "current_ratio_max":
-                        conditions.append("JSON_EXTRACT(key_metrics, %s) <= %s")
-                        params.append(field_path, value)
-                    elif key == "current_ratio_equals":
-                        conditions.append("JSON_EXTRACT(key_metrics, %s) = %s")
-                        params.append(field_path, value)
+            conditions, params = COMPANY_FILTERS.compile(sql_filters)
             
-            # Build the SQL query
-            sql = f"SELECT {', '.join(sql_columns)} FROM {table}"
-            if conditions:
-                sql += " WHERE " + " AND ".join(conditions)
-            sql += f" LIMIT {limit}"
-            
-            # Execute the query
-            result = execute_query(sql, tuple(params))
-            
-            # Process JSON fields in the results
-            if "results" in result and result["results"]:
-                for company in result["results"]:
-                    for field in ["key_metrics", "income_statement", "balance_sheet", "cashflow", 
-                                 "lenders_profile", "comparison", "borrowers_profile", 
-                                 "shareholding_profile", "key_personnel"]:
-                        if field in company and isinstance(company[field], str):
-                            try:
-                                company[field] = json.loads(company[field])
-                            except:
-                                pass
+            # Restrict to ranked text index hits and page through them in relevance order
+            sort = query_params.get("sort")
+            sort_expr = None
+            ranked_ids = []
+            text_matches = 0
+            if text_queries:
+                # Apply the structured filters first, so the hit cap only drops companies matching everything
+                candidates = None
+                if conditions:
+                    matching = execute_query(
+                        f"SELECT id FROM tap_bonds.{table} WHERE {' AND '.join(conditions)}", tuple(params), cache=True
+                    )
+                    if "error" in matching:
+                        return matching
+                    candidates = {row["id"] for row in matching["results"]}
+                hits = text_index.search_many(text_queries, candidates=candidates)
+                text_matches = len(hits)
+                ranked_ids = [doc_id for doc_id, _ in hits[:self.max_text_hits]]
+                if not ranked_ids:
+                    return {"count": 0, "results": [], "next_cursor": None}
+                placeholders = ', '.join(['%s'] * len(ranked_ids))
+                conditions.append(f"id IN ({placeholders})")
+                params.extend(ranked_ids)
+                sort, sort_expr = "relevance", f"FIELD(id, {placeholders})"
             
+            # Execute one keyset page; JSON columns are decoded only when a consumer reads them
+            result = fetch_page(
+                table, sql_columns, conditions, params,
+                filters=filters,
+                sort=sort,
+                cursor=query_params.get("cursor"),
+                limit=query_params.get("limit") or 5,
+                select_params=select_params,
+                sort_expr=sort_expr,
+                sort_params=ranked_ids,
+                json_columns=json_columns,
+                cache=True,
+            )
+            # Pages only reach the best max_text_hits matches; say so rather than drop the rest silently
+            if text_matches > self.max_text_hits and "error" not in result:
+                result["text_matches"] = text_matches
+                result["truncated"] = True
             return result
             
         except Exception as e:
             return {"error": f"Error executing query: {str(e)}"}
+
+    def build_projection(self, columns):
+        """
+        Translate requested columns into SELECT expressions.
+
+        Unknown columns are dropped so that only what was asked for is transferred.
+        "column.Key" entries on JSON columns become JSON_EXTRACT expressions, so a
+        caller needing one metric doesn't pull the whole document over the wire.
+
+        Returns:
+            tuple: (select expressions, params for the expressions, JSON result columns)
+        """
+        sql_columns = []
+        select_params = []
+        json_columns = []
+        seen = set()
+        
+        for col in columns or []:
+            if not isinstance(col, str) or col in seen:
+                continue
+            seen.add(col)
+            
+            if col in COMPANY_COLUMNS:
+                sql_columns.append(col)
+            elif col in COMPANY_JSON_COLUMNS:
+                sql_columns.append(col)
+                json_columns.append(col)
+            elif "." in col and col.split(".", 1)[0] in COMPANY_JSON_COLUMNS:
+                base, key = col.split(".", 1)
+                alias = col.replace("`", "").replace("%", "")
+                sql_columns.append(f"JSON_EXTRACT({base}, %s) AS `{alias}`")
+                select_params.append('$."' + key.replace('"', '\\"') + '"')
+                json_columns.append(alias)
+        
+        if not sql_columns:
+            sql_columns = ["company_name", "company_industry"]
+        
+        return sql_columns, select_params, json_columns
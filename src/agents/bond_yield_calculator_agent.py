@@ -1,21 +1,10 @@
-from langchain.chains import LLMChain
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain.prompts import PromptTemplate
-import json
-from dotenv import load_dotenv
-import os
-
-# Load environment variables from .env file
-load_dotenv()
+from src.utils.llm import DEFAULT_MODEL, LLM, PromptChain, PromptTemplate
+from src.utils import json_codec
 
 class BondYieldCalculatorAgent:
     def __init__(self, api_key=None):
         # Initialize LLM
-        self.llm = ChatGoogleGenerativeAI(
-            model="gemini-2.0-flash",
-            google_api_key=os.getenv("GAI_PS"),
-            temperature=0
-        )
+        self.llm = LLM(model=DEFAULT_MODEL, temperature=0, api_key=api_key, name="bond_yield_calculator")
         
         # Create master prompt
         template = """You are a Bond Yield Calculator Agent that helps users calculate bond yields and prices.
@@ -58,16 +47,14 @@ If essential information is missing, clearly state what additional data is neede
         
         self.prompt = PromptTemplate(template=template, input_variables=["query", "bond_data"])
         
-        # Update to use newer style (avoid deprecation warning)
-        from langchain_core.runnables import RunnableSequence
-        self.chain = RunnableSequence(self.prompt, self.llm)
+        self.chain = PromptChain(self.prompt, self.llm)
     
     def process_query(self, query, bond_data):
         """Process a bond yield calculator query and return a response."""
         try:
             # Format bond data if it's not already a string
             if not isinstance(bond_data, str):
-                bond_data_str = json.dumps(bond_data, indent=2)
+                bond_data_str = json_codec.dumps(bond_data, indent=2)
             else:
                 bond_data_str = bond_data
             
@@ -1,13 +1,63 @@
-from fastapi import FastAPI, HTTPException
+import time
+
+# Measured from the first line of the module so the reported startup includes imports
+_STARTED = time.perf_counter()
+
+import asyncio
+import hmac
+import itertools
+import os
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Header, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
+from .utils.config import load_env
+
+# Before the imports below, some of which read their settings at import time
+load_env()
+
 from .orchestrator import OrchestratorAgent
+from .utils import json_codec, llm, metrics
+from .utils.cache import get_cache
+from .agents.bond_screener_agent import QUERY_SCHEMA as SCREENER_SCHEMA
+from .utils.bond_queries import QUERY_PARTS, QUERY_SCHEMA, build_query
+from .utils.pagination import fetch_page
+from .utils.exporters import EXPORT_FORMATS
+from .utils.cashflow_calendar import CalendarError, cashflow_calendar
+from .utils.compute_pool import JobCancelled, shutdown_compute_pool, start_compute_pool
+from .utils import portfolios
+from .utils.query_profiler import PROFILER
+from .utils.scenarios import KEY_RATE_TENORS, PARALLEL_SHIFTS_BP, ScenarioError, prepare_grid
+from .utils.schemas import SchemaError
+from .utils.tidb_connector import stream_query
+
+class CodecJSONResponse(Response):
+    """JSON response encoded with json_codec (handles Decimal/date results, skips jsonable_encoder)."""
+    media_type = "application/json"
+
+    def render(self, content):
+        return json_codec.dumps_bytes(content)
 
-app = FastAPI()
-# Add CORS middleware to allow all origins for local development
+STARTUP_SECONDS = metrics.REGISTRY.gauge("tap_startup_seconds", "Seconds from module import until the app was ready to serve")
+
+@asynccontextmanager
+async def lifespan(app):
+    # The model client is built off the request path; set LLM_WARMUP=0 to build it on first use instead
+    llm.warm_up_in_background()
+    # Worker processes for CPU-bound analytics (COMPUTE_WORKERS, inline below 2)
+    start_compute_pool()
+    STARTUP_SECONDS.set(round(time.perf_counter() - _STARTED, 4))
+    try:
+        yield
+    finally:
+        shutdown_compute_pool()
+
+app = FastAPI(default_response_class=CodecJSONResponse, lifespan=lifespan)
+# Add CORS middleware to allow all origins for local development; no cookies, so no credentials
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # Allows all origins
-    allow_credentials=True,
+    allow_credentials=False,
     allow_methods=["*"],  # Allows all methods
     allow_headers=["*"],  # Allows all headers
 )
@@ -20,13 +70,223 @@ async def query(payload: dict):
     Accepts a JSON payload with a "query" key and returns the orchestrator's response.
     Example request payload:
         { "query": "Find bond with ISIN INE001A07QX9" }
+    Set "timings": true to get a per-stage timing breakdown back with the response.
     """
     if "query" not in payload:
         raise HTTPException(status_code=400, detail="Missing 'query' in request")
     
     query_text = payload["query"]
-    result = orchestrator.process_query(query_text)
-    return {"response": result}
+    llm.record_query(query_text)
+    with metrics.request_trace(payload.get("request_id")) as trace:
+        # The orchestrator blocks on gateway calls; to_thread copies the context, so
+        # spans recorded in the worker thread still land on this request's trace
+        result = await asyncio.to_thread(orchestrator.process_query, query_text)
+    
+    body = {"response": result}
+    if payload.get("timings"):
+        body["timings"] = trace.breakdown()
+    return CodecJSONResponse(body, headers={"X-Request-ID": trace.request_id})
+
+def _validated(schema, payload):
+    try:
+        return schema.validate(payload)
+    except SchemaError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def _page_response(result):
+    if "error" in result:
+        raise HTTPException(status_code=400, detail=result["error"])
+    return CodecJSONResponse(result)
+
+@app.post("/bonds")
+def list_bonds(payload: dict):
+    """
+    One page of bond_details or cashflows rows matching directory filters, without going through the LLM.
+    Example request payload:
+        { "table": "bond_details", "columns": ["isin", "coupon_rate"], "filters": {"secured": "Secured"},
+          "sort": "maturity_date", "limit": 50 }
+    Pass the returned "next_cursor" back as "cursor" (with the same table, sort and filters) for the next page.
+    """
+    if "next_query" in payload:
+        raise HTTPException(status_code=400, detail="Compound queries aren't supported here")
+    query_params = _validated(QUERY_SCHEMA, payload)
+    table = query_params["table"]
+    sql_columns, conditions, params = QUERY_PARTS[table](query_params.get("columns"), query_params.get("filters"))
+    return _page_response(fetch_page(
+        table, sql_columns, conditions, params,
+        filters=query_params.get("filters"),
+        sort=query_params.get("sort"),
+        cursor=query_params.get("cursor"),
+        limit=query_params.get("limit"),
+    ))
+
+@app.post("/companies")
+def list_companies(payload: dict):
+    """
+    One page of company_insights rows matching screener filters (same payload and paging as /bonds).
+    """
+    query_params = _validated(SCREENER_SCHEMA, payload)
+    return _page_response(orchestrator.bond_screener_agent.execute_optimized_query(query_params))
+
+@app.post("/bonds/export")
+def export_bonds(payload: dict):
+    """
+    Streams every bond_details or cashflows row matching directory filters, in constant memory.
+    Example request payload:
+        { "table": "bond_details", "columns": ["isin", "coupon_rate"], "filters": {"secured": "Secured"}, "format": "csv" }
+    "format" is "ndjson" (default) or "csv"; "limit" is optional.
+    """
+    export_format = payload.pop("format", "ndjson")
+    if export_format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported format '{export_format}' (expected ndjson or csv)")
+    if "next_query" in payload:
+        raise HTTPException(status_code=400, detail="Compound queries can't be exported")
+    query_params = _validated(QUERY_SCHEMA, payload)
+    
+    sql, params = build_query(query_params, limit=query_params.get("limit"))
+    chunks = stream_query(sql, tuple(params))
+    # Run the query before answering so connection and SQL errors still get an error status
+    try:
+        first = next(chunks, [])
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=f"Error executing query: {str(e)}")
+    
+    media_type, encode = EXPORT_FORMATS[export_format]
+    filename = f"{query_params['table']}.{export_format}"
+    return StreamingResponse(
+        encode(itertools.chain([first], chunks)),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+@app.post("/cashflows/calendar")
+def cashflows_calendar(payload: dict):
+    """
+    Coupons, redemptions and TDS per month, quarter or year, summed exactly across a set of holdings.
+    Example request payload:
+        { "holdings": [{"isin": "INE001A07QX9", "units": 100}, "INE002A08534"], "period": "quarter",
+          "start": "2025-04-01", "end": "2028-04-01" }
+    Without "holdings" the whole universe is aggregated; "source" ("actual" or "projected") is optional.
+    The range defaults to the next three years.
+    """
+    try:
+        return CodecJSONResponse(cashflow_calendar(
+            payload.get("holdings"),
+            start=payload.get("start"),
+            end=payload.get("end"),
+            period=payload.get("period", "month"),
+            source=payload.get("source"),
+        ))
+    except CalendarError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=f"Error executing query: {str(e)}")
+
+def _portfolio_call(fn, *args, **kwargs):
+    try:
+        return CodecJSONResponse(fn(*args, **kwargs))
+    except portfolios.PortfolioError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except portfolios.PortfolioNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=502, detail=str(e))
+
+@app.post("/portfolios")
+def create_portfolio(payload: dict):
+    """
+    Stores a portfolio and values its positions.
+    Example request payload:
+        { "name": "Core book", "positions": [{"isin": "INE001A07QX9", "units": 100, "cost": 1012.5,
+          "settlement_date": "2024-06-14"}] }
+    "cost" is per unit; analytics needing it (cost_yield, carrying_value, durations) are null without it.
+    """
+    return _portfolio_call(portfolios.create_portfolio, payload.get("name"), payload.get("positions"))
+
+@app.get("/portfolios/{portfolio_id}")
+def get_portfolio(portfolio_id: str):
+    """A portfolio with the precomputed analytics of its positions."""
+    return _portfolio_call(portfolios.get_portfolio, portfolio_id)
+
+@app.put("/portfolios/{portfolio_id}/positions")
+def replace_positions(portfolio_id: str, payload: dict):
+    """Replaces the positions of a portfolio (same "positions" payload as POST /portfolios)."""
+    return _portfolio_call(portfolios.replace_positions, portfolio_id, payload.get("positions"))
+
+@app.post("/scenarios")
+async def scenarios(payload: dict, request: Request):
+    """
+    Reprices a list of holdings under parallel yield shifts and key-rate bumps.
+    Example request payload:
+        { "holdings": [{"isin": "INE001A07QX9", "units": 100, "yield": 8.1}],
+          "shifts_bp": [-100, -50, 50, 100], "key_rate_bp": 25, "as_of": "2025-04-01" }
+    "yield" (%) defaults to the coupon rate. "key_rate_tenors" (years) and custom "scenarios"
+    ({"name", "parallel_bp", "key_rates_bp": {tenor: bp}}) are optional.
+    The grid is priced on the compute pool and abandoned if the client disconnects.
+    """
+    try:
+        grid = await asyncio.to_thread(
+            prepare_grid,
+            payload.get("holdings"),
+            shifts_bp=payload.get("shifts_bp", PARALLEL_SHIFTS_BP),
+            key_rate_tenors=payload.get("key_rate_tenors", KEY_RATE_TENORS),
+            key_rate_bp=payload.get("key_rate_bp"),
+            custom=payload.get("scenarios", ()),
+            as_of=payload.get("as_of"),
+        )
+        # Small grids are priced inline by submit(), so it stays off the event loop too
+        job = await asyncio.to_thread(grid.submit)
+        return CodecJSONResponse(grid.result(await job.wait(request.is_disconnected)))
+    except (ScenarioError, TypeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=502, detail=f"Error loading cash flows: {str(e)}")
+    except JobCancelled:
+        # Nobody is left to read it (nginx's "client closed request")
+        return Response(status_code=499)
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Latency histograms and counters in the Prometheus text exposition format."""
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+def _require_admin(token):
+    """Admin endpoints need X-Admin-Token to match ADMIN_TOKEN; without ADMIN_TOKEN they are disabled."""
+    expected = os.getenv("ADMIN_TOKEN")
+    if not expected:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled (set ADMIN_TOKEN)")
+    if not token or not hmac.compare_digest(token.encode("utf-8"), expected.encode("utf-8")):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+@app.get("/admin/slow-queries")
+async def slow_queries(sort: str = "total_ms", limit: int = 50, slow_only: bool = False,
+                       x_admin_token: str = Header(default=None)):
+    """
+    Per-fingerprint SQL statistics from execute_query, worst first.
+    Statements slower than SLOW_QUERY_MS include their captured EXPLAIN output.
+    sort: total_ms, p95_ms, max_ms, mean_ms, count or slow_count
+    """
+    _require_admin(x_admin_token)
+    return CodecJSONResponse(PROFILER.report(sort=sort, limit=limit, slow_only=slow_only))
+
+@app.post("/admin/slow-queries/reset")
+async def reset_slow_queries(x_admin_token: str = Header(default=None)):
+    """Clear the collected SQL statistics."""
+    _require_admin(x_admin_token)
+    PROFILER.reset()
+    return CodecJSONResponse({"status": "success"})
+
+@app.post("/admin/portfolios/revalue")
+def revalue_portfolios(force: bool = False, x_admin_token: str = Header(default=None)):
+    """Recompute analytics of positions whose bonds, cash flows or valuation date changed (all with force)."""
+    _require_admin(x_admin_token)
+    return _portfolio_call(portfolios.revalue, force=force)
+
+@app.post("/admin/cache/invalidate")
+def invalidate_cache(x_admin_token: str = Header(default=None)):
+    """Start a new cache generation, e.g. after data was changed outside data_processing."""
+    _require_admin(x_admin_token)
+    return CodecJSONResponse({"status": "success", "generation": get_cache().bump_generation()})
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,68 @@
+"""
+Cold-start benchmark for the API worker.
+
+Imports src.app in fresh interpreters (no warm bytecode or module caches beyond
+what is on disk) and reports how long each took and which heavy third-party
+modules ended up loaded at import time.
+
+    python -m src.benchmarks.cold_start --runs 5 --output cold_start.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# Modules that should only be imported on first use, never at worker start
+HEAVY_MODULES = ["pandas", "numpy", "langchain", "langchain_core", "langchain_google_genai", "google.generativeai"]
+
+_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import src.app
+elapsed = time.perf_counter() - start
+print(json.dumps({{
+    "import_s": elapsed,
+    "loaded": [name for name in {heavy!r} if name in sys.modules],
+    "modules": len(sys.modules),
+}}))
+"""
+
+def measure_once(cwd, env):
+    """Import src.app in a new interpreter and return its probe report."""
+    output = subprocess.check_output(
+        [sys.executable, "-c", _PROBE.format(heavy=HEAVY_MODULES)], cwd=cwd, env=env
+    )
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure API worker import time in fresh processes")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters to start")
+    parser.add_argument("--output", default=None, help="Write the JSON report here instead of stdout")
+    args = parser.parse_args(argv)
+
+    root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+    env = dict(os.environ, LLM_WARMUP="0")
+    runs = [measure_once(root, env) for _ in range(args.runs)]
+    timings = sorted(run["import_s"] for run in runs)
+
+    report = {
+        "runs": args.runs,
+        "median_ms": round(statistics.median(timings) * 1000, 1),
+        "min_ms": round(timings[0] * 1000, 1),
+        "max_ms": round(timings[-1] * 1000, 1),
+        "modules_loaded": runs[-1]["modules"],
+        "heavy_modules_loaded": runs[-1]["loaded"],
+    }
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    return report
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
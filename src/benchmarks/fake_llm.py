@@ -0,0 +1,90 @@
+import random
+import threading
+import time
+from src.utils.llm import LLMMessage
+
+# Marker text identifying which prompt the model is answering
+ROLE_MARKERS = [
+    ("orchestrator", "You are an Orchestrator Agent"),
+    ("bond_directory", "You are a Bond Directory Agent"),
+    ("bond_screener", "You are a Bond Screener Agent"),
+    ("bond_yield_calculator", "You are a Bond Yield Calculator Agent"),
+    ("bond_finder", "You are a Bond Finder Agent"),
+    ("compile", "Original user query:"),
+]
+
+# Answers used when the active script doesn't provide one for a role
+DEFAULT_RESPONSES = {
+    "bond_yield_calculator": "Price: 101.25% of face value (benchmark stub).",
+    "bond_finder": "Top recommendation: the highest yielding AAA bond (benchmark stub).",
+    "compile": "## Summary\n\nCompiled benchmark response.",
+}
+
+class FakeRateLimitError(Exception):
+    """Quota error raised by FakeLLM, shaped like the 429 the real client raises."""
+
+    status_code = 429
+
+def detect_role(prompt_text):
+    """Return the agent role a rendered prompt belongs to."""
+    for role, marker in ROLE_MARKERS:
+        if marker in prompt_text:
+            return role
+    return "unknown"
+
+class FakeLLM:
+    """
+    Deterministic LLM transport for offline benchmarks (install with llm.set_transport).
+
+    Answers come from a per-thread script (role -> response text) installed with
+    `script()`, falling back to DEFAULT_RESPONSES. An optional latency (with
+    seeded jitter) simulates the network round trip of a real model, and
+    `error_rate` makes that fraction of calls fail with a 429.
+    """
+
+    def __init__(self, latency_ms=0.0, jitter_ms=0.0, seed=0, responses=None, error_rate=0.0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.responses = dict(DEFAULT_RESPONSES, **(responses or {}))
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+        self._local = threading.local()
+        self.calls = 0
+        self.errors = 0
+
+    def script(self, responses):
+        """Install role -> response overrides for the current thread."""
+        self._local.responses = responses
+        return self
+
+    def _sleep(self):
+        if not self.latency_ms and not self.jitter_ms:
+            return
+        with self._random_lock:
+            jitter = self._random.uniform(-self.jitter_ms, self.jitter_ms) if self.jitter_ms else 0.0
+        time.sleep(max(0.0, self.latency_ms + jitter) / 1000.0)
+
+    def _fails(self):
+        if not self.error_rate:
+            return False
+        with self._random_lock:
+            return self._random.random() < self.error_rate
+
+    def complete(self, model, temperature, prompt_text, hint=None, api_key=None, json_mode=False):
+        """Answer a prompt with the scripted response for its role."""
+        role = detect_role(prompt_text)
+        scripted = getattr(self._local, "responses", None) or {}
+        content = scripted.get(role, self.responses.get(role))
+        if content is None:
+            raise KeyError(f"No scripted response for role '{role}'")
+
+        self._sleep()
+        self.calls += 1
+        if self._fails():
+            self.errors += 1
+            raise FakeRateLimitError("429 Resource has been exhausted (benchmark stub)")
+        return LLMMessage(content)
+
+    def record_query(self, query):
+        pass
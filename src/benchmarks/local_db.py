@@ -0,0 +1,305 @@
+import json
+import os
+import random
+import re
+import sqlite3
+import tempfile
+import threading
+from datetime import date, timedelta
+from src.utils.bond_documents import decompress_document, document_rows, summary_fields
+from src.utils.bond_queries import BOND_JSON_FIELDS, NUMERIC_JSON_FIELDS
+
+# SQLite versions of the tables created by utils.data_processing.create_tables
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS tap_bonds.bond_details (
+        id TEXT PRIMARY KEY,
+        created_at TEXT, updated_at TEXT,
+        isin TEXT, company_name TEXT, issue_size REAL,
+        allotment_date TEXT, maturity_date TEXT,
+        %s
+    )
+    """ % ", ".join(f"{name} {'REAL' if name in NUMERIC_JSON_FIELDS else 'TEXT'}" for name in BOND_JSON_FIELDS),
+    "CREATE INDEX IF NOT EXISTS tap_bonds.bond_details_isin ON bond_details (isin)",
+    """
+    CREATE TABLE IF NOT EXISTS tap_bonds.bond_detail_documents (
+        bond_id TEXT NOT NULL, section TEXT NOT NULL, bytes INTEGER NOT NULL, payload BLOB NOT NULL,
+        PRIMARY KEY (bond_id, section)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS tap_bonds.cashflows (
+        id TEXT PRIMARY KEY,
+        isin TEXT, cash_flow_date TEXT, cash_flow_amount REAL, record_date TEXT,
+        principal_amount REAL, interest_amount REAL, tds_amount REAL, remaining_principal REAL,
+        state TEXT, source TEXT NOT NULL DEFAULT 'actual', created_at TEXT, updated_at TEXT
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS tap_bonds.cashflows_isin ON cashflows (isin)",
+    """
+    CREATE TABLE IF NOT EXISTS tap_bonds.company_insights (
+        id TEXT PRIMARY KEY,
+        created_at TEXT, updated_at TEXT,
+        company_name TEXT, company_industry TEXT, description TEXT,
+        key_metrics TEXT, income_statement TEXT, balance_sheet TEXT, cashflow TEXT, lenders_profile TEXT,
+        comparison TEXT, borrowers_profile TEXT, shareholding_profile TEXT,
+        pros TEXT, cons TEXT, key_personnel TEXT, news_and_events TEXT
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS tap_bonds.company_insights_name ON company_insights (company_name)",
+    """
+    CREATE TABLE IF NOT EXISTS tap_bonds.portfolios (
+        id TEXT PRIMARY KEY, name TEXT, created_at TEXT, updated_at TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS tap_bonds.portfolio_positions (
+        id TEXT PRIMARY KEY, portfolio_id TEXT NOT NULL, isin TEXT NOT NULL,
+        units REAL NOT NULL, cost REAL, settlement_date TEXT
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS tap_bonds.portfolio_positions_portfolio ON portfolio_positions (portfolio_id)",
+    """
+    CREATE TABLE IF NOT EXISTS tap_bonds.position_valuations (
+        position_id TEXT PRIMARY KEY, portfolio_id TEXT NOT NULL, fingerprint TEXT NOT NULL,
+        valued_at TEXT, analytics TEXT
+    )
+    """,
+    # Same keyset pagination indexes as data_processing.PAGINATION_INDEXES
+    "CREATE INDEX IF NOT EXISTS tap_bonds.bond_details_isin_id ON bond_details (isin, id)",
+    "CREATE INDEX IF NOT EXISTS tap_bonds.bond_details_maturity_id ON bond_details (maturity_date, id)",
+    "CREATE INDEX IF NOT EXISTS tap_bonds.cashflows_date_id ON cashflows (cash_flow_date, id)",
+    "CREATE INDEX IF NOT EXISTS tap_bonds.company_insights_name_id ON company_insights (company_name, id)",
+    "CREATE INDEX IF NOT EXISTS tap_bonds.cashflows_isin_date ON cashflows (isin, cash_flow_date)",
+]
+
+SECTORS = [("Financial Services", "Banking"), ("Financial Services", "NBFC"), ("Energy", "Power"),
+           ("Infrastructure", "Roads"), ("Real Estate", "Housing"), ("Industrials", "Capital Goods")]
+RATINGS = ["AAA", "AA+", "AA", "AA-", "A+", "A", "BBB"]
+WORDS = ["renewable", "energy", "solar", "wind", "lending", "retail", "housing", "finance", "infrastructure",
+         "growth", "strong", "balance", "sheet", "debt", "profitability", "rating", "upgrade", "downgrade",
+         "liquidity", "capital", "adequacy", "expansion", "margin", "pressure", "regulatory", "approval",
+         "acquisition", "merger", "dividend", "diversified", "portfolio", "asset", "quality", "stable"]
+
+_PLACEHOLDER_RE = re.compile(r"%s")
+_FIELD_RE = re.compile(r"FIELD\((\w+)((?:, \?)+)\)")
+# SQLite rejects function calls with more arguments than this
+_MAX_FUNCTION_ARGS = 127
+
+def _field_as_case(match):
+    column, placeholders = match.group(1), match.group(2).count("?")
+    if placeholders < _MAX_FUNCTION_ARGS:
+        return match.group(0)
+    whens = " ".join(f"WHEN ? THEN {position}" for position in range(1, placeholders + 1))
+    return f"(CASE {column} {whens} ELSE 0 END)"
+
+def _translate(sql):
+    """MySQL-flavoured SQL to SQLite: %s placeholders, and long FIELD() lists as CASE expressions."""
+    return _FIELD_RE.sub(_field_as_case, _PLACEHOLDER_RE.sub("?", sql))
+
+def _field(*args):
+    """SQLite implementation of MySQL FIELD(value, v1, v2, ...)."""
+    value = args[0]
+    for position, candidate in enumerate(args[1:], start=1):
+        if candidate == value:
+            return position
+    return 0
+
+def _isin(rng):
+    return "INE" + "".join(rng.choice("ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789") for _ in range(9))
+
+class LocalDatabase:
+    """
+    SQLite-backed stand-in for TiDB used by the offline benchmarks.
+
+    Tables live in an attached database named tap_bonds, so both qualified
+    (tap_bonds.bond_details) and unqualified table names in the agents' SQL
+    resolve. MySQL-style %s placeholders are translated and FIELD() and
+    UNCOMPRESS() are provided as functions. Each thread gets its own connection.
+    """
+
+    def __init__(self, path=None):
+        if path is None:
+            handle, path = tempfile.mkstemp(prefix="tap_bonds_bench_", suffix=".sqlite")
+            os.close(handle)
+        self.path = path
+        self.isins = []
+        self.company_names = []
+        self._local = threading.local()
+
+    def connect(self):
+        """Get this thread's connection."""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(":memory:")
+            connection.execute("ATTACH DATABASE ? AS tap_bonds", (self.path,))
+            connection.create_function("FIELD", -1, _field, deterministic=True)
+            connection.create_function("UNCOMPRESS", 1, decompress_document, deterministic=True)
+            self._local.connection = connection
+        return connection
+
+    def create_tables(self):
+        connection = self.connect()
+        for statement in SCHEMA:
+            connection.execute(statement)
+        connection.commit()
+
+    def execute(self, sql, params=None):
+        """Run a MySQL-flavoured statement and return rows as dicts (execute_query backend)."""
+        cursor = self.connect().execute(_translate(sql), tuple(params or ()))
+        if cursor.description is None:
+            return []
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    __call__ = execute
+
+    def write(self, statements):
+        """Run (sql, rows) write statements in one transaction (execute_write backend)."""
+        connection = self.connect()
+        affected = 0
+        try:
+            for sql, rows in statements:
+                if rows:
+                    affected += connection.executemany(_translate(sql), [tuple(row) for row in rows]).rowcount
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        return affected
+
+    def stream(self, sql, params=None, chunk_size=1000):
+        """Yield rows in chunks of row dicts (stream_query backend)."""
+        cursor = self.connect().execute(_translate(sql), tuple(params or ()))
+        if cursor.description is None:
+            return
+        columns = [column[0] for column in cursor.description]
+        try:
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield [dict(zip(columns, row)) for row in rows]
+        finally:
+            cursor.close()
+
+    def seed(self, bonds=1000, companies=None, seed=7, blob_bytes=2048):
+        """
+        Populate the tables with synthetic data.
+
+        Args:
+            bonds (int): Number of bonds; each gets a semi-annual cash flow schedule
+            companies (int, optional): Number of issuing companies (default bonds // 5)
+            seed (int): Random seed, so every run sees the same universe
+            blob_bytes (int): Padding added to key_documents_details to mimic large JSON blobs
+
+        Returns:
+            dict: Row counts per table
+        """
+        rng = random.Random(seed)
+        companies = companies or max(1, bonds // 5)
+        self.create_tables()
+        connection = self.connect()
+        for table in ("bond_details", "bond_detail_documents", "cashflows", "company_insights"):
+            connection.execute(f"DELETE FROM tap_bonds.{table}")
+
+        self.company_names = [f"{rng.choice(WORDS).upper()} {rng.choice(WORDS).upper()} LIMITED {n}" for n in range(companies)]
+        company_rows = []
+        for n, name in enumerate(self.company_names):
+            sector, industry = rng.choice(SECTORS)
+            company_rows.append((
+                f"company-{n}", "2025-01-01", "2025-01-01", name, industry,
+                " ".join(rng.choice(WORDS) for _ in range(60)),
+                json.dumps({"EPS": round(rng.uniform(-5, 60), 2), "Current ratio": round(rng.uniform(0.5, 3), 2),
+                            "Debt/Equity": round(rng.uniform(0, 8), 2)}),
+                json.dumps({"revenue": [rng.randint(100, 10000) for _ in range(5)]}),
+                json.dumps({"assets": [rng.randint(100, 10000) for _ in range(5)]}),
+                json.dumps({"operating": [rng.randint(-500, 5000) for _ in range(5)]}),
+                json.dumps([{"lender": rng.choice(WORDS), "share": rng.random()} for _ in range(5)]),
+                json.dumps([{"peer": rng.choice(self.company_names)} for _ in range(3)]),
+                json.dumps([]),
+                json.dumps({"promoters": rng.random()}),
+                " ".join(rng.choice(WORDS) for _ in range(20)),
+                " ".join(rng.choice(WORDS) for _ in range(20)),
+                json.dumps([{"name": f"Person {n}", "role": "CEO"}]),
+                " ".join(rng.choice(WORDS) for _ in range(40)),
+            ))
+        connection.executemany(
+            "INSERT INTO tap_bonds.company_insights VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            company_rows
+        )
+
+        padding = "x" * blob_bytes
+        self.isins = []
+        bond_rows = []
+        section_rows = []
+        cashflow_rows = []
+        for n in range(bonds):
+            isin = _isin(rng)
+            self.isins.append(isin)
+            sector, industry = rng.choice(SECTORS)
+            coupon_rate = round(rng.uniform(6.0, 12.0), 2)
+            face_value = rng.choice([1000, 10000, 100000])
+            allotment = date(2018, 1, 1) + timedelta(days=rng.randint(0, 2500))
+            maturity = allotment + timedelta(days=365 * rng.randint(1, 10))
+            documents = {
+                "issuer_details": json.dumps({"issuerTypeOwner": rng.choice(["PSU", "Non PSU"]), "sector": sector, "industry": industry}),
+                "instrument_details": json.dumps({"instrumentsVo": {"instruments": {"faceValue": face_value, "secured": rng.choice(["Secured", "Unsecured"])}}}),
+                "coupon_details": json.dumps({"coupensVo": {"couponDetails": {"couponRate": coupon_rate, "couponType": "Fixed",
+                                                                              "interestPaymentFrequency": "Semi-Annual",
+                                                                              "couponBasis": "Actual/Actual"}}}),
+                "redemption_details": json.dumps({"redemptionType": "Bullet", "putIndicator": "N", "callIndicator": "N"}),
+                "credit_rating_details": json.dumps({"currentRatings": {"currentRating": rng.choice(RATINGS), "outlook": "Stable"}}),
+                "listing_details": json.dumps({"listingDetails": {"exchangeName": rng.choice(["NSE", "BSE"])}}),
+                "key_contacts_details": json.dumps({"debtTrusteeName": "Benchmark Trustee Ltd"}),
+                "key_documents_details": json.dumps({"documents": padding}),
+            }
+            bond_rows.append((
+                f"bond-{n}", "2025-01-01", "2025-01-01", isin, rng.choice(self.company_names),
+                round(rng.uniform(10, 5000), 2), allotment.isoformat(), maturity.isoformat(),
+            ) + tuple(summary_fields(documents).values()))
+            section_rows.extend(document_rows(f"bond-{n}", documents))
+
+            coupon = face_value * coupon_rate / 200
+            flow_date = allotment
+            flow_number = 0
+            while True:
+                flow_date = flow_date + timedelta(days=182)
+                final = flow_date >= maturity
+                if final:
+                    flow_date = maturity
+                principal = face_value if final else 0
+                cashflow_rows.append((
+                    f"cf-{n}-{flow_number}", isin, flow_date.isoformat(), round(coupon + principal, 4),
+                    (flow_date - timedelta(days=15)).isoformat(), principal, round(coupon, 4), 0,
+                    0 if final else face_value, "active", "2025-01-01", "2025-01-01",
+                ))
+                flow_number += 1
+                if final:
+                    break
+
+        connection.executemany(
+            f"INSERT INTO tap_bonds.bond_details VALUES ({', '.join(['?'] * len(bond_rows[0]))})", bond_rows
+        )
+        connection.executemany("INSERT INTO tap_bonds.bond_detail_documents VALUES (?, ?, ?, ?)", section_rows)
+        connection.executemany(
+            "INSERT INTO tap_bonds.cashflows (id, isin, cash_flow_date, cash_flow_amount, record_date, principal_amount, "
+            "interest_amount, tds_amount, remaining_principal, state, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            cashflow_rows
+        )
+        connection.commit()
+        return {"bond_details": len(bond_rows), "bond_detail_documents": len(section_rows),
+                "cashflows": len(cashflow_rows), "company_insights": len(company_rows)}
+
+    def company_texts(self):
+        """Yield (id, updated_at, texts) for building a text index over the seeded companies."""
+        rows = self.execute("SELECT id, updated_at, description, news_and_events, pros, cons FROM company_insights")
+        for row in rows:
+            yield row["id"], row["updated_at"], row
+
+    def close(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
@@ -0,0 +1,120 @@
+"""
+Replay recorded /query traffic against the current build.
+
+Queries and model responses captured with LLM_TRANSPORT=record are served from
+the cassette, so only the non-LLM work (planning glue, SQL, serialization) is
+measured. Runs against TiDB by default, or a seeded local stand-in with
+--local-bonds.
+
+    python -m src.benchmarks.replay --cassette data/llm_cassette.jsonl --clients 1,8 --output replay.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from src.benchmarks.local_db import LocalDatabase
+from src.benchmarks.run import STAGES, StageRecorder, _git_commit, _instrument, summarize
+from src.utils import llm as llm_module, tidb_connector
+from src.utils.llm_gateway import LLMGateway, set_gateway
+
+def replay_level(clients, queries, transport, recorder_backend):
+    """Replay every query once, spread over `clients` concurrent orchestrators."""
+    from src.orchestrator import OrchestratorAgent
+
+    recorder = StageRecorder()
+    llm_module.set_transport(transport)
+    orchestrators = [_instrument(OrchestratorAgent(), recorder) for _ in range(clients)]
+
+    def backend(sql, params):
+        with recorder.timed("agent_sql"):
+            return recorder_backend(sql, params)
+
+    tidb_connector.set_query_backend(backend)
+    errors = []
+
+    def client(worker):
+        orchestrator = orchestrators[worker]
+        for position in range(worker, len(queries), clients):
+            recorder.begin()
+            with recorder.timed("end_to_end"):
+                result = orchestrator.process_query(queries[position])
+            recorder.end()
+            if "error" in result:
+                errors.append(result["error"])
+
+    hits, misses = transport.hits, transport.misses
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        with ThreadPoolExecutor(max_workers=clients) as pool:
+            list(pool.map(client, range(clients)))
+    wall = time.perf_counter() - start
+    tidb_connector.set_query_backend(None)
+    llm_module.set_transport(None)
+
+    return {
+        "clients": clients,
+        "requests": len(queries),
+        "errors": len(errors),
+        "sample_errors": sorted(set(errors))[:5],
+        "cassette_hits": transport.hits - hits,
+        "cassette_misses": transport.misses - misses,
+        "wall_s": round(wall, 4),
+        "qps": round(len(queries) / wall, 2) if wall else 0.0,
+        "stages": {stage: summarize(recorder.samples[stage], wall) for stage in STAGES},
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay recorded /query traffic from an LLM cassette")
+    parser.add_argument("--cassette", default=llm_module.DEFAULT_CASSETTE_PATH)
+    parser.add_argument("--clients", default="1", help="Comma-separated concurrency levels")
+    parser.add_argument("--repeat", type=int, default=1, help="Replay the recorded traffic this many times")
+    parser.add_argument("--latency", default=None, help='Simulated LLM latency: milliseconds or "recorded"')
+    parser.add_argument("--on-miss", default="stub", choices=["stub", "error"],
+                        help="What to do when a prompt isn't in the cassette")
+    parser.add_argument("--local-bonds", type=int, default=None,
+                        help="Run against a seeded SQLite stand-in with this many bonds instead of TiDB")
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args(argv)
+
+    cassette = llm_module.Cassette(args.cassette)
+    queries = cassette.queries() * args.repeat
+    if not queries:
+        parser.error(f"No recorded queries in {args.cassette}")
+
+    if args.local_bonds:
+        db = LocalDatabase()
+        db.seed(bonds=args.local_bonds)
+        backend = db.execute
+    else:
+        backend = tidb_connector.fetch_rows
+
+    transport = llm_module.ReplayTransport(cassette, latency=args.latency, on_miss=args.on_miss)
+    # Replayed calls never reach the model, so its quota limits don't apply
+    set_gateway(LLMGateway(max_concurrency=None, rate_per_s=None))
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "cassette": args.cassette,
+            "recorded_calls": len(cassette),
+            "recorded_queries": len(cassette.queries()),
+            "latency": args.latency,
+            "database": f"local:{args.local_bonds}" if args.local_bonds else "tidb",
+        },
+        "runs": [replay_level(int(clients), queries, transport, backend) for clients in args.clients.split(",")],
+    }
+
+    set_gateway(None)
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    return report
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
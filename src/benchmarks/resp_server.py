@@ -0,0 +1,151 @@
+"""
+Local stand-in for a Redis server, enough for CACHE_BACKEND=resp.
+
+Speaks RESP and implements the commands the cache uses (PING, AUTH, SELECT,
+GET, SET [EX|PX], DEL, INCR, DBSIZE, FLUSHDB) on one dict, with expiry checked
+on access. Lets several uvicorn workers or benchmark processes share a cache
+without installing Redis.
+
+    python -m src.benchmarks.resp_server --port 6380
+    CACHE_BACKEND=resp CACHE_URL=redis://127.0.0.1:6380/0 uvicorn src.app:app --workers 4
+"""
+import argparse
+import socketserver
+import threading
+import time
+
+class _Store:
+    def __init__(self):
+        self.values = {}
+        self.expires = {}
+        self.lock = threading.Lock()
+
+    def live(self, key):
+        expires = self.expires.get(key)
+        if expires is not None and expires <= time.monotonic():
+            self.values.pop(key, None)
+            self.expires.pop(key, None)
+        return key in self.values
+
+def _encode(value):
+    if value is None:
+        return b"$-1\r\n"
+    if value is True:
+        return b"+OK\r\n"
+    if isinstance(value, str):
+        return b"+%s\r\n" % value.encode("utf-8")
+    if isinstance(value, int):
+        return b":%d\r\n" % value
+    if isinstance(value, Exception):
+        return b"-ERR %s\r\n" % str(value).encode("utf-8")
+    return b"$%d\r\n%s\r\n" % (len(value), value)
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        while True:
+            try:
+                args = self._read_command()
+            except (ValueError, ConnectionError):
+                return
+            if args is None:
+                return
+            try:
+                reply = self.server.execute(args)
+            except Exception as e:
+                reply = e
+            self.wfile.write(_encode(reply))
+
+    def _read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if not line.startswith(b"*"):
+            # Inline command (e.g. typed into telnet)
+            return line.split()
+        args = []
+        for _ in range(int(line[1:])):
+            length = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+class RespServer(socketserver.ThreadingTCPServer):
+    """
+    Threaded Redis-protocol server over a single in-memory keyspace.
+
+    Args:
+        address (tuple): (host, port); port 0 picks a free one (see .url)
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address=("127.0.0.1", 0)):
+        super().__init__(address, _Handler)
+        self.store = _Store()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"redis://{host}:{port}/0"
+
+    def start(self):
+        """Serve on a daemon thread; returns self."""
+        threading.Thread(target=self.serve_forever, name="resp-server", daemon=True).start()
+        return self
+
+    def execute(self, args):
+        command = args[0].decode("utf-8").upper()
+        store = self.store
+        with store.lock:
+            if command == "PING":
+                return "PONG"
+            if command in ("AUTH", "SELECT"):
+                return True
+            if command == "GET":
+                return store.values[args[1]] if store.live(args[1]) else None
+            if command == "SET":
+                key, value = args[1], args[2]
+                store.values[key] = value
+                store.expires.pop(key, None)
+                options = [arg.decode("utf-8").upper() for arg in args[3:]]
+                if options:
+                    scale = {"EX": 1.0, "PX": 0.001}[options[0]]
+                    store.expires[key] = time.monotonic() + int(options[1]) * scale
+                return True
+            if command == "DEL":
+                removed = 0
+                for key in args[1:]:
+                    if store.live(key):
+                        removed += 1
+                    store.values.pop(key, None)
+                    store.expires.pop(key, None)
+                return removed
+            if command == "INCR":
+                value = int(store.values[args[1]]) + 1 if store.live(args[1]) else 1
+                store.values[args[1]] = str(value).encode("ascii")
+                return value
+            if command == "DBSIZE":
+                return sum(1 for key in list(store.values) if store.live(key))
+            if command == "FLUSHDB":
+                store.values.clear()
+                store.expires.clear()
+                return True
+        raise ValueError(f"unknown command '{command}'")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a local Redis-protocol stand-in for CACHE_BACKEND=resp")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6380)
+    args = parser.parse_args(argv)
+
+    server = RespServer((args.host, args.port))
+    print(f"Serving {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,349 @@
+"""
+Offline end-to-end benchmark for the /query pipeline.
+
+Runs the real orchestrator and agents against a deterministic fake LLM and a
+seeded SQLite stand-in for TiDB, then reports per-stage latency percentiles
+and throughput for one or more client concurrency levels.
+
+    python -m src.benchmarks.run --bonds 5000 --requests 200 --clients 1,4,16 --output bench.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# utils.text_index resolves its path at import time
+os.environ.setdefault("TEXT_INDEX_PATH", os.path.join(tempfile.gettempdir(), "tap_bonds_bench_text_index.json"))
+
+from src.benchmarks.fake_llm import FakeLLM
+from src.benchmarks.local_db import LocalDatabase
+from src.benchmarks.resp_server import RespServer
+from src.utils import llm as llm_module, tidb_connector
+from src.utils.cache import CACHE_REQUESTS, Cache, MemoryBackend, NullBackend, RespBackend, set_cache
+from src.utils.llm_gateway import LLMGateway, set_gateway
+from src.utils.text_index import TextIndex, TEXT_FILTER_FIELDS
+
+STAGES = ["plan", "agent_sql", "compile", "end_to_end"]
+
+def _plan(*steps, instructions="Summarise the results."):
+    return json.dumps({
+        "plan": [
+            {"agent": agent, "query": query, "needs_previous_output": agent in ("bond_yield_calculator", "bond_finder")}
+            for agent, query in steps
+        ],
+        "final_compilation_instructions": instructions,
+    })
+
+def build_scenarios():
+    """
+    Canned request scripts. Each returns (user query, role -> LLM response) for a
+    randomly chosen ISIN/company so requests differ but stay reproducible.
+    """
+    def isin_lookup(rng, db):
+        isin = rng.choice(db.isins)
+        return f"Show details and cash flows for {isin}", {
+            "orchestrator": _plan(("bond_directory", f"Get details and cash flows for {isin}")),
+            "bond_directory": json.dumps({
+                "table": "bond_details",
+                "columns": ["isin", "company_name", "coupon_rate", "face_value", "maturity_date"],
+                "filters": {"isin": isin},
+                "limit": 1,
+                "compound": True,
+                "next_query": {
+                    "table": "cashflows",
+                    "columns": ["cash_flow_date", "cash_flow_amount"],
+                    "filters": {"isin": "RESULT_FROM_QUERY_1.isin"},
+                    "limit": 5,
+                },
+            }),
+        }
+
+    def coupon_screen(rng, db):
+        rate = rng.choice([7, 8, 9, 10])
+        return f"Find secured bonds with coupon above {rate}%", {
+            "orchestrator": _plan(("bond_directory", f"Secured bonds with coupon rate above {rate}%")),
+            "bond_directory": json.dumps({
+                "table": "bond_details",
+                "columns": ["isin", "company_name", "coupon_rate", "credit_rating"],
+                "filters": {"coupon_rate_min": rate, "secured": "Secured"},
+                "limit": 10,
+                "compound": False,
+            }),
+        }
+
+    def company_text_search(rng, db):
+        term = rng.choice(["renewable energy", "strong balance", "liquidity", "\"capital adequacy\""])
+        return f"Which issuers mention {term}?", {
+            "orchestrator": _plan(("bond_screener", f"Companies whose description mentions {term}")),
+            "bond_screener": json.dumps({
+                "table": "company_insights",
+                "columns": ["company_name", "company_industry", "key_metrics.EPS"],
+                "filters": {"description_contains": term},
+                "limit": 5,
+            }),
+        }
+
+    def yield_calculation(rng, db):
+        isin = rng.choice(db.isins)
+        return f"Price {isin} at 9% yield", {
+            "orchestrator": _plan(
+                ("bond_directory", f"Get cash flows for {isin}"),
+                ("bond_yield_calculator", f"Price {isin} at a 9% yield"),
+            ),
+            "bond_directory": json.dumps({
+                "table": "cashflows",
+                "columns": ["isin", "cash_flow_date", "cash_flow_amount", "principal_amount", "interest_amount"],
+                "filters": {"isin": isin},
+                "limit": 10,
+                "compound": False,
+            }),
+        }
+
+    return {
+        "isin_lookup": isin_lookup,
+        "coupon_screen": coupon_screen,
+        "company_text_search": company_text_search,
+        "yield_calculation": yield_calculation,
+    }
+
+class StageRecorder:
+    """Collects per-request stage durations from instrumented components (thread-safe)."""
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.samples = {stage: [] for stage in STAGES}
+
+    def begin(self):
+        self._local.current = {stage: 0.0 for stage in STAGES}
+
+    def add(self, stage, seconds):
+        current = getattr(self._local, "current", None)
+        if current is not None:
+            current[stage] += seconds
+
+    def end(self):
+        current = self._local.current
+        self._local.current = None
+        with self._lock:
+            for stage, seconds in current.items():
+                self.samples[stage].append(seconds)
+
+    @contextlib.contextmanager
+    def timed(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start)
+
+def percentile(sorted_values, fraction):
+    """Linear-interpolated percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    position = (len(sorted_values) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+def summarize(samples, wall_seconds):
+    """Latency percentiles (ms) and throughput for one stage."""
+    values = sorted(samples)
+    return {
+        "count": len(values),
+        "mean_ms": round(sum(values) / len(values) * 1000, 3) if values else 0.0,
+        "p50_ms": round(percentile(values, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(values, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(values, 0.99) * 1000, 3),
+        "qps": round(len(values) / wall_seconds, 2) if wall_seconds else 0.0,
+    }
+
+def _instrument(orchestrator, recorder):
+    """Wrap the orchestrator's plan chain and compile step with stage timers."""
+    plan_chain = orchestrator.chain
+    compile_response = orchestrator._compile_final_response
+
+    class TimedChain:
+        def invoke(self, inputs):
+            with recorder.timed("plan"):
+                return plan_chain.invoke(inputs)
+
+    def timed_compile(*args, **kwargs):
+        with recorder.timed("compile"):
+            return compile_response(*args, **kwargs)
+
+    orchestrator.chain = TimedChain()
+    orchestrator._compile_final_response = timed_compile
+    return orchestrator
+
+def build_text_index(db):
+    """Index the seeded companies so screener text filters hit the BM25 path."""
+    index = TextIndex(fields=TEXT_FILTER_FIELDS.values())
+    for doc_id, version, texts in db.company_texts():
+        index.upsert(doc_id, texts, version=version)
+    index.save(os.environ["TEXT_INDEX_PATH"])
+    return len(index)
+
+def _cache_results():
+    """Shared cache lookups so far, by result (hit/miss)."""
+    totals = {"hit": 0, "miss": 0}
+    for _, (namespace, result), value in CACHE_REQUESTS.samples():
+        totals[result] = totals.get(result, 0) + value
+    return totals
+
+def _sql_cache_results():
+    """In-process SQL result cache lookups so far, by result (hit/miss/stale)."""
+    return {labels[0]: value for _, labels, value in tidb_connector.SQL_CACHE_REQUESTS.samples()}
+
+def run_level(clients, requests, llm, db, scenarios, seed, cache=None):
+    """Run `requests` queries spread over `clients` concurrent orchestrators, starting from an empty cache."""
+    from src.orchestrator import OrchestratorAgent
+
+    cache = cache or Cache(NullBackend())
+    cache.backend.clear()
+    set_cache(cache)
+    cache_before = _cache_results()
+    sql_cache_before = _sql_cache_results()
+
+    recorder = StageRecorder()
+    llm_module.set_transport(llm)
+    orchestrators = [_instrument(OrchestratorAgent(), recorder) for _ in range(clients)]
+
+    def backend(sql, params):
+        with recorder.timed("agent_sql"):
+            return db.execute(sql, params)
+
+    tidb_connector.set_query_backend(backend)
+
+    names = sorted(scenarios)
+    errors = []
+
+    def client(worker):
+        rng = random.Random(seed * 1000 + worker)
+        orchestrator = orchestrators[worker]
+        for _ in range(worker, requests, clients):
+            query, script = scenarios[names[rng.randrange(len(names))]](rng, db)
+            llm.script(script)
+            recorder.begin()
+            with recorder.timed("end_to_end"):
+                result = orchestrator.process_query(query)
+            recorder.end()
+            if "error" in result:
+                errors.append(result["error"])
+
+    start = time.perf_counter()
+    # The agents print debug output for every call; keep it out of the measurements
+    with contextlib.redirect_stdout(io.StringIO()):
+        with ThreadPoolExecutor(max_workers=clients) as pool:
+            list(pool.map(client, range(clients)))
+    wall = time.perf_counter() - start
+    tidb_connector.set_query_backend(None)
+    llm_module.set_transport(None)
+    set_cache(None)
+    cache_after = _cache_results()
+    sql_cache_after = _sql_cache_results()
+
+    return {
+        "clients": clients,
+        "requests": requests,
+        "errors": len(errors),
+        "cache": {result: cache_after[result] - cache_before.get(result, 0) for result in cache_after},
+        "sql_result_cache": {result: value - sql_cache_before.get(result, 0) for result, value in sql_cache_after.items()},
+        "sample_errors": sorted(set(errors))[:5],
+        "wall_s": round(wall, 4),
+        "qps": round(requests / wall, 2) if wall else 0.0,
+        "stages": {stage: summarize(recorder.samples[stage], wall) for stage in STAGES},
+    }
+
+def _git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline latency/throughput benchmark for the query pipeline")
+    parser.add_argument("--bonds", type=int, default=1000, help="Synthetic bonds to seed")
+    parser.add_argument("--companies", type=int, default=None, help="Synthetic companies (default bonds/5)")
+    parser.add_argument("--blob-bytes", type=int, default=2048, help="Padding per bond JSON document")
+    parser.add_argument("--requests", type=int, default=100, help="Queries per concurrency level")
+    parser.add_argument("--clients", default="1,4", help="Comma-separated concurrency levels")
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0, help="Simulated latency per LLM call")
+    parser.add_argument("--llm-jitter-ms", type=float, default=0.0, help="Uniform +/- jitter on the latency")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0, help="Fraction of LLM calls failing with a 429")
+    parser.add_argument("--llm-max-concurrency", type=int, default=None, help="Gateway concurrency cap (default: none)")
+    parser.add_argument("--llm-rate", type=float, default=None, help="Gateway calls per second (default: unlimited)")
+    parser.add_argument("--scenarios", default=None, help="Comma-separated subset of scenarios")
+    parser.add_argument("--cache", choices=["none", "memory", "resp"], default="none",
+                        help="Shared cache backend (resp starts a local stand-in server)")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--db-path", default=None, help="SQLite file to use (default: temporary file)")
+    parser.add_argument("--output", default=None, help="Write the JSON report here instead of stdout")
+    args = parser.parse_args(argv)
+
+    scenarios = build_scenarios()
+    if args.scenarios:
+        scenarios = {name: scenarios[name] for name in args.scenarios.split(",")}
+
+    db = LocalDatabase(args.db_path)
+    seeded = db.seed(bonds=args.bonds, companies=args.companies, seed=args.seed, blob_bytes=args.blob_bytes)
+    indexed = build_text_index(db)
+    llm = FakeLLM(latency_ms=args.llm_latency_ms, jitter_ms=args.llm_jitter_ms, seed=args.seed, error_rate=args.llm_error_rate)
+    # Limits are off unless requested so the default run measures the pipeline, not the quota
+    set_gateway(LLMGateway(max_concurrency=args.llm_max_concurrency, rate_per_s=args.llm_rate,
+                           burst=max(1, int(args.llm_rate or 1)), backoff_base_s=0.05))
+    resp_server = RespServer().start() if args.cache == "resp" else None
+    cache = {
+        "none": lambda: Cache(NullBackend()),
+        "memory": lambda: Cache(MemoryBackend()),
+        "resp": lambda: Cache(RespBackend(resp_server.url)),
+    }[args.cache]()
+
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "seed": args.seed,
+            "rows": seeded,
+            "text_index_docs": indexed,
+            "llm_latency_ms": args.llm_latency_ms,
+            "llm_jitter_ms": args.llm_jitter_ms,
+            "llm_error_rate": args.llm_error_rate,
+            "llm_max_concurrency": args.llm_max_concurrency,
+            "llm_rate": args.llm_rate,
+            "scenarios": sorted(scenarios),
+            "cache": args.cache,
+        },
+        "runs": [
+            run_level(int(clients), args.requests, llm, db, scenarios, args.seed, cache)
+            for clients in args.clients.split(",")
+        ],
+    }
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+    set_gateway(None)
+    if resp_server is not None:
+        resp_server.shutdown()
+        resp_server.server_close()
+    if args.db_path is None:
+        db.close()
+        os.remove(db.path)
+    return report
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
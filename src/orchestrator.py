@@ -1,31 +1,23 @@
-from langchain.chains import LLMChain
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain.prompts import PromptTemplate
-import json
-import os
-from dotenv import load_dotenv
+from src.utils.llm import DEFAULT_MODEL, LLM, PromptChain, PromptTemplate, response_text
+from src.utils import json_codec
+from src.utils.cache import get_cache
+from src.utils.schemas import parse_structured, validate_plan
+from src.utils.metrics import span
 from src.agents.bond_directory_agent import BondDirectoryAgent
 from src.agents.bond_screener_agent import BondScreenerAgent
 from src.agents.bond_yield_calculator_agent import BondYieldCalculatorAgent
 from src.agents.bond_finder_agent import BondFinderAgent
 
-# Load environment variables
-load_dotenv()
-
 class OrchestratorAgent:
     def __init__(self, api_key=None):
         # Initialize LLM
-        self.llm = ChatGoogleGenerativeAI(
-            model="gemini-2.0-flash",
-            google_api_key=os.getenv("GAI_PS", api_key),
-            temperature=0.1
-        )
+        self.llm = LLM(model=DEFAULT_MODEL, temperature=0.1, api_key=api_key, name="orchestrator")
         
         # Initialize specialized agents
-        self.bond_directory_agent = BondDirectoryAgent()
-        self.bond_screener_agent = BondScreenerAgent()
-        self.bond_yield_calculator_agent = BondYieldCalculatorAgent()
-        self.bond_finder_agent = BondFinderAgent()
+        self.bond_directory_agent = BondDirectoryAgent(api_key)
+        self.bond_screener_agent = BondScreenerAgent(api_key)
+        self.bond_yield_calculator_agent = BondYieldCalculatorAgent(api_key)
+        self.bond_finder_agent = BondFinderAgent(api_key)
         
         # Create master prompt for orchestration
         template = """You are an Orchestrator Agent for the Tap Bonds platform, responsible for routing user queries to specialized agents and compiling their responses.
@@ -75,42 +67,31 @@ Output the JSON plan only, nothing else.
 """
         
         self.prompt = PromptTemplate(template=template, input_variables=["query"])
-        from langchain_core.runnables import RunnableSequence
-        self.chain = RunnableSequence(self.prompt, self.llm)
-        
-        # Store for accumulated results
-        self.agent_results = []
+        self.chain = PromptChain(self.prompt, self.llm, json_mode=True)
     
     def process_query(self, query):
-        """Process a user query through the orchestrator."""
+        """
+        Process a user query through the orchestrator.
+
+        Safe to call from several threads at once: everything a query accumulates
+        lives on the call stack, not on the shared agents.
+        """
         try:
-            # Reset agent results at the start of a new query
-            self.agent_results = []
-            
-            # Get orchestration plan from LLM
-            response = self.chain.invoke({"query": query})
-            
-            # Extract content from response
-            json_str = None
-            if hasattr(response, "content"):
-                json_str = response.content
-            elif isinstance(response, dict) and "text" in response:
-                json_str = response["text"]
-            elif isinstance(response, str):
-                json_str = response
-            else:
-                json_str = str(response)
-            
-            # Clean up the markdown code block formatting
-            if json_str.startswith("```"):
-                # Extract just the JSON part between the code block markers
-                lines = json_str.split("\n")
-                # Remove first line (```json) and last line (```
-                clean_lines = lines[1:-1] if len(lines) > 2 else lines
-                json_str = "\n".join(clean_lines)
-            
-            # Parse the JSON response
-            orchestration_plan = json.loads(json_str)
+            # Plans are shared by every worker through the cache; the key includes the
+            # prompt so a changed template doesn't reuse plans made for the old one
+            cache = get_cache()
+            plan_key = (self.llm.model, self.prompt.template, query)
+            orchestration_plan = cache.get("plan", plan_key)
+            if orchestration_plan is None:
+                # Get orchestration plan from LLM
+                with span("plan", component="orchestrator"):
+                    response = self.chain.invoke({"query": query})
+                
+                # Parse and validate the plan, repairing only the invalid part if needed
+                orchestration_plan = parse_structured(
+                    response_text(response), validate_plan, self.llm, component="orchestrator", task="orchestration plan"
+                )
+                cache.set("plan", plan_key, orchestration_plan)
             
             # Execute the plan
             return self.execute_plan(orchestration_plan, query)
@@ -121,6 +102,8 @@ Output the JSON plan only, nothing else.
     def execute_plan(self, plan, original_query):
         """Execute the orchestration plan by calling agents in sequence."""
         previous_results = {}
+        # Accumulated results of this query, handed to the compilation step
+        agent_results = []
         
         # Execute each agent call in the plan
         for i, agent_call in enumerate(plan["plan"]):
@@ -129,21 +112,25 @@ Output the JSON plan only, nothing else.
             needs_previous_output = agent_call["needs_previous_output"]
             
             # Call the appropriate agent
-            if agent_name == "bond_directory":
-                result = self.bond_directory_agent.process_query(agent_query)
-            elif agent_name == "bond_screener":
-                result = self.bond_screener_agent.process_query(agent_query)
-            elif agent_name == "bond_yield_calculator":
-                # Bond Yield Calculator needs previous results
-                result = self.bond_yield_calculator_agent.process_query(agent_query, previous_results)
-            elif agent_name == "bond_finder":
-                # Bond Finder needs previous results
-                result = self.bond_finder_agent.process_query(agent_query, previous_results)
-            else:
-                result = {"error": f"Unknown agent: {agent_name}"}
+            with span("agent", component=agent_name, step=i):
+                if agent_name == "bond_directory":
+                    # A compound lookup earlier in this plan gives the next one its first part as context
+                    earlier = previous_results.get("bond_directory")
+                    prev_res = json_codec.dumps(earlier["data_part_1"]) if isinstance(earlier, dict) and "data_part_1" in earlier else ""
+                    result = self.bond_directory_agent.process_query(agent_query, prev_res)
+                elif agent_name == "bond_screener":
+                    result = self.bond_screener_agent.process_query(agent_query)
+                elif agent_name == "bond_yield_calculator":
+                    # Bond Yield Calculator needs previous results
+                    result = self.bond_yield_calculator_agent.process_query(agent_query, previous_results)
+                elif agent_name == "bond_finder":
+                    # Bond Finder needs previous results
+                    result = self.bond_finder_agent.process_query(agent_query, previous_results)
+                else:
+                    result = {"error": f"Unknown agent: {agent_name}"}
             
             # Append the result to agent_results (instead of overwriting)
-            self.agent_results.append({
+            agent_results.append({
                 "agent": agent_name,
                 "query": agent_query,
                 "result": result
@@ -153,18 +140,20 @@ Output the JSON plan only, nothing else.
             previous_results[agent_name] = result
         
         # Compile the final response
-        final_response = self._compile_final_response(plan["final_compilation_instructions"], original_query)
+        with span("compile", component="orchestrator"):
+            final_response = self._compile_final_response(plan["final_compilation_instructions"], original_query,
+                                                          agent_results)
         
         return final_response
     
-    def _compile_final_response(self, compilation_instructions, original_query):
+    def _compile_final_response(self, compilation_instructions, original_query, agent_results):
         """Compile the final response based on all agent results."""
         # Create a prompt for the LLM to compile the results
         compilation_prompt = f"""
         Original user query: {original_query}
         
         Agent results:
-        {json.dumps(self.agent_results, indent=2)}
+        {json_codec.dumps(agent_results, indent=2)}
         
         Compilation instructions:
         {compilation_instructions}
@@ -173,9 +162,6 @@ Output the JSON plan only, nothing else.
         Format your response using Markdown for better readability.
         Include all relevant information from the agent results, but organize it in a coherent way.
         Focus on providing actionable insights and clear explanations.
-
-        MOST IMPORTANT:
-        Strictly take care of the decimels and dates in the response and send them as NORMALISED strings so that they can be serialised withtout issues else you get penalty.
         """
         
         # Use the LLM to compile the results
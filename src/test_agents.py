@@ -2,20 +2,9 @@ from agents.bond_directory_agent import BondDirectoryAgent
 from agents.bond_screener_agent import BondScreenerAgent
 from agents.bond_yield_calculator_agent import BondYieldCalculatorAgent
 from agents.bond_finder_agent import BondFinderAgent
-import json
-from decimal import Decimal
-from datetime import date, datetime
+from utils import json_codec
 from orchestrator import OrchestratorAgent
 
-# Define a custom JSON encoder to handle Decimal and date types
-class CustomEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, Decimal):
-            return float(obj)  # Convert Decimal to float for JSON serialization
-        elif isinstance(obj, (date, datetime)):
-            return obj.isoformat()  # Convert dates to ISO format string
-        return super(CustomEncoder, self).default(obj)
-
 def test_bond_directory():
     """Test the Bond Directory Agent with various queries."""
     agent = BondDirectoryAgent()
@@ -36,8 +25,8 @@ def test_bond_directory():
         else:
             print(f"Found: {result.get('count', 0)} results")
             if result.get("results") and result["results"]:
-                # Print first result as sample using the custom encoder
-                print(f"Sample result: {json.dumps(result['results'][0], indent=2, cls=CustomEncoder)}")
+                # Print first result as sample
+                print(f"Sample result: {json_codec.dumps(result['results'][0], indent=2)}")
         print("=" * 50)
 
 def test_bond_screener():
@@ -58,8 +47,8 @@ def test_bond_screener():
         else:
             print(f"Found: {result.get('count', 0)} results")
             if result.get("results") and result["results"]:
-                # Print first result as sample using the custom encoder
-                print(f"Sample result: {json.dumps(result['results'][0], indent=2, cls=CustomEncoder)}")
+                # Print first result as sample
+                print(f"Sample result: {json_codec.dumps(result['results'][0], indent=2)}")
         print("=" * 50)
 
 def test_bond_finder():
@@ -219,8 +208,8 @@ def test_orchestrator():
         if "error" in result:
             print(f"ERROR: {result['error']}")
         else:
-            # Use the CustomEncoder to handle date and Decimal objects
-            print(f"Response: {json.dumps(result['response'], cls=CustomEncoder, indent=2)}")
+            # json_codec handles date and Decimal objects
+            print(f"Response: {json_codec.dumps(result['response'], indent=2)}")
     except Exception as e:
         print(f"\n=== Orchestrator Test ===")
         print(f"Query: {query}")
@@ -0,0 +1,133 @@
+"""
+Compressed storage of the bond_details JSON documents.
+
+The hot bond_details row holds only typed summary fields (BOND_JSON_FIELDS);
+each full document lives in bond_detail_documents, one row per (bond id,
+section), compressed in the format of MySQL's COMPRESS() so the database can
+UNCOMPRESS() a section in SQL (see bond_queries.BOND_SECTION_COLUMNS) and
+clients can decompress it after fetching only the sections they need.
+"""
+import math
+import struct
+import zlib
+from . import json_codec
+from .bond_queries import BOND_DOCUMENT_SECTIONS, BOND_JSON_FIELDS, NUMERIC_JSON_FIELDS
+
+COMPRESS_LEVEL = 6
+
+def compress_document(text):
+    """
+    Compress a document like MySQL COMPRESS(): 4-byte little-endian length of the
+    uncompressed bytes followed by the zlib stream (empty input stays empty).
+    """
+    raw = text.encode("utf-8") if isinstance(text, str) else bytes(text)
+    if not raw:
+        return b""
+    return struct.pack("<I", len(raw) & 0x3FFFFFFF) + zlib.compress(raw, COMPRESS_LEVEL)
+
+def decompress_document(payload):
+    """Inverse of compress_document (and of MySQL COMPRESS()); returns text, None for NULL."""
+    if payload is None:
+        return None
+    payload = bytes(payload)
+    if not payload:
+        return ""
+    return zlib.decompress(payload[4:]).decode("utf-8")
+
+def _json_path(document, path):
+    """Follow a simple '$.a.b' path through nested objects, like JSON_EXTRACT on objects."""
+    for key in path[2:].split("."):
+        if not isinstance(document, dict):
+            return None
+        document = document.get(key)
+    return document
+
+def _number(value):
+    if value is None or isinstance(value, bool):
+        return None
+    try:
+        number = float(str(value).replace(",", "").strip())
+    except ValueError:
+        return None
+    return number if math.isfinite(number) else None
+
+def _text(value):
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, (dict, list)):
+        return json_codec.dumps(value)
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value)
+
+def summary_fields(row):
+    """
+    Typed values of the BOND_JSON_FIELDS for one bond, from its section documents.
+
+    Args:
+        row (dict): Section name -> JSON text (other keys are ignored)
+
+    Returns:
+        dict: Field name -> float for NUMERIC_JSON_FIELDS, text otherwise (None when absent)
+    """
+    documents = {}
+    values = {}
+    for name, (section, path) in BOND_JSON_FIELDS.items():
+        if section not in documents:
+            raw = row.get(section)
+            try:
+                documents[section] = json_codec.loads(raw) if isinstance(raw, (str, bytes)) and raw.strip() else None
+            except ValueError:
+                documents[section] = None
+        value = _json_path(documents[section], path)
+        values[name] = _number(value) if name in NUMERIC_JSON_FIELDS else _text(value)
+    return values
+
+def document_rows(bond_id, row):
+    """
+    bond_detail_documents rows (bond_id, section, bytes, payload) for the non-empty sections of one bond.
+    """
+    rows = []
+    for section in BOND_DOCUMENT_SECTIONS:
+        text = row.get(section)
+        if isinstance(text, str) and text.strip():
+            rows.append((bond_id, section, len(text.encode("utf-8")), compress_document(text)))
+    return rows
+
+def fetch_documents(cursor, bond_ids, sections=None):
+    """
+    Fetch and decompress selected sections of some bonds.
+
+    Only the requested (bond, section) rows are read, so asking for one section of
+    one bond transfers one compressed document.
+
+    Args:
+        cursor: DB-API cursor on the tap_bonds database
+        bond_ids (list): bond_details ids
+        sections (list): Section names (default all BOND_DOCUMENT_SECTIONS)
+
+    Returns:
+        dict: bond id -> {section: JSON text}; missing sections are absent
+
+    Raises:
+        ValueError: For an unknown section name
+    """
+    sections = list(sections or BOND_DOCUMENT_SECTIONS)
+    unknown = [section for section in sections if section not in BOND_DOCUMENT_SECTIONS]
+    if unknown:
+        raise ValueError(f"Unknown bond document sections: {', '.join(unknown)}")
+    documents = {bond_id: {} for bond_id in bond_ids}
+    if not documents or not sections:
+        return documents
+    cursor.execute(
+        f"SELECT bond_id, section, payload FROM bond_detail_documents "
+        f"WHERE bond_id IN ({', '.join(['%s'] * len(documents))}) AND section IN ({', '.join(['%s'] * len(sections))})",
+        tuple(documents) + tuple(sections)
+    )
+    for row in cursor.fetchall():
+        if isinstance(row, dict):
+            bond_id, section, payload = row["bond_id"], row["section"], row["payload"]
+        else:
+            bond_id, section, payload = row
+        documents[bond_id][section] = decompress_document(payload)
+    return documents
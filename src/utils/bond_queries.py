@@ -0,0 +1,226 @@
+from .filter_compiler import Filter, FilterCompiler, as_date, as_number, range_filters
+from .pagination import SORT_KEYS
+from .schemas import QuerySchema, TableSchema
+
+# JSON documents of a bond, stored compressed in bond_detail_documents (see utils.bond_documents)
+BOND_DOCUMENT_SECTIONS = ["issuer_details", "instrument_details", "coupon_details", "redemption_details",
+                          "credit_rating_details", "listing_details", "key_contacts_details", "key_documents_details"]
+
+# Typed summary columns of bond_details, extracted at load time: name -> (document section, JSON path)
+BOND_JSON_FIELDS = {
+    # Coupon details
+    "coupon_rate": ("coupon_details", "$.coupensVo.couponDetails.couponRate"),
+    "coupon_type": ("coupon_details", "$.coupensVo.couponDetails.couponType"),
+    "coupon_frequency": ("coupon_details", "$.coupensVo.couponDetails.interestPaymentFrequency"),
+    "coupon_basis": ("coupon_details", "$.coupensVo.couponDetails.couponBasis"),
+    
+    # Instrument details
+    "face_value": ("instrument_details", "$.instrumentsVo.instruments.faceValue"),
+    "secured": ("instrument_details", "$.instrumentsVo.instruments.secured"),
+    "instrument_description": ("instrument_details", "$.instrumentsVo.instruments.instrumentDesc"),
+    "mode_of_issue": ("instrument_details", "$.instrumentsVo.instruments.modeOfIssue"),
+    "tenure_years": ("instrument_details", "$.instrumentsVo.instruments.tenureYears"),
+    "tenure_months": ("instrument_details", "$.instrumentsVo.instruments.tenureMonths"),
+    "tenure_days": ("instrument_details", "$.instrumentsVo.instruments.tenureDays"),
+    "series": ("instrument_details", "$.instrumentsVo.instruments.series"),
+    "tax_free": ("instrument_details", "$.instrumentsVo.instruments.taxFree"),
+    
+    # Issuer details
+    "issuer_type": ("issuer_details", "$.issuerTypeOwner"),
+    "sector": ("issuer_details", "$.sector"),
+    "industry": ("issuer_details", "$.industry"),
+    "cin": ("issuer_details", "$.cin"),
+    "lei": ("issuer_details", "$.lei"),
+    
+    # Credit rating details
+    "credit_rating": ("credit_rating_details", "$.currentRatings.currentRating"),
+    "rating_outlook": ("credit_rating_details", "$.currentRatings.outlook"),
+    "rating_agency": ("credit_rating_details", "$.currentRatings.creditRatingAgencyName"),
+    "rating_date": ("credit_rating_details", "$.currentRatings.creditRatingDate"),
+    
+    # Listing details
+    "listing_exchange": ("listing_details", "$.listingDetails.exchangeName"),
+    "listing_date": ("listing_details", "$.listingDetails.listingDate"),
+    "listing_status": ("listing_details", "$.listingStatus"),
+    
+    # Redemption details
+    "redemption_type": ("redemption_details", "$.redemptionType"),
+    "put_option": ("redemption_details", "$.putIndicator"),
+    "call_option": ("redemption_details", "$.callIndicator"),
+    "maturity_type": ("redemption_details", "$.maturityType"),
+    
+    # Trustee details
+    "debenture_trustee": ("key_contacts_details", "$.debtTrusteeName"),
+    "registrar": ("key_contacts_details", "$.registrar"),
+    "registrar_contact": ("key_contacts_details", "$.regContact"),
+    "trustee_contact": ("key_contacts_details", "$.debtTrusteeContact"),
+    "trustee_address": ("key_contacts_details", "$.debtTrusteeAddr"),
+}
+
+# Derived fields holding numbers; everything else is text
+NUMERIC_JSON_FIELDS = {"coupon_rate", "face_value", "tenure_years", "tenure_months", "tenure_days"}
+
+# SELECT expressions producing the derived columns; they are plain columns of the hot row
+BOND_COLUMN_MAPPING = {name: name for name in BOND_JSON_FIELDS}
+
+# SELECT expressions producing the full documents; each reads and uncompresses only its own section
+BOND_SECTION_COLUMNS = {
+    section: (f"(SELECT CAST(UNCOMPRESS(d.payload) AS CHAR) FROM tap_bonds.bond_detail_documents d "
+              f"WHERE d.bond_id = bond_details.id AND d.section = '{section}') as {section}")
+    for section in BOND_DOCUMENT_SECTIONS
+}
+
+BOND_DETAILS_COLUMNS = ["id", "created_at", "updated_at", "isin", "company_name", "issue_size", "allotment_date",
+                        "maturity_date"]
+
+CASHFLOW_COLUMNS = ["id", "isin", "cash_flow_date", "cash_flow_amount", "record_date", "principal_amount",
+                    "interest_amount", "tds_amount", "remaining_principal", "state", "source", "created_at", "updated_at"]
+
+# Plain columns of company_insights that can be selected directly
+COMPANY_COLUMNS = ["id", "created_at", "updated_at", "company_name", "company_industry", "description",
+                   "pros", "cons", "news_and_events"]
+
+# Columns stored as JSON text; these are decoded lazily and can be projected with "column.Key"
+COMPANY_JSON_COLUMNS = ["key_metrics", "income_statement", "balance_sheet", "cashflow", "lenders_profile",
+                        "comparison", "borrowers_profile", "shareholding_profile", "key_personnel"]
+
+BOND_FILTERS = FilterCompiler({
+    # ISIN and company name filters
+    "isin": Filter("isin", many=True),
+    "company_name": Filter("company_name", "contains"),
+    
+    # Maturity date filters
+    **range_filters("maturity", "maturity_date", as_date, suffixes=("after", "before", "equals")),
+    
+    # Coupon rate filters
+    **range_filters("coupon_rate", "coupon_rate", as_number),
+    
+    # Secured status, issuer type, sector, industry filters
+    "secured": Filter("secured"),
+    "issuer_type": Filter("issuer_type"),
+    "sector": Filter("sector"),
+    "industry": Filter("industry"),
+    
+    # Credit rating filters
+    "credit_rating_min": Filter("credit_rating", ">="),
+    "credit_rating_equals": Filter("credit_rating"),
+    
+    # Face value filters
+    **range_filters("face_value", "face_value", as_number),
+    
+    # Listing exchange filter
+    "listing_exchange": Filter("listing_exchange"),
+    
+    # Issue size filters
+    **range_filters("issue_size", "issue_size", as_number),
+})
+
+CASHFLOW_FILTERS = FilterCompiler({
+    "isin": Filter("isin", many=True),
+    **range_filters("cash_flow_date", "cash_flow_date", as_date, suffixes=("after", "before", "equals")),
+    **range_filters("cash_flow_amount", "cash_flow_amount", as_number),
+    **range_filters("principal_amount", "principal_amount", as_number),
+    **range_filters("interest_amount", "interest_amount", as_number),
+    "state": Filter("state"),
+    "source": Filter("source"),
+})
+
+# What the model may ask for; anything else is sent back for repair instead of reaching the SQL
+QUERY_SCHEMA = QuerySchema(
+    tables=[
+        TableSchema(
+            "bond_details",
+            columns=BOND_DETAILS_COLUMNS + BOND_DOCUMENT_SECTIONS + list(BOND_COLUMN_MAPPING),
+            filter_compiler=BOND_FILTERS,
+            sort_keys=SORT_KEYS["bond_details"],
+        ),
+        TableSchema(
+            "cashflows",
+            columns=CASHFLOW_COLUMNS,
+            filter_compiler=CASHFLOW_FILTERS,
+            sort_keys=SORT_KEYS["cashflows"],
+        ),
+    ],
+    default_table="bond_details",
+    allow_next_query=True,
+)
+
+def bond_details_parts(columns=None, filters=None):
+    """
+    Translate a bond_details lookup into SELECT expressions and WHERE conditions.
+
+    Args:
+        columns (list): Table columns, BOND_COLUMN_MAPPING names or document sections; unknown
+            names are skipped
+        filters (dict): Filter key -> value, see BOND_FILTERS for the accepted keys
+
+    Returns:
+        tuple: (select expressions, conditions, params for the conditions)
+
+    Raises:
+        FilterError: For an unknown filter key or a value of the wrong type
+    """
+    sql_columns = []
+    for col in columns or ["isin", "company_name"]:
+        if col in BOND_COLUMN_MAPPING:
+            sql_columns.append(BOND_COLUMN_MAPPING[col])
+        elif col in BOND_SECTION_COLUMNS:
+            sql_columns.append(BOND_SECTION_COLUMNS[col])
+        elif col in BOND_DETAILS_COLUMNS:
+            sql_columns.append(col)
+    if not sql_columns:
+        sql_columns = ["isin", "company_name"]
+    
+    conditions, params = BOND_FILTERS.compile(filters)
+    return sql_columns, conditions, params
+
+def cashflows_parts(columns=None, filters=None):
+    """
+    Translate a cashflows lookup into SELECT expressions and WHERE conditions.
+
+    Args:
+        columns (list): Table columns; unknown names are skipped
+        filters (dict): Filter key -> value, see CASHFLOW_FILTERS for the accepted keys
+
+    Returns:
+        tuple: (select expressions, conditions, params for the conditions)
+
+    Raises:
+        FilterError: For an unknown filter key or a value of the wrong type
+    """
+    sql_columns = [col for col in columns or ["id", "isin", "cash_flow_date"] if col in CASHFLOW_COLUMNS]
+    if not sql_columns:
+        sql_columns = ["id", "isin", "cash_flow_date"]
+    
+    conditions, params = CASHFLOW_FILTERS.compile(filters)
+    return sql_columns, conditions, params
+
+QUERY_PARTS = {
+    "bond_details": bond_details_parts,
+    "cashflows": cashflows_parts,
+}
+
+# Order of full (non-paginated) results
+DEFAULT_ORDER = {
+    "bond_details": None,
+    "cashflows": "cash_flow_date",
+}
+
+def build_query(query_params, limit=None):
+    """
+    Build (sql, params) for a validated directory query object.
+
+    Args:
+        query_params (dict): {"table", "columns", "filters"}
+        limit (int, optional): Row cap, None for no LIMIT clause
+    """
+    table = query_params.get("table", "bond_details")
+    sql_columns, conditions, params = QUERY_PARTS[table](query_params.get("columns"), query_params.get("filters"))
+    sql = f"SELECT {', '.join(sql_columns)} FROM tap_bonds.{table}"
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    if DEFAULT_ORDER[table]:
+        sql += f" ORDER BY {DEFAULT_ORDER[table]}"
+    if limit is not None:
+        sql += f" LIMIT {int(limit)}"
+    return sql, params
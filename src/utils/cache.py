@@ -0,0 +1,448 @@
+"""
+Cache shared by the uvicorn workers.
+
+One Cache in front of a pluggable backend, selected with CACHE_BACKEND:
+
+    none    Caching disabled
+    memory  In-process LRU (default); every worker warms its own copy, but the
+            generations below are kept in the SQLite file at CACHE_PATH so
+            every process on the host sees the same ones
+    disk    SQLite file at CACHE_PATH, shared by the workers on one host
+    resp    Redis-protocol server at CACHE_URL (redis://host:port/db), shared by every host
+
+Keys are namespaced ("sql", "plan", ...) and versioned by the data load
+generation: data_processing bumps the generation after a load, which moves
+every worker to a fresh key space at once instead of invalidating entries one
+by one (stale ones age out through the TTL and eviction). Each table also has
+its own generation, bumped whenever the table is written, so cached SQL
+results only go stale when a table they read changed. Values are pickled,
+so every hit returns a private copy the caller may mutate.
+
+Backend errors never fail a request: they are counted and treated as misses.
+"""
+import hashlib
+import os
+import pickle
+import socket
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlparse
+from .config import load_env
+from .metrics import REGISTRY
+
+DEFAULT_DISK_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "data", "cache.sqlite")
+MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "10000"))
+# Entry lifetime; bounds staleness when a write isn't seen through the generations (e.g. from another host)
+DEFAULT_TTL_S = float(os.getenv("CACHE_TTL_S", "300"))
+# Seconds a worker keeps using the generation it last read before asking the backend again
+GENERATION_POLL_S = float(os.getenv("CACHE_GENERATION_POLL_S", "1"))
+SOCKET_TIMEOUT_S = 0.5
+# Seconds a disk cache write waits for another process holding the SQLite write lock
+BUSY_TIMEOUT_S = 5
+
+GENERATION_KEY = "tap:generation"
+
+CACHE_REQUESTS = REGISTRY.counter("tap_cache_requests_total", "Shared cache lookups", labelnames=("namespace", "result"))
+CACHE_ERRORS = REGISTRY.counter("tap_cache_errors_total", "Shared cache backend errors", labelnames=("operation",))
+
+_MISSING = object()
+
+class NullBackend:
+    """Stores nothing and keeps no generations: every lookup misses."""
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value, ttl_s=None):
+        pass
+
+    def delete(self, key):
+        pass
+
+    def counter(self, name):
+        return None
+
+    def incr(self, name):
+        return None
+
+    def clear(self):
+        pass
+
+class MemoryBackend:
+    """LRU dict of bytes values with per-entry expiry."""
+
+    def __init__(self, max_entries=MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires is not None and expires <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl_s=None):
+        with self._lock:
+            self._entries[key] = (value, time.time() + ttl_s if ttl_s else None)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def counter(self, name):
+        return self._counters.get(name, 0)
+
+    def incr(self, name):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + 1
+            return self._counters[name]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+class DiskBackend:
+    """
+    SQLite file shared by the processes on one host (WAL mode, one connection per thread).
+
+    Entries are evicted least recently used first once there are more than
+    max_entries; the count is checked every `prune_every` writes.
+    """
+
+    def __init__(self, path=DEFAULT_DISK_PATH, max_entries=MAX_ENTRIES, prune_every=100):
+        self.path = path
+        self.max_entries = max_entries
+        self.prune_every = prune_every
+        self._writes = 0
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        connection = self._connect()
+        connection.execute("CREATE TABLE IF NOT EXISTS entries ("
+                           "key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL, used REAL NOT NULL)")
+        connection.execute("CREATE INDEX IF NOT EXISTS idx_entries_used ON entries (used)")
+        connection.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+
+    def _connect(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            # Autocommit: every statement is its own short transaction
+            connection = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_S, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def get(self, key):
+        connection = self._connect()
+        now = time.time()
+        row = connection.execute("SELECT value, expires FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        if row[1] is not None and row[1] <= now:
+            connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+            return None
+        connection.execute("UPDATE entries SET used = ? WHERE key = ?", (now, key))
+        return row[0]
+
+    def set(self, key, value, ttl_s=None):
+        connection = self._connect()
+        now = time.time()
+        connection.execute("REPLACE INTO entries (key, value, expires, used) VALUES (?, ?, ?, ?)",
+                           (key, sqlite3.Binary(value), now + ttl_s if ttl_s else None, now))
+        self._writes += 1
+        if self._writes % self.prune_every == 0:
+            self.prune()
+
+    def prune(self):
+        """Drop expired entries, then the least recently used ones beyond max_entries."""
+        connection = self._connect()
+        connection.execute("DELETE FROM entries WHERE expires IS NOT NULL AND expires <= ?", (time.time(),))
+        connection.execute("DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY used DESC "
+                           "LIMIT -1 OFFSET ?)", (self.max_entries,))
+
+    def delete(self, key):
+        self._connect().execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def counter(self, name):
+        row = self._connect().execute("SELECT value FROM counters WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else 0
+
+    def incr(self, name):
+        connection = self._connect()
+        connection.execute("INSERT INTO counters (name, value) VALUES (?, 1) "
+                           "ON CONFLICT(name) DO UPDATE SET value = value + 1", (name,))
+        return self.counter(name)
+
+    def clear(self):
+        self._connect().execute("DELETE FROM entries")
+
+class RespError(Exception):
+    """Error reply from a Redis-protocol server."""
+
+class RespBackend:
+    """
+    Minimal Redis-protocol client (GET/SET PX/DEL/INCR/FLUSHDB), one socket per thread.
+
+    Works against Redis, Valkey, or the stand-in in src.benchmarks.resp_server.
+    Eviction is left to the server (e.g. maxmemory-policy allkeys-lru).
+    """
+
+    def __init__(self, url="redis://127.0.0.1:6379/0", timeout_s=SOCKET_TIMEOUT_S):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "127.0.0.1"
+        self.port = parsed.port or 6379
+        self.db = int(parsed.path.strip("/") or 0)
+        self.password = parsed.password
+        self.timeout_s = timeout_s
+        self._local = threading.local()
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            sock = socket.create_connection((self.host, self.port), timeout=self.timeout_s)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            connection = self._local.connection = (sock, sock.makefile("rb"))
+            if self.password:
+                self._roundtrip(connection, ("AUTH", self.password))
+            if self.db:
+                self._roundtrip(connection, ("SELECT", self.db))
+        return connection
+
+    def _roundtrip(self, connection, args):
+        sock, reader = connection
+        parts = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode("utf-8")
+            parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+        sock.sendall(b"".join(parts))
+        return _read_reply(reader)
+
+    def command(self, *args):
+        """Send one command and return its reply, reconnecting once if the socket went away."""
+        for attempt in range(2):
+            connection = self._connection()
+            try:
+                return self._roundtrip(connection, args)
+            except (OSError, EOFError):
+                self._disconnect()
+                if attempt:
+                    raise
+
+    def _disconnect(self):
+        connection = getattr(self._local, "connection", None)
+        self._local.connection = None
+        if connection is not None:
+            try:
+                connection[0].close()
+            except OSError:
+                pass
+
+    def get(self, key):
+        return self.command("GET", key)
+
+    def set(self, key, value, ttl_s=None):
+        if ttl_s:
+            self.command("SET", key, value, "PX", int(ttl_s * 1000))
+        else:
+            self.command("SET", key, value)
+
+    def delete(self, key):
+        self.command("DEL", key)
+
+    def counter(self, name):
+        value = self.command("GET", name)
+        return int(value) if value is not None else 0
+
+    def incr(self, name):
+        return self.command("INCR", name)
+
+    def clear(self):
+        self.command("FLUSHDB")
+
+def _read_reply(reader):
+    line = reader.readline()
+    if not line.endswith(b"\r\n"):
+        raise EOFError("Connection closed by the cache server")
+    kind, payload = line[:1], line[1:-2]
+    if kind == b"+":
+        return payload.decode("utf-8")
+    if kind == b"-":
+        raise RespError(payload.decode("utf-8", "replace"))
+    if kind == b":":
+        return int(payload)
+    if kind == b"$":
+        length = int(payload)
+        if length < 0:
+            return None
+        data = reader.read(length + 2)
+        if len(data) != length + 2:
+            raise EOFError("Connection closed by the cache server")
+        return data[:-2]
+    if kind == b"*":
+        count = int(payload)
+        return None if count < 0 else [_read_reply(reader) for _ in range(count)]
+    raise RespError(f"Unexpected reply {line[:32]!r}")
+
+class Cache:
+    """
+    Namespaced, generation-versioned cache over one backend.
+
+    Args:
+        backend: NullBackend, MemoryBackend, DiskBackend or RespBackend (anything with
+            get/set/delete/counter/incr/clear)
+        ttl_s (float): Default entry lifetime, None/0 to keep entries until evicted
+        generation_poll_s (float): How long a read generation is trusted before re-reading it
+        counters: Backend holding the generation counters (default: backend); a memory
+            backend's counters are only seen by its own process
+    """
+
+    def __init__(self, backend, ttl_s=DEFAULT_TTL_S, generation_poll_s=GENERATION_POLL_S, counters=None):
+        self.backend = backend
+        self.counters = counters if counters is not None else backend
+        self.ttl_s = ttl_s
+        self.generation_poll_s = generation_poll_s
+        # counter name -> (value, monotonic time it was read)
+        self._counters = {}
+
+    def _counter(self, name):
+        """A backend counter, re-read at most every generation_poll_s; None when unknown."""
+        now = time.monotonic()
+        value, read = self._counters.get(name, (None, 0.0))
+        if value is None or now - read >= self.generation_poll_s:
+            try:
+                value = self.counters.counter(name)
+            except Exception:
+                CACHE_ERRORS.inc(operation="generation")
+                # Keep the last known value; with none known, don't serve cached data at all
+                if value is None:
+                    return None
+            self._counters[name] = (value, now)
+        return value
+
+    def generation(self):
+        """The current data load generation (re-read from the backend at most every generation_poll_s)."""
+        return self._counter(GENERATION_KEY)
+
+    def bump_generation(self):
+        """Start a new generation after a data load; every key written before it stops matching."""
+        generation = self.counters.incr(GENERATION_KEY)
+        self._counters[GENERATION_KEY] = (generation, time.monotonic())
+        return generation
+
+    def table_generations(self, tables):
+        """
+        Version of the data a statement reading `tables` sees: the data load generation
+        followed by the generation of each table, or None when any of them is unknown.
+        """
+        generations = (self.generation(),) + tuple(self._counter(f"{GENERATION_KEY}:{table}") for table in tables)
+        return None if None in generations else generations
+
+    def bump_table_generation(self, *tables):
+        """Mark tables as changed; cached results that read any of them stop matching."""
+        for table in tables:
+            name = f"{GENERATION_KEY}:{table}"
+            self._counters[name] = (self.counters.incr(name), time.monotonic())
+
+    def _key(self, namespace, key, generation):
+        if not isinstance(key, (str, bytes)):
+            key = repr(key)
+        if isinstance(key, str):
+            key = key.encode("utf-8")
+        return f"tap:{namespace}:{generation}:{hashlib.sha256(key).hexdigest()}"
+
+    def get(self, namespace, key, default=None):
+        """The cached value, or `default` on a miss."""
+        generation = self.generation()
+        if generation is None:
+            CACHE_REQUESTS.inc(namespace=namespace, result="miss")
+            return default
+        try:
+            payload = self.backend.get(self._key(namespace, key, generation))
+            value = pickle.loads(payload) if payload is not None else default
+        except Exception:
+            CACHE_ERRORS.inc(operation="get")
+            payload, value = None, default
+        CACHE_REQUESTS.inc(namespace=namespace, result="hit" if payload is not None else "miss")
+        return value
+
+    def set(self, namespace, key, value, ttl_s=None):
+        generation = self.generation()
+        if generation is None:
+            return
+        try:
+            self.backend.set(self._key(namespace, key, generation), pickle.dumps(value, pickle.HIGHEST_PROTOCOL),
+                             ttl_s if ttl_s is not None else self.ttl_s)
+        except Exception:
+            CACHE_ERRORS.inc(operation="set")
+
+    def get_or_compute(self, namespace, key, compute, ttl_s=None, cacheable=None):
+        """
+        The cached value, or compute() stored for next time.
+
+        Args:
+            cacheable (callable): Called with the computed value; falsy keeps it out of the
+                cache (e.g. error results)
+        """
+        value = self.get(namespace, key, _MISSING)
+        if value is _MISSING:
+            value = compute()
+            if cacheable is None or cacheable(value):
+                self.set(namespace, key, value, ttl_s)
+        return value
+
+def cache_from_env():
+    """Build the cache selected by CACHE_BACKEND (none, memory, disk or resp), see the module docstring."""
+    load_env()
+    kind = os.getenv("CACHE_BACKEND", "memory").lower()
+    counters = None
+    if kind == "none":
+        backend = NullBackend()
+    elif kind == "memory":
+        backend = MemoryBackend()
+        # data_processing and the other workers must see the same generations, or
+        # each process would keep serving what it cached before their writes
+        try:
+            counters = DiskBackend(os.getenv("CACHE_PATH", DEFAULT_DISK_PATH))
+        except (OSError, sqlite3.Error):
+            CACHE_ERRORS.inc(operation="generation")
+            # Without shared generations nothing is cached rather than served stale
+            counters = NullBackend()
+    elif kind == "disk":
+        backend = DiskBackend(os.getenv("CACHE_PATH", DEFAULT_DISK_PATH))
+    elif kind == "resp":
+        backend = RespBackend(os.getenv("CACHE_URL", "redis://127.0.0.1:6379/0"))
+    else:
+        raise ValueError(f"Unknown CACHE_BACKEND '{kind}' (expected none, memory, disk or resp)")
+    return Cache(backend, counters=counters)
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_cache():
+    """Get the process-wide cache (created from the environment on first use)."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = cache_from_env()
+    return _cache
+
+def set_cache(cache):
+    """Install a cache for the whole process (None re-reads the environment on next use)."""
+    global _cache
+    with _cache_lock:
+        _cache = cache
@@ -0,0 +1,169 @@
+"""
+Cash-flow calendars: coupons and redemptions bucketed by period.
+
+Flows are read with a range scan on cash_flow_date (per ISIN batch on the
+(isin, cash_flow_date) index, or across the whole universe on the
+(cash_flow_date, id) index), streamed in chunks and summed per period with
+Decimal arithmetic, so totals are exact however many flows are added up.
+"""
+from collections import defaultdict
+from datetime import date
+from decimal import Decimal
+from .filter_compiler import as_date
+from .tidb_connector import stream_query
+
+PERIODS = ("month", "quarter", "year")
+DEFAULT_YEARS = 3
+MAX_ISINS = 20000
+ISIN_BATCH = 500
+SOURCES = ("actual", "projected")
+
+_PLACES = Decimal("0.0001")
+_ZERO = Decimal(0)
+
+class CalendarError(ValueError):
+    """Raised for an invalid calendar request."""
+
+def _decimal(value):
+    if value is None:
+        return _ZERO
+    if isinstance(value, Decimal):
+        return value
+    # Through str so float amounts (e.g. from SQLite) keep their printed value
+    return Decimal(str(value))
+
+def _period_start(day, period):
+    if period == "month":
+        return date(day.year, day.month, 1)
+    if period == "quarter":
+        return date(day.year, 3 * ((day.month - 1) // 3) + 1, 1)
+    return date(day.year, 1, 1)
+
+def _next_period(start, period):
+    months = {"month": 1, "quarter": 3, "year": 12}[period]
+    month = start.month - 1 + months
+    return date(start.year + month // 12, month % 12 + 1, 1)
+
+def _label(start, period):
+    if period == "month":
+        return f"{start.year}-{start.month:02d}"
+    if period == "quarter":
+        return f"{start.year}-Q{(start.month - 1) // 3 + 1}"
+    return str(start.year)
+
+def _add_years(day, years):
+    try:
+        return day.replace(year=day.year + years)
+    except ValueError:
+        # 29 February
+        return day.replace(year=day.year + years, day=28)
+
+def _to_date(value):
+    return value if isinstance(value, date) else date.fromisoformat(str(value)[:10])
+
+def _flow_chunks(start, end, isins, source):
+    sql = ("SELECT isin, cash_flow_date, interest_amount, principal_amount, tds_amount FROM tap_bonds.cashflows "
+           "WHERE cash_flow_date >= %s AND cash_flow_date < %s")
+    params = [start.isoformat(), end.isoformat()]
+    if source:
+        sql += " AND source = %s"
+        params.append(source)
+    if isins is None:
+        yield from stream_query(sql, tuple(params))
+        return
+    for i in range(0, len(isins), ISIN_BATCH):
+        batch = isins[i:i + ISIN_BATCH]
+        batch_sql = f"{sql} AND isin IN ({', '.join(['%s'] * len(batch))})"
+        yield from stream_query(batch_sql, tuple(params + batch))
+
+def cashflow_calendar(holdings=None, start=None, end=None, period="month", source=None):
+    """
+    Aggregate interest, principal and TDS per period.
+
+    Args:
+        holdings (list): ISIN strings or {"isin", "units"} objects (units default 1);
+            None for the whole universe, one unit of every bond
+        start (str): First day included (default today)
+        end (str): First day excluded (default DEFAULT_YEARS years after start)
+        period (str): "month", "quarter" or "year"
+        source (str): Only "actual" or only "projected" flows; None for both
+
+    Returns:
+        dict: {"period", "start", "end", "ladder": [{"period", "start", "interest", "principal",
+            "tds", "net", "flows", "isins"}], "totals"} with amounts as exact decimal strings
+    """
+    if period not in PERIODS:
+        raise CalendarError(f"period must be one of {', '.join(PERIODS)}")
+    if source is not None and source not in SOURCES:
+        raise CalendarError(f"source must be one of {', '.join(SOURCES)}")
+    try:
+        start = date.fromisoformat(as_date(start)) if start else date.today()
+        end = date.fromisoformat(as_date(end)) if end else _add_years(start, DEFAULT_YEARS)
+    except ValueError as e:
+        raise CalendarError(f"start/end: {e}")
+    if end <= start:
+        raise CalendarError("end must be after start")
+
+    units = None
+    if holdings is not None:
+        if not isinstance(holdings, list) or not holdings:
+            raise CalendarError("holdings must be a non-empty list of ISINs or {isin, units} objects")
+        if len(holdings) > MAX_ISINS:
+            raise CalendarError(f"At most {MAX_ISINS} holdings per request")
+        units = defaultdict(lambda: _ZERO)
+        for i, holding in enumerate(holdings):
+            isin, quantity = None, None
+            if isinstance(holding, str):
+                isin, quantity = holding, 1
+            elif isinstance(holding, dict):
+                isin, quantity = holding.get("isin"), holding.get("units", 1)
+            if not isinstance(isin, str):
+                raise CalendarError(f"holdings[{i}]: expected an ISIN or an object with an isin")
+            try:
+                units[isin] += _decimal(quantity)
+            except ArithmeticError:
+                raise CalendarError(f"holdings[{i}]: units must be a number")
+
+    # period start -> [interest, principal, tds, flows, isins]
+    buckets = defaultdict(lambda: [_ZERO, _ZERO, _ZERO, 0, set()])
+    for rows in _flow_chunks(start, end, list(units) if units is not None else None, source):
+        for row in rows:
+            quantity = units[row["isin"]] if units is not None else 1
+            bucket = buckets[_period_start(_to_date(row["cash_flow_date"]), period)]
+            bucket[0] += _decimal(row["interest_amount"]) * quantity
+            bucket[1] += _decimal(row["principal_amount"]) * quantity
+            bucket[2] += _decimal(row["tds_amount"]) * quantity
+            bucket[3] += 1
+            bucket[4].add(row["isin"])
+
+    # Every period of the range is listed, including those without flows
+    ladder = []
+    totals = [_ZERO, _ZERO, _ZERO, 0, set()]
+    current = _period_start(start, period)
+    while current < end:
+        interest, principal, tds, flows, isins = buckets.get(current) or (_ZERO, _ZERO, _ZERO, 0, set())
+        ladder.append(_entry(interest, principal, tds, flows, isins, period=_label(current, period),
+                             start=current.isoformat()))
+        for i, value in enumerate((interest, principal, tds, flows)):
+            totals[i] += value
+        totals[4] |= isins
+        current = _next_period(current, period)
+
+    return {
+        "period": period,
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "ladder": ladder,
+        "totals": _entry(*totals),
+    }
+
+def _entry(interest, principal, tds, flows, isins, **extra):
+    return dict(
+        extra,
+        interest=str(interest.quantize(_PLACES)),
+        principal=str(principal.quantize(_PLACES)),
+        tds=str(tds.quantize(_PLACES)),
+        net=str((interest + principal - tds).quantize(_PLACES)),
+        flows=flows,
+        isins=len(isins),
+    )
@@ -0,0 +1,220 @@
+"""
+Process pool for CPU-bound analytics.
+
+Numeric work such as scenario grid pricing would hold the GIL inside the
+uvicorn worker and stall every other request, so it runs in a pool of worker
+processes owned by the app (started and stopped in its lifespan). A job's
+NumPy inputs are placed in shared memory once and workers map them instead of
+receiving pickled copies; the rows are split into chunks across the workers,
+and a job can be cancelled, e.g. when its client disconnects.
+
+Without a started pool (scripts, tests, single-core hosts) jobs run inline.
+"""
+import asyncio
+import concurrent.futures
+import multiprocessing
+import os
+import threading
+from multiprocessing import shared_memory
+import numpy as np
+from .metrics import REGISTRY
+
+WORKERS = int(os.getenv("COMPUTE_WORKERS", "0")) or os.cpu_count() or 1
+# Seconds between client disconnect checks while a job runs
+DISCONNECT_POLL_S = 0.1
+
+COMPUTE_JOBS = REGISTRY.counter("tap_compute_jobs_total", "Compute pool jobs by outcome", labelnames=("outcome",))
+COMPUTE_CHUNKS_IN_FLIGHT = REGISTRY.gauge("tap_compute_chunks_in_flight", "Compute pool chunks submitted and not finished")
+
+class JobCancelled(Exception):
+    """Raised when a job was cancelled before all of its chunks finished."""
+
+def _attach(descriptors, start, stop):
+    """Map shared arrays in a worker and slice rows [start, stop)."""
+    blocks, arrays = [], {}
+    for name, (block_name, shape, dtype) in descriptors.items():
+        block = shared_memory.SharedMemory(name=block_name)
+        blocks.append(block)
+        arrays[name] = np.ndarray(shape, dtype=dtype, buffer=block.buf)[start:stop]
+    return blocks, arrays
+
+def _run_chunk(fn, descriptors, start, stop, args):
+    blocks, arrays = _attach(descriptors, start, stop)
+    try:
+        # Copy out so no view of the shared buffers outlives the mapping
+        return np.array(fn(arrays, *args))
+    finally:
+        arrays.clear()
+        for block in blocks:
+            block.close()
+
+class ChunkedJob:
+    """
+    One job split into row chunks.
+
+    Args:
+        executor (ProcessPoolExecutor): Pool to run on, None to run inline
+        fn (callable): Module-level function called as fn(arrays, *args) per chunk, where
+            arrays maps names to the chunk's rows of each input
+        arrays (dict): Name -> ndarray inputs, all with the same number of rows
+        args (tuple): Extra picklable arguments passed to every chunk
+        chunk_rows (int): Rows per chunk
+    """
+
+    def __init__(self, executor, fn, arrays, args, chunk_rows):
+        rows = len(next(iter(arrays.values()))) if arrays else 0
+        self.bounds = [(start, min(start + chunk_rows, rows)) for start in range(0, rows, max(1, chunk_rows))]
+        self._blocks = []
+        self._futures = []
+        self._results = None
+        self._released = False
+        self._lock = threading.Lock()
+
+        if executor is None:
+            self._results = [np.array(fn({name: array[start:stop] for name, array in arrays.items()}, *args))
+                             for start, stop in self.bounds]
+            COMPUTE_JOBS.inc(outcome="inline")
+            return
+
+        descriptors = {}
+        try:
+            for name, array in arrays.items():
+                array = np.ascontiguousarray(array)
+                block = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+                self._blocks.append(block)
+                np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+                descriptors[name] = (block.name, array.shape, array.dtype.str)
+            for start, stop in self.bounds:
+                future = executor.submit(_run_chunk, fn, descriptors, start, stop, args)
+                COMPUTE_CHUNKS_IN_FLIGHT.inc()
+                future.add_done_callback(lambda _: COMPUTE_CHUNKS_IN_FLIGHT.inc(-1))
+                self._futures.append(future)
+        except BaseException:
+            self.cancel()
+            raise
+        if not self._futures:
+            self._release()
+
+    def result(self, timeout=None):
+        """Chunk results in row order, blocking until all are done."""
+        if self._results is not None:
+            return self._results
+        try:
+            results = [future.result(timeout) for future in self._futures]
+        except concurrent.futures.CancelledError:
+            COMPUTE_JOBS.inc(outcome="cancelled")
+            raise JobCancelled("Compute job was cancelled")
+        except BaseException:
+            COMPUTE_JOBS.inc(outcome="failed")
+            self.cancel()
+            raise
+        finally:
+            if all(future.done() for future in self._futures):
+                self._release()
+        COMPUTE_JOBS.inc(outcome="completed")
+        self._results = results
+        return results
+
+    async def wait(self, is_disconnected=None, poll_s=DISCONNECT_POLL_S):
+        """
+        Await the chunk results, cancelling the job if `is_disconnected()` (awaitable) turns true.
+
+        Raises:
+            JobCancelled: If the job was cancelled
+        """
+        if self._results is not None:
+            return self._results
+        pending = {asyncio.wrap_future(future) for future in self._futures}
+        while pending:
+            done, pending = await asyncio.wait(pending, timeout=poll_s)
+            if any(task.cancelled() or task.exception() is not None for task in done):
+                break
+            if pending and is_disconnected is not None and await is_disconnected():
+                self.cancel()
+                COMPUTE_JOBS.inc(outcome="cancelled")
+                raise JobCancelled("Client disconnected")
+        return self.result()
+
+    def cancel(self):
+        """Drop chunks that haven't started; running chunks finish but their results are discarded."""
+        for future in self._futures:
+            future.cancel()
+        # Workers that already mapped the blocks keep their mapping; unlinking only removes the names
+        self._release()
+
+    def _release(self):
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        for block in self._blocks:
+            block.close()
+            try:
+                block.unlink()
+            except FileNotFoundError:
+                pass
+
+class ComputePool:
+    """
+    Managed pool of worker processes.
+
+    Args:
+        workers (int): Worker processes; below 2 the pool runs jobs inline
+    """
+
+    def __init__(self, workers=WORKERS):
+        self.workers = workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self._executor is not None
+
+    def start(self):
+        with self._lock:
+            if self._executor is None and self.workers >= 2:
+                # spawn: forking a threaded server process can deadlock the children
+                self._executor = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+                )
+        return self
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def submit(self, fn, arrays, args=(), chunk_rows=None, inline=False):
+        """
+        Start a job over the rows of `arrays` (see ChunkedJob).
+
+        Args:
+            chunk_rows (int): Upper bound on rows per chunk; chunks are made smaller so
+                every worker gets at least one
+            inline (bool): Run in this process even when the pool is running, for jobs
+                too small to be worth the round trip
+        """
+        rows = len(next(iter(arrays.values()))) if arrays else 0
+        executor = None if inline else self._executor
+        chunk_rows = chunk_rows or rows or 1
+        if executor is not None:
+            chunk_rows = max(1, min(chunk_rows, -(-rows // self.workers)))
+        return ChunkedJob(executor, fn, arrays, args, chunk_rows)
+
+_pool = ComputePool()
+
+def get_compute_pool():
+    """The process-wide pool (running only between start_compute_pool and shutdown_compute_pool)."""
+    return _pool
+
+def start_compute_pool(workers=None):
+    global _pool
+    if workers is not None and workers != _pool.workers:
+        _pool.shutdown()
+        _pool = ComputePool(workers)
+    return _pool.start()
+
+def shutdown_compute_pool():
+    _pool.shutdown()
@@ -0,0 +1,23 @@
+import os
+import threading
+
+_loaded = False
+_lock = threading.Lock()
+
+def load_env():
+    """Load the .env file into the environment once per process (later calls are no-ops)."""
+    global _loaded
+    if _loaded:
+        return
+    with _lock:
+        if not _loaded:
+            from dotenv import load_dotenv
+            load_dotenv()
+            _loaded = True
+
+def env_flag(name, default=False):
+    """Read a boolean environment variable ("1", "true", "yes" and "on" are true)."""
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
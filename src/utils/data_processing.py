@@ -3,15 +3,40 @@ import json
 import pymysql
 import os
 from datetime import datetime
-from dotenv import load_dotenv
 from utils.tidb_connector import get_db
+from utils.cache import get_cache
+from utils.text_index import refresh_text_index
+from utils.snapshot import write_snapshot
+from utils.bond_queries import (BOND_COLUMN_MAPPING, BOND_DETAILS_COLUMNS, BOND_DOCUMENT_SECTIONS, BOND_JSON_FIELDS,
+                                NUMERIC_JSON_FIELDS)
+from utils.bond_documents import document_rows, fetch_documents, summary_fields
+from utils.schedules import build_schedules, prepare_terms, schedule_rows
+from utils.portfolios import revalue
+from utils.staging import normalize_frame, read_staged, stage_source
+from utils.validation import validate_rows
+
+# Quarantine payloads keep values up to this many characters; longer ones are replaced by their length
+QUARANTINE_VALUE_CHARS = 65536
+
+PAGINATION_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_bond_details_isin_id ON bond_details (isin, id)",
+    "CREATE INDEX IF NOT EXISTS idx_bond_details_maturity_id ON bond_details (maturity_date, id)",
+    "CREATE INDEX IF NOT EXISTS idx_cashflows_date_id ON cashflows (cash_flow_date, id)",
+    "CREATE INDEX IF NOT EXISTS idx_company_insights_name_id ON company_insights (company_name, id)",
+    # Cash-flow calendars over an ISIN set scan each ISIN's date range
+    "CREATE INDEX IF NOT EXISTS idx_cashflows_isin_date ON cashflows (isin, cash_flow_date)",
+]
+
+def _summary_column_type(name):
+    return "DECIMAL(20, 4)" if name in NUMERIC_JSON_FIELDS else "TEXT"
 
 def create_tables(connection):
     """Create tables in TiDB if they don't exist."""
     cursor = connection.cursor()
     
-    # Bond Details table
-    cursor.execute("""
+    # Bond Details table: the hot row, with typed summary fields extracted from the documents
+    summary_columns = "".join(f",\n        {name} {_summary_column_type(name)} DEFAULT NULL" for name in BOND_JSON_FIELDS)
+    cursor.execute(f"""
     CREATE TABLE IF NOT EXISTS bond_details (
         id VARCHAR(255) PRIMARY KEY,
         created_at VARCHAR(50) DEFAULT NULL,
@@ -20,15 +45,20 @@ def create_tables(connection):
         company_name VARCHAR(255) DEFAULT NULL,
         issue_size DECIMAL(20, 2) DEFAULT NULL,
         allotment_date DATE DEFAULT NULL,
-        maturity_date DATE DEFAULT NULL,
-        issuer_details MEDIUMTEXT DEFAULT NULL,
-        instrument_details MEDIUMTEXT DEFAULT NULL,
-        coupon_details MEDIUMTEXT DEFAULT NULL,
-        redemption_details MEDIUMTEXT DEFAULT NULL,
-        credit_rating_details MEDIUMTEXT DEFAULT NULL,
-        listing_details MEDIUMTEXT DEFAULT NULL,
-        key_contacts_details MEDIUMTEXT DEFAULT NULL,
-        key_documents_details MEDIUMTEXT DEFAULT NULL
+        maturity_date DATE DEFAULT NULL{summary_columns}
+    )
+    """)
+    for name in BOND_JSON_FIELDS:
+        cursor.execute(f"ALTER TABLE bond_details ADD COLUMN IF NOT EXISTS {name} {_summary_column_type(name)} DEFAULT NULL")
+    
+    # Full JSON documents of each bond, one COMPRESS()-format row per section (see utils.bond_documents)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS bond_detail_documents (
+        bond_id VARCHAR(255) NOT NULL,
+        section VARCHAR(64) NOT NULL,
+        bytes BIGINT NOT NULL,
+        payload LONGBLOB NOT NULL,
+        PRIMARY KEY (bond_id, section)
     )
     """)
     
@@ -45,11 +75,14 @@ def create_tables(connection):
         tds_amount DECIMAL(20, 4) DEFAULT NULL,
         remaining_principal DECIMAL(20, 4) DEFAULT NULL,
         state VARCHAR(50) DEFAULT NULL,
+        source VARCHAR(16) NOT NULL DEFAULT 'actual',
         created_at VARCHAR(50) DEFAULT NULL,
         updated_at VARCHAR(50) DEFAULT NULL,
         INDEX (isin)
     )
     """)
+    # 'actual' rows come from the source files, 'projected' ones from insert_projected_cashflows
+    cursor.execute("ALTER TABLE cashflows ADD COLUMN IF NOT EXISTS source VARCHAR(16) NOT NULL DEFAULT 'actual'")
     
     # Company Insights table
     cursor.execute("""
@@ -76,6 +109,59 @@ def create_tables(connection):
     )
     """)
     
+    # Portfolios: positions and their precomputed analytics (see utils.portfolios)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS portfolios (
+        id VARCHAR(64) PRIMARY KEY,
+        name VARCHAR(255) DEFAULT NULL,
+        created_at VARCHAR(50) DEFAULT NULL,
+        updated_at VARCHAR(50) DEFAULT NULL
+    )
+    """)
+    
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS portfolio_positions (
+        id VARCHAR(64) PRIMARY KEY,
+        portfolio_id VARCHAR(64) NOT NULL,
+        isin VARCHAR(50) NOT NULL,
+        units DECIMAL(20, 4) NOT NULL,
+        cost DECIMAL(20, 4) DEFAULT NULL,
+        settlement_date DATE DEFAULT NULL,
+        INDEX (portfolio_id),
+        INDEX (isin)
+    )
+    """)
+    
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS position_valuations (
+        position_id VARCHAR(64) PRIMARY KEY,
+        portfolio_id VARCHAR(64) NOT NULL,
+        fingerprint VARCHAR(64) NOT NULL,
+        valued_at VARCHAR(50) DEFAULT NULL,
+        analytics TEXT DEFAULT NULL,
+        INDEX (portfolio_id)
+    )
+    """)
+    
+    # Source rows rejected by validation or by the database, with the reasons (see quarantine_rows)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS ingest_quarantine (
+        id BIGINT AUTO_INCREMENT PRIMARY KEY,
+        table_name VARCHAR(64) NOT NULL,
+        row_id VARCHAR(255) DEFAULT NULL,
+        isin VARCHAR(50) DEFAULT NULL,
+        reasons TEXT NOT NULL,
+        payload MEDIUMTEXT DEFAULT NULL,
+        quarantined_at VARCHAR(50) DEFAULT NULL,
+        INDEX (table_name)
+    )
+    """)
+    
+    # Composite (sort key, id) indexes so keyset pagination pages are index range scans;
+    # created separately so existing tables pick them up too
+    for index_sql in PAGINATION_INDEXES:
+        cursor.execute(index_sql)
+    
     connection.commit()
     cursor.close()
 
@@ -84,198 +170,283 @@ def load_excel_data(file_path):
     print(f"Loading data from {file_path}...")
     return pd.read_excel(file_path)
 
-def process_json_columns(df):
-    """Process JSON columns in the dataframe."""
-    for column in df.columns:
-        if df[column].dtype == 'object':
-            try:
-                df[column] = df[column].apply(
-                    lambda x: json.dumps(json.loads(x)) if isinstance(x, str) and x.strip().startswith('{') else x
-                )
-            except Exception as e:
-                print(f"Error processing column {column}: {e}")
-    return df
+def load_source(file_path, table):
+    """
+    Rows of a source file, parsed through the Parquet staging area (see utils.staging).
 
-def insert_bond_details(connection, df, batch_size=50):
-    """Insert bond details data into TiDB in batches."""
+    Unchanged sources are read back from their staged parts without parsing. Without
+    pyarrow the file is parsed directly and normalized the same way.
+    """
+    try:
+        manifest = stage_source(file_path, table)
+        print(f"{'Reusing' if manifest['reused'] else 'Staged'} {manifest['rows']} {table} rows "
+              f"from {file_path} ({len(manifest['parts'])} parts)")
+        return read_staged(table)
+    except ImportError as e:
+        print(f"Staging unavailable ({str(e)}), parsing {file_path} directly")
+        df = pd.read_csv(file_path) if file_path.endswith('.csv') else load_excel_data(file_path)
+        return normalize_frame(df, table)
+
+def quarantine_rows(connection, table, rows):
+    """
+    Replace the quarantined rows of `table` with those of this load.
+
+    Args:
+        rows (DataFrame): Rejected source rows with a "reasons" column
+    """
     cursor = connection.cursor()
-    
-    # Process the dataframe
-    df = process_json_columns(df)
-    
-    # Clear existing data
-    cursor.execute("TRUNCATE TABLE bond_details")
+    cursor.execute("DELETE FROM ingest_quarantine WHERE table_name = %s", (table,))
+    quarantined_at = datetime.now().isoformat()
+    params = []
+    for record in rows.to_dict('records'):
+        reasons = record.pop('reasons')
+        payload = {
+            column: f"<{len(value)} characters>" if isinstance(value, str) and len(value) > QUARANTINE_VALUE_CHARS else value
+            for column, value in record.items()
+        }
+        params.append((table, record.get('id'), record.get('isin'), reasons, json.dumps(payload, default=str), quarantined_at))
+    for start in range(0, len(params), 1000):
+        cursor.executemany("""
+        INSERT INTO ingest_quarantine (table_name, row_id, isin, reasons, payload, quarantined_at)
+        VALUES (%s, %s, %s, %s, %s, %s)
+        """, params[start:start+1000])
     connection.commit()
+    cursor.close()
+    if params:
+        print(f"Quarantined {len(params)} {table} rows (see ingest_quarantine)")
 
-    # Replace NaN values with None (which becomes NULL in SQL)
-    df = df.replace({float('nan'): None, 'nan': None})
-    df = df.where(pd.notnull(df), None)
-    
-    total_records = len(df)
-    count = 0
-    next_log_threshold = 1000
-    
-    for batch_num, start in enumerate(range(0, total_records, batch_size), start=1):
-        batch = df.iloc[start:start+batch_size]
-        params = []
-        for _, row in batch.iterrows():
-            # Convert date columns with error handling
-            allotment_date = None
-            if pd.notna(row['allotment_date']):
-                try:
-                    # Explicitly specify dayfirst=True for DD-MM-YYYY format
-                    allotment_date = pd.to_datetime(row['allotment_date'], dayfirst=True).strftime('%Y-%m-%d')
-                except (ValueError, OverflowError, pd._libs.tslibs.np_datetime.OutOfBoundsDatetime) as e:
-                    print(f"Warning: Invalid allotment_date '{row['allotment_date']}' for ISIN {row.get('isin', 'unknown')}")
-            
-            maturity_date = None
-            if pd.notna(row['maturity_date']):
-                try:
-                    # Explicitly specify dayfirst=True for DD-MM-YYYY format
-                    maturity_date = pd.to_datetime(row['maturity_date'], dayfirst=True).strftime('%Y-%m-%d')
-                except (ValueError, OverflowError, pd._libs.tslibs.np_datetime.OutOfBoundsDatetime) as e:
-                    print(f"Warning: Invalid maturity_date '{row['maturity_date']}' for ISIN {row.get('isin', 'unknown')}")
-            
-            # Handle JSON columns
-            json_fields = {'issuer_details': None, 'instrument_details': None, 'coupon_details': None,
-                          'redemption_details': None, 'credit_rating_details': None, 'listing_details': None,
-                          'key_contacts_details': None, 'key_documents_details': None}
-            
-            for col in json_fields:
-                if col in row and pd.notna(row[col]):
-                    try:
-                        # If it's a dict, convert to JSON string
-                        if isinstance(row[col], dict):
-                            json_str = json.dumps(row[col])
-                        else:
-                            json_str = str(row[col])
-                            
-                        # Check size and truncate if needed
-                        max_size = 4000000  # ~4MB to be safe (MEDIUMTEXT limit is ~16MB)
-                        if len(json_str) > max_size:
-                            print(f"Warning: Truncating oversized {col} from {len(json_str)} bytes to {max_size} bytes for ISIN {row.get('isin', 'unknown')}")
-                            json_fields[col] = json_str[:max_size] + " ... [truncated]"
-                        else:
-                            json_fields[col] = json_str
-                    except Exception as json_error:
-                        print(f"Error processing JSON column {col} for ISIN {row.get('isin', 'unknown')}: {str(json_error)}")
-                        json_fields[col] = None
-            
-            params.append((
-                row['id'], row['created_at'], row['updated_at'], row['isin'], row['company_name'], 
-                row['issue_size'], allotment_date, maturity_date, row['issuer_details'], 
-                row['instrument_details'], row['coupon_details'], row['redemption_details'], 
-                row['credit_rating_details'], row['listing_details'], row['key_contacts_details'], 
-                row['key_documents_details']
-            ))
-        
+def _insert_batches(connection, sql, rows, batch_size, label):
+    """
+    executemany the rows in batches, one commit per batch.
+
+    Rows have been validated, so a batch should not fail; if one does, it is
+    rolled back and its rows are inserted one by one so only the offending rows
+    are lost.
+
+    Returns:
+        tuple: (rows inserted, [(row position, error message)] for rows the database rejected)
+    """
+    cursor = connection.cursor()
+    inserted = 0
+    rejected = []
+    next_log_threshold = 10000
+    for batch_num, start in enumerate(range(0, len(rows), batch_size), start=1):
+        batch = rows[start:start+batch_size]
         try:
-            cursor.executemany("""
-            INSERT INTO bond_details 
-            (id, created_at, updated_at, isin, company_name, issue_size, allotment_date, maturity_date,
-             issuer_details, instrument_details, coupon_details, redemption_details, credit_rating_details,
-             listing_details, key_contacts_details, key_documents_details)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            """, params)
+            cursor.executemany(sql, batch)
             connection.commit()
-            
-            count += len(batch)
-            if count >= next_log_threshold:
-                print(f"Completed {count} entries (batch number {batch_num})")
-                next_log_threshold += 1000
-                
+            inserted += len(batch)
         except Exception as e:
-            print(f"Error in batch {batch_num}: {e}")
             connection.rollback()
+            print(f"Error in {label} batch {batch_num}: {e}; inserting its rows one by one")
+            for position, row in enumerate(batch, start=start):
+                try:
+                    cursor.execute(sql, row)
+                    connection.commit()
+                    inserted += 1
+                except Exception as row_error:
+                    connection.rollback()
+                    rejected.append((position, f"insert: {str(row_error)}"))
+        if inserted >= next_log_threshold:
+            print(f"Completed {inserted} {label} entries (batch number {batch_num})")
+            next_log_threshold += 10000
+    cursor.close()
+    return inserted, rejected
+
+def _load_validated(connection, table, df, sql, columns, batch_size, prepare=None):
+    """
+    Validate staged rows, insert the valid ones and quarantine the rest.
+
+    Args:
+        columns (list): DataFrame columns in the order of the INSERT placeholders
+        prepare (callable): Optional transformation of the valid rows before they are inserted
+
+    Returns:
+        tuple: (DataFrame of the inserted rows, number of quarantined rows)
+    """
+    # Replace NaN values with None (which becomes NULL in SQL)
+    df = df.astype(object).where(pd.notnull(df), None)
+    for column in columns:
+        if column not in df.columns:
+            df[column] = None
     
-    print(f"Inserted {total_records} bond details records")
+    valid, quarantined = validate_rows(df, table)
+    if prepare is not None:
+        valid = prepare(valid)
+    rows = list(valid[columns].itertuples(index=False, name=None))
+    _, rejected = _insert_batches(connection, sql, rows, batch_size, table)
+    if rejected:
+        positions = [position for position, _ in rejected]
+        failed = valid.iloc[positions].copy()
+        failed['reasons'] = [reason for _, reason in rejected]
+        quarantined = pd.concat([quarantined, failed])
+        valid = valid.iloc[sorted(set(range(len(valid))) - set(positions))]
+    quarantine_rows(connection, table, quarantined)
+    return valid, len(quarantined)
+
+BOND_DETAILS_INSERT_COLUMNS = BOND_DETAILS_COLUMNS + list(BOND_JSON_FIELDS)
+
+def _add_summary_fields(df):
+    """Typed summary columns of bond_details rows, extracted from their JSON documents."""
+    summaries = pd.DataFrame([summary_fields(row) for row in df.reindex(columns=BOND_DOCUMENT_SECTIONS).to_dict('records')],
+                             index=df.index, columns=list(BOND_JSON_FIELDS))
+    summaries = summaries.astype(object).where(pd.notnull(summaries), None)
+    return pd.concat([df.drop(columns=list(BOND_JSON_FIELDS), errors='ignore'), summaries], axis=1)
+
+def insert_bond_documents(connection, df, batch_size=50):
+    """
+    Store the JSON documents of inserted bond_details rows, compressed, one row per section.
+
+    Documents are kept whole however large they are; a section the database
+    rejects is quarantined under bond_detail_documents with its document text.
+    """
+    rows = []
+    sources = []
+    for record in df.reindex(columns=['id', 'isin'] + BOND_DOCUMENT_SECTIONS).to_dict('records'):
+        for row in document_rows(record['id'], record):
+            rows.append(row)
+            sources.append({'id': record['id'], 'isin': record['isin'], 'section': row[1], 'document': record[row[1]]})
+    inserted, rejected = _insert_batches(connection, """
+    INSERT INTO bond_detail_documents (bond_id, section, bytes, payload)
+    VALUES (%s, %s, %s, %s)
+    """, rows, batch_size, 'bond_detail_documents')
+    failed = pd.DataFrame([dict(sources[position], reasons=reason) for position, reason in rejected],
+                          columns=['id', 'isin', 'section', 'document', 'reasons'])
+    quarantine_rows(connection, 'bond_detail_documents', failed)
+    lost = {position for position, _ in rejected}
+    stored = sum(row[2] for position, row in enumerate(rows) if position not in lost)
+    compressed = sum(len(row[3]) for position, row in enumerate(rows) if position not in lost)
+    print(f"Stored {inserted} bond documents ({stored} bytes, {compressed} compressed)")
+    return inserted
+
+def insert_bond_details(connection, df, batch_size=50):
+    """
+    Insert bond details data (staged rows, see load_source) into TiDB in batches, quarantining invalid rows.
+
+    The hot bond_details row gets the typed summary fields; the JSON documents go,
+    untruncated and compressed, to bond_detail_documents.
+    """
+    cursor = connection.cursor()
+    
+    # Clear existing data
+    cursor.execute("TRUNCATE TABLE bond_details")
+    cursor.execute("TRUNCATE TABLE bond_detail_documents")
+    # Tables created before the documents moved out still carry them; they are being reloaded anyway
+    for column in BOND_DOCUMENT_SECTIONS:
+        cursor.execute(f"ALTER TABLE bond_details DROP COLUMN IF EXISTS {column}")
+    connection.commit()
     cursor.close()
+    
+    loaded, quarantined = _load_validated(connection, 'bond_details', df, f"""
+    INSERT INTO bond_details 
+    ({', '.join(BOND_DETAILS_INSERT_COLUMNS)})
+    VALUES ({', '.join(['%s'] * len(BOND_DETAILS_INSERT_COLUMNS))})
+    """, BOND_DETAILS_INSERT_COLUMNS, batch_size, prepare=_add_summary_fields)
+    
+    print(f"Inserted {len(loaded)} bond details records ({quarantined} quarantined)")
+    
+    insert_bond_documents(connection, loaded, batch_size)
+    get_cache().bump_table_generation('bond_details', 'bond_detail_documents')
 
-def insert_cashflows(connection, df, batch_size=1000):
-    """Insert cashflows data into TiDB in batches."""
+def insert_cashflows(connection, df, batch_size=5000):
+    """Insert cashflows data (staged rows, see load_source) into TiDB in batches, quarantining invalid rows."""
     cursor = connection.cursor()
     
     # Clear existing data
     cursor.execute("TRUNCATE TABLE cashflows")
     connection.commit()
+    cursor.close()
+    
+    loaded, quarantined = _load_validated(connection, 'cashflows', df, """
+    INSERT INTO cashflows 
+    (id, isin, cash_flow_date, cash_flow_amount, record_date, principal_amount, interest_amount,
+     tds_amount, remaining_principal, state, created_at, updated_at)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+    """, ['id', 'isin', 'cash_flow_date', 'cash_flow_amount', 'record_date', 'principal_amount', 'interest_amount',
+          'tds_amount', 'remaining_principal', 'state', 'created_at', 'updated_at'], batch_size)
+    
+    print(f"Inserted {len(loaded)} cashflow records ({quarantined} quarantined)")
+    get_cache().bump_table_generation('cashflows')
 
-    # Replace NaN values with None (which becomes NULL in SQL)
-    df = df.replace({float('nan'): None, 'nan': None})
-    df = df.where(pd.notnull(df), None)
+def insert_projected_cashflows(connection, batch_size=1000):
+    """
+    Generate cash flow schedules for bonds that have no actual cashflows rows.
+
+    Schedules are projected from the coupon and instrument terms of bond_details
+    (see utils.schedules) and replace any previously projected rows.
+    """
+    cursor = connection.cursor(pymysql.cursors.DictCursor)
     
-    total_records = len(df)
-    for start in range(0, total_records, batch_size):
-        batch = df.iloc[start:start+batch_size]
-        params = []
-        for _, row in batch.iterrows():
-            cash_flow_date = pd.to_datetime(row['cash_flow_date']).strftime('%Y-%m-%d') if pd.notna(row['cash_flow_date']) else None
-            record_date = pd.to_datetime(row['record_date']).strftime('%Y-%m-%d') if pd.notna(row['record_date']) else None
-            params.append((
-                row['id'], row['isin'], cash_flow_date, row['cash_flow_amount'], record_date,
-                row['principal_amount'], row['interest_amount'], row['tds_amount'], row['remaining_principal'],
-                row['state'], row['created_at'], row['updated_at']
-            ))
-        
+    # Only the typed terms columns of the hot row are read
+    terms_columns = [BOND_COLUMN_MAPPING[name] for name in
+                     ("coupon_rate", "coupon_frequency", "coupon_basis", "face_value")]
+    cursor.execute(f"""
+    SELECT isin, allotment_date, maturity_date, {', '.join(terms_columns)}
+    FROM bond_details b
+    WHERE isin IS NOT NULL
+      AND NOT EXISTS (SELECT 1 FROM cashflows c WHERE c.isin = b.isin AND c.source = 'actual')
+    """)
+    terms, skipped = prepare_terms(cursor.fetchall())
+    schedule = build_schedules(terms)
+    rows = schedule_rows(terms, schedule, datetime.now().isoformat())
+    
+    cursor.execute("DELETE FROM cashflows WHERE source = 'projected'")
+    connection.commit()
+    
+    for start in range(0, len(rows), batch_size):
         cursor.executemany("""
         INSERT INTO cashflows 
         (id, isin, cash_flow_date, cash_flow_amount, record_date, principal_amount, interest_amount,
-         tds_amount, remaining_principal, state, created_at, updated_at)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-        """, params)
+         tds_amount, remaining_principal, state, source, created_at, updated_at)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        """, rows[start:start+batch_size])
         connection.commit()
     
-    print(f"Inserted {total_records} cashflow records")
+    print(f"Projected {len(rows)} cashflow records for {len(terms['isin'])} bonds "
+          f"({len(skipped)} bonds skipped for incomplete terms)")
     cursor.close()
+    get_cache().bump_table_generation('cashflows')
 
 def insert_company_insights(connection, df, batch_size=1000):
-    """Insert company insights data into TiDB in batches."""
+    """Insert company insights data (staged rows, see load_source) into TiDB in batches, quarantining invalid rows."""
     cursor = connection.cursor()
     
-    # Process the dataframe
-    df = process_json_columns(df)
-    
     # Clear existing data
     cursor.execute("TRUNCATE TABLE company_insights")
     connection.commit()
-
-    # Replace NaN values with None (which becomes NULL in SQL)
-    df = df.replace({float('nan'): None, 'nan': None})
-    df = df.where(pd.notnull(df), None)
+    cursor.close()
     
-    total_records = len(df)
-    for start in range(0, total_records, batch_size):
-        batch = df.iloc[start:start+batch_size]
-        params = []
-        for _, row in batch.iterrows():
-            for col in ['key_metrics', 'income_statement', 'balance_sheet', 'cashflow', 'lenders_profile',
-                        'comparison', 'borrowers_profile', 'shareholding_profile', 'pros', 'cons', 'key_personnel']:
-                if isinstance(row[col], (list, dict)):
-                    row[col] = json.dumps(row[col])
-                    
-            params.append((
-                row['id'], row['created_at'], row['updated_at'], row['company_name'], row['company_industry'],
-                row['description'], row['key_metrics'], row['income_statement'], row['balance_sheet'],
-                row['cashflow'], row['lenders_profile'], row['comparison'], row['borrowers_profile'],
-                row['shareholding_profile'], row['pros'], row['cons'], row['key_personnel'], row['news_and_events']
-            ))
-        
-        cursor.executemany("""
-        INSERT INTO company_insights 
-        (id, created_at, updated_at, company_name, company_industry, description, key_metrics,
-         income_statement, balance_sheet, cashflow, lenders_profile, comparison, borrowers_profile,
-         shareholding_profile, pros, cons, key_personnel, news_and_events)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-        """, params)
-        connection.commit()
+    loaded, quarantined = _load_validated(connection, 'company_insights', df, """
+    INSERT INTO company_insights 
+    (id, created_at, updated_at, company_name, company_industry, description, key_metrics,
+     income_statement, balance_sheet, cashflow, lenders_profile, comparison, borrowers_profile,
+     shareholding_profile, pros, cons, key_personnel, news_and_events)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+    """, ['id', 'created_at', 'updated_at', 'company_name', 'company_industry', 'description', 'key_metrics',
+          'income_statement', 'balance_sheet', 'cashflow', 'lenders_profile', 'comparison', 'borrowers_profile',
+          'shareholding_profile', 'pros', 'cons', 'key_personnel', 'news_and_events'], batch_size)
     
-    print(f"Inserted {total_records} company insight records")
-    cursor.close()
+    print(f"Inserted {len(loaded)} company insight records ({quarantined} quarantined)")
+    get_cache().bump_table_generation('company_insights')
+    
+    # Re-index descriptions, news, pros and cons for rows that changed
+    refresh_text_index(connection)
 
-def fetch_bond_by_isin(connection, isin):
-    """Fetch bond details by ISIN."""
+def fetch_bond_by_isin(connection, isin, sections=()):
+    """
+    Fetch bond details by ISIN: the hot row, plus the requested document sections.
+
+    Args:
+        sections (list): BOND_DOCUMENT_SECTIONS names to attach as JSON text; only
+            these are read from bond_detail_documents (None for all of them)
+    """
     cursor = connection.cursor(pymysql.cursors.DictCursor)
-    cursor.execute("SELECT * FROM bond_details WHERE isin = %s", (isin,))
+    cursor.execute(f"SELECT {', '.join(BOND_DETAILS_INSERT_COLUMNS)} FROM bond_details WHERE isin = %s", (isin,))
     result = cursor.fetchone()
+    if result is not None and (sections is None or sections):
+        documents = fetch_documents(cursor, [result['id']], sections)[result['id']]
+        for section in sections or BOND_DOCUMENT_SECTIONS:
+            result[section] = documents.get(section)
     cursor.close()
     return result
 
@@ -311,12 +482,12 @@ def main():
         # Create tables
         create_tables(connection)
         
-        # Define data files along with their processors and batch sizes.
+        # Define data files along with their target tables, processors and batch sizes.
         # For CSV files, change the file extension accordingly.
         data_files = [
-            {'file': '/home/deep/Desktop/work/web/hackathon/data/bonds_details.csv', 'processor': insert_bond_details, 'batch_size': 100},
-            # {'file': '/home/deep/Desktop/work/web/hackathon/data/cashflows.csv', 'processor': insert_cashflows, 'batch_size': 1000},
-            # {'file': '/home/deep/Desktop/work/web/hackathon/data/company_insights.csv', 'processor': insert_company_insights, 'batch_size': 1000}
+            {'file': '/home/deep/Desktop/work/web/hackathon/data/bonds_details.csv', 'table': 'bond_details', 'processor': insert_bond_details, 'batch_size': 100},
+            # {'file': '/home/deep/Desktop/work/web/hackathon/data/cashflows.csv', 'table': 'cashflows', 'processor': insert_cashflows, 'batch_size': 5000},
+            # {'file': '/home/deep/Desktop/work/web/hackathon/data/company_insights.csv', 'table': 'company_insights', 'processor': insert_company_insights, 'batch_size': 1000}
         ]
         
         # Process each file
@@ -326,18 +497,32 @@ def main():
             batch_size = data_file['batch_size']
             
             if os.path.exists(file_path):
-                # Load data based on file extension
-                if file_path.endswith('.csv'):
-                    print(f"Loading data from {file_path}...")
-                    df = pd.read_csv(file_path)
-                else:
-                    df = load_excel_data(file_path)
+                # Parse (in parallel, only if the file changed) into the staging area and read it back
+                df = load_source(file_path, data_file['table'])
                 
                 # Process and insert data in batches
                 processor(connection, df, batch_size)
             else:
                 print(f"File not found: {file_path}")
         
+        # Give every bond without a published schedule a projected one
+        insert_projected_cashflows(connection)
+        
+        # Revalue the stored portfolio positions whose bonds or cash flows changed
+        result = revalue()
+        print(f"Revalued {result['revalued']} of {result['checked']} portfolio positions.")
+        
+        # Refresh the columnar snapshot so batch jobs and new workers start from the new data
+        try:
+            manifest = write_snapshot()
+            print(f"Snapshot {manifest['version']} written.")
+        except ImportError as e:
+            print(f"Skipping snapshot: {str(e)}")
+        
+        # New cache key space for every worker, so nothing cached from the old data is served
+        generation = get_cache().bump_generation()
+        print(f"Cache generation {generation}.")
+        
         print("Data processing completed.")
     
     finally:
@@ -0,0 +1,39 @@
+import csv
+import io
+from . import json_codec
+
+def ndjson_chunks(row_chunks):
+    """Encode chunks of row dicts as newline-delimited JSON, one bytes block per chunk."""
+    for rows in row_chunks:
+        yield b"".join(json_codec.dumps_bytes(row) + b"\n" for row in rows)
+
+def _csv_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, (dict, list)):
+        return json_codec.dumps(value)
+    return value
+
+def csv_chunks(row_chunks):
+    """
+    Encode chunks of row dicts as CSV, one bytes block per chunk.
+
+    The header comes from the keys of the first row; every row of a query has the same keys.
+    """
+    columns = None
+    for rows in row_chunks:
+        if not rows:
+            continue
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        if columns is None:
+            columns = list(rows[0])
+            writer.writerow(columns)
+        writer.writerows([_csv_value(row.get(column)) for column in columns] for row in rows)
+        yield buffer.getvalue().encode("utf-8")
+
+# format -> (media type, encoder)
+EXPORT_FORMATS = {
+    "ndjson": ("application/x-ndjson", ndjson_chunks),
+    "csv": ("text/csv; charset=utf-8", csv_chunks),
+}
@@ -0,0 +1,165 @@
+"""
+Declarative WHERE clauses for the agents' filter objects.
+
+Each table has a registry of filter keys, each mapping to a SQL expression, an
+operator and a value coercion. A filter dict compiles to (conditions, params);
+the SQL text depends only on the filter keys used (and the bucketed size of IN
+lists), so it is built once per shape and reused, and the database sees a small
+set of stable statements whose plans it can cache.
+"""
+import functools
+from datetime import date
+
+# Largest number of distinct filter shapes kept per registry
+TEMPLATE_CACHE_SIZE = 1024
+
+_OPERATORS = {
+    "=": "{} = %s",
+    ">=": "{} >= %s",
+    "<=": "{} <= %s",
+    "contains": "{} LIKE %s",
+}
+
+class FilterError(ValueError):
+    """Raised for an unknown filter key or a value that doesn't fit the filter."""
+
+    def __init__(self, key, message):
+        super().__init__(f"filter {key!r}: {message}")
+        self.key = key
+        self.message = message
+
+def as_text(value):
+    if isinstance(value, (dict, list, bool)):
+        raise ValueError(f"expected a string, got {value!r}")
+    return str(value)
+
+def as_number(value):
+    if isinstance(value, bool):
+        raise ValueError(f"expected a number, got {value!r}")
+    if isinstance(value, (int, float)):
+        return value
+    try:
+        return float(str(value).replace(",", "").strip())
+    except ValueError:
+        raise ValueError(f"expected a number, got {value!r}")
+
+def as_date(value):
+    if isinstance(value, date):
+        return value.isoformat()[:10]
+    try:
+        return date.fromisoformat(str(value).strip()[:10]).isoformat()
+    except ValueError:
+        raise ValueError(f"expected a date (YYYY-MM-DD), got {value!r}")
+
+class Filter:
+    """
+    One filter key.
+
+    Args:
+        expression (str): SQL expression the value is compared with
+        operator (str): "=", ">=", "<=" or "contains" (LIKE %value%)
+        coerce (callable): Converts the raw value, raising ValueError when it doesn't fit
+        many (bool): Whether a list of values is accepted (compiled to IN)
+    """
+
+    __slots__ = ("expression", "operator", "coerce", "many")
+
+    def __init__(self, expression, operator="=", coerce=as_text, many=False):
+        if operator not in _OPERATORS:
+            raise ValueError(f"Unknown filter operator {operator!r}")
+        self.expression = expression
+        self.operator = operator
+        self.coerce = coerce
+        self.many = many
+
+    def condition(self, size=None):
+        """SQL condition for one value, or for an IN list of `size` values."""
+        if size is not None:
+            return f"{self.expression} IN ({', '.join(['%s'] * size)})"
+        return _OPERATORS[self.operator].format(self.expression)
+
+def range_filters(prefix, expression, coerce, suffixes=("min", "max", "equals")):
+    """Lower bound, upper bound and exact match filters named <prefix>_<suffix> on one expression."""
+    low, high, exact = suffixes
+    return {
+        f"{prefix}_{low}": Filter(expression, ">=", coerce),
+        f"{prefix}_{high}": Filter(expression, "<=", coerce),
+        f"{prefix}_{exact}": Filter(expression, "=", coerce),
+    }
+
+def _bucket(size):
+    """IN-list length to compile for `size` values: the next power of two, so few distinct statements exist."""
+    return 1 << (size - 1).bit_length()
+
+class FilterCompiler:
+    """
+    Compiles filter dicts for one table into parameterized SQL conditions.
+
+    Unknown keys raise FilterError instead of being dropped, so a misspelled
+    filter can never turn into an unfiltered scan. Keys whose value is None are
+    treated as absent.
+
+    Args:
+        fields (dict): Filter key -> Filter
+    """
+
+    def __init__(self, fields):
+        self.fields = dict(fields)
+        self._template = functools.lru_cache(maxsize=TEMPLATE_CACHE_SIZE)(self._build_template)
+
+    def __iter__(self):
+        return iter(self.fields)
+
+    def __contains__(self, key):
+        return key in self.fields
+
+    def coerce(self, key, value):
+        """
+        Check and convert the value of one filter.
+
+        Returns:
+            The coerced value, or a list of coerced values for a many-valued filter
+
+        Raises:
+            FilterError: If the key is unknown or the value doesn't fit
+        """
+        field = self.fields.get(key)
+        if field is None:
+            raise FilterError(key, "unknown filter")
+        try:
+            if isinstance(value, (list, tuple)):
+                if not field.many:
+                    raise ValueError("expected a single value, not a list")
+                if not value:
+                    raise ValueError("expected at least one value")
+                return [field.coerce(item) for item in value]
+            return field.coerce(value)
+        except ValueError as e:
+            raise FilterError(key, str(e))
+
+    def compile(self, filters):
+        """
+        Compile a filter dict.
+
+        Returns:
+            tuple: (conditions, params) for a WHERE clause joined with AND
+        """
+        shape = []
+        params = []
+        for key in sorted(filters or {}):
+            value = filters[key]
+            if value is None:
+                continue
+            value = self.coerce(key, value)
+            if isinstance(value, list):
+                size = _bucket(len(value))
+                # Padding with a repeated value leaves the IN list's meaning unchanged
+                params.extend(value + [value[-1]] * (size - len(value)))
+                shape.append((key, size))
+            else:
+                params.append(f"%{value}%" if self.fields[key].operator == "contains" else value)
+                shape.append((key, None))
+        return list(self._template(tuple(shape))), params
+
+    def _build_template(self, shape):
+        return tuple(self.fields[key].condition(size) for key, size in shape)
@@ -0,0 +1,115 @@
+import json
+from datetime import date, datetime, time
+from decimal import Decimal
+
+# orjson is several times faster than the standard library for both directions;
+# fall back to json when it isn't installed.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def loads(data):
+    """Decode a JSON document (str or bytes)."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def _default(obj):
+    """Encode types the backend doesn't handle natively."""
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if isinstance(obj, (datetime, date, time)):
+        return obj.isoformat()
+    if isinstance(obj, bytes):
+        return obj.decode("utf-8", errors="replace")
+    if isinstance(obj, LazyJSONRow):
+        return obj.materialize()
+    if isinstance(obj, dict):
+        return dict(obj.items())
+    if isinstance(obj, (list, tuple, set)):
+        return list(obj)
+    if isinstance(obj, str):
+        return str(obj)
+    if isinstance(obj, int):
+        return int(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+def dumps_bytes(obj, indent=None):
+    """
+    Encode an object as UTF-8 JSON bytes.
+
+    Decimal values (as returned by pymysql) become numbers and date/datetime
+    values become ISO 8601 strings, so DB results can be passed straight through.
+    """
+    if orjson is not None:
+        option = orjson.OPT_PASSTHROUGH_SUBCLASS | orjson.OPT_NON_STR_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=_default, option=option)
+    return json.dumps(obj, indent=indent, default=_default, ensure_ascii=False).encode()
+
+def dumps(obj, indent=None):
+    """Encode an object as a JSON string (see dumps_bytes)."""
+    return dumps_bytes(obj, indent=indent).decode()
+
+class LazyJSONRow(dict):
+    """
+    Result row whose JSON columns are decoded the first time they are read.
+
+    The raw column text is kept until a consumer actually touches the field, so
+    rows that are only inspected for a couple of scalar columns never pay for
+    parsing large documents. Values that fail to parse are left as strings.
+    """
+
+    __slots__ = ("_pending",)
+
+    def __init__(self, row, json_columns):
+        super().__init__(row)
+        self._pending = {column for column in json_columns if isinstance(row.get(column), (str, bytes))}
+
+    def _decode(self, key):
+        if key in self._pending:
+            self._pending.discard(key)
+            raw = super().__getitem__(key)
+            try:
+                super().__setitem__(key, loads(raw))
+            except ValueError:
+                pass
+
+    def __getitem__(self, key):
+        self._decode(key)
+        return super().__getitem__(key)
+
+    def __setitem__(self, key, value):
+        self._pending.discard(key)
+        super().__setitem__(key, value)
+
+    def get(self, key, default=None):
+        self._decode(key)
+        return super().get(key, default)
+
+    def pop(self, key, *default):
+        self._decode(key)
+        return super().pop(key, *default)
+
+    def materialize(self):
+        """Decode every pending column and return a plain dict."""
+        for key in list(self._pending):
+            self._decode(key)
+        return dict(super().items())
+
+    def items(self):
+        return self.materialize().items()
+
+    def values(self):
+        return self.materialize().values()
+
+    def copy(self):
+        return self.materialize()
+
+    def __repr__(self):
+        return repr(self.materialize())
+
+    def __reduce__(self):
+        return (dict, (self.materialize(),))
@@ -0,0 +1,435 @@
+import hashlib
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from . import json_codec
+from .cache import DiskBackend
+from .config import env_flag, load_env
+from .llm_gateway import get_gateway
+from .metrics import LLM_TOKENS, REGISTRY, span
+
+DEFAULT_MODEL = "gemini-2.0-flash"
+
+DEFAULT_CASSETTE_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "..", "data", "llm_cassette.jsonl"
+)
+
+# Returned on a replay miss when LLM_REPLAY_ON_MISS=stub
+REPLAY_MISS_CONTENT = "[replay] no recorded response for this prompt"
+
+# Timeout of a single request to Gemini; retries and the overall deadline belong to the gateway
+CALL_TIMEOUT_S = float(os.getenv("LLM_CALL_TIMEOUT_S", "30"))
+
+DEFAULT_MEMO_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "data", "llm_memo.sqlite")
+MEMO_MAX_ENTRIES = int(os.getenv("LLM_MEMO_MAX_ENTRIES", "50000"))
+# Part of every memo key: bump when the structured outputs the agents parse (query schemas,
+# filter JSON) change meaning without the prompt text changing, so old answers stop matching
+MEMO_SCHEMA_VERSION = "1"
+
+LLM_MEMO = REGISTRY.counter("tap_llm_memo_total", "Temperature-0 LLM calls looked up in the prompt memo", labelnames=("result",))
+
+class LLMMessage:
+    """Model response carrying the same `content` attribute as a LangChain AIMessage."""
+
+    def __init__(self, content):
+        self.content = content
+
+    def __repr__(self):
+        return f"LLMMessage({self.content!r})"
+
+class CassetteMiss(KeyError):
+    """Raised in replay mode when a prompt was never recorded."""
+
+def prompt_key(model, temperature, prompt_text):
+    """Stable hash identifying one model call."""
+    payload = f"{model}\x00{float(temperature)!r}\x00{prompt_text}".encode("utf-8")
+    return hashlib.sha256(payload).hexdigest()
+
+def _hint_key(model, temperature, hint):
+    return f"{model}\x00{float(temperature)!r}\x00{hint}"
+
+def response_text(response):
+    """Extract the text payload from whatever a model client returned."""
+    if hasattr(response, "content"):
+        return response.content
+    if isinstance(response, dict) and "text" in response:
+        return response["text"]
+    return response if isinstance(response, str) else str(response)
+
+class Cassette:
+    """
+    Append-only JSONL file of recorded model calls and /query traces.
+
+    Each line is either
+        {"kind": "llm", "key": ..., "model": ..., "temperature": ..., "hint": ..., "content": ..., "latency_ms": ...}
+    or
+        {"kind": "query", "query": ..., "recorded_at": ...}
+    """
+
+    def __init__(self, path=DEFAULT_CASSETTE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._hints = {}
+        self._queries = []
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    if line.strip():
+                        self._index(json_codec.loads(line))
+
+    def _index(self, record):
+        if record.get("kind") == "query":
+            self._queries.append(record["query"])
+            return
+        self._calls[record["key"]] = record
+        if record.get("hint") is not None:
+            self._hints[_hint_key(record["model"], record["temperature"], record["hint"])] = record
+
+    def _append(self, record):
+        with self._lock:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(self.path, "a") as f:
+                f.write(json_codec.dumps(record) + "\n")
+            self._index(record)
+
+    def record_call(self, key, model, temperature, hint, content, latency_ms):
+        self._append({
+            "kind": "llm",
+            "key": key,
+            "model": model,
+            "temperature": temperature,
+            "hint": hint,
+            "content": content,
+            "latency_ms": round(latency_ms, 3),
+        })
+
+    def record_query(self, query):
+        self._append({"kind": "query", "query": query, "recorded_at": datetime.now(timezone.utc).isoformat()})
+
+    def lookup(self, key, model=None, temperature=None, hint=None):
+        """Find a recorded call by exact prompt hash, falling back to the (model, temperature, hint) index."""
+        record = self._calls.get(key)
+        if record is None and hint is not None:
+            record = self._hints.get(_hint_key(model, temperature, hint))
+        return record
+
+    def queries(self):
+        """Recorded /query texts in arrival order."""
+        return list(self._queries)
+
+    def __len__(self):
+        return len(self._calls)
+
+class LiveTransport:
+    """
+    Calls Gemini through a single client per (model, api key), created on first use.
+
+    Temperature is passed per call, so the orchestrator and every agent share
+    one client instead of each building their own.
+    """
+
+    def __init__(self):
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def _client(self, model, api_key):
+        client_key = (model, api_key)
+        client = self._clients.get(client_key)
+        if client is None:
+            with self._lock:
+                client = self._clients.get(client_key)
+                if client is None:
+                    # Deferred: langchain_google_genai is the most expensive import in the service
+                    load_env()
+                    from langchain_google_genai import ChatGoogleGenerativeAI
+                    client = ChatGoogleGenerativeAI(
+                        model=model,
+                        google_api_key=os.getenv("GAI_PS", api_key),
+                        timeout=CALL_TIMEOUT_S,
+                        max_retries=1,
+                    )
+                    self._clients[client_key] = client
+        return client
+
+    def complete(self, model, temperature, prompt_text, hint=None, api_key=None, json_mode=False):
+        client = self._client(model, api_key)
+        generation_config = {"temperature": temperature}
+        if json_mode:
+            # Gemini JSON mode: the response is a bare JSON document, no fences or prose
+            generation_config["response_mime_type"] = "application/json"
+        return client.invoke(prompt_text, generation_config=generation_config)
+
+    def warm_up(self, model=DEFAULT_MODEL, api_key=None):
+        """Build the client ahead of the first request."""
+        self._client(model, api_key)
+
+    def record_query(self, query):
+        pass
+
+class RecordTransport:
+    """Forwards to another transport and appends every call to a cassette."""
+
+    def __init__(self, inner, cassette):
+        self.inner = inner
+        self.cassette = cassette
+
+    def complete(self, model, temperature, prompt_text, hint=None, api_key=None, json_mode=False):
+        start = time.perf_counter()
+        response = self.inner.complete(model, temperature, prompt_text, hint=hint, api_key=api_key, json_mode=json_mode)
+        latency_ms = (time.perf_counter() - start) * 1000
+        self.cassette.record_call(
+            prompt_key(model, temperature, prompt_text), model, temperature, hint, response_text(response), latency_ms
+        )
+        return response
+
+    def record_query(self, query):
+        self.cassette.record_query(query)
+
+    def warm_up(self, **kwargs):
+        if hasattr(self.inner, "warm_up"):
+            self.inner.warm_up(**kwargs)
+
+class ReplayTransport:
+    """
+    Serves calls from a cassette without touching the network.
+
+    Args:
+        cassette (Cassette): Recorded calls
+        latency: None/0 to answer immediately, "recorded" to sleep for the recorded
+            latency, or a number of milliseconds to sleep per call
+        on_miss (str): "error" to raise CassetteMiss, "stub" to answer REPLAY_MISS_CONTENT
+    """
+
+    def __init__(self, cassette, latency=None, on_miss="error"):
+        self.cassette = cassette
+        self.latency = latency
+        self.on_miss = on_miss
+        self.hits = 0
+        self.misses = 0
+
+    def complete(self, model, temperature, prompt_text, hint=None, api_key=None, json_mode=False):
+        key = prompt_key(model, temperature, prompt_text)
+        record = self.cassette.lookup(key, model=model, temperature=temperature, hint=hint)
+        if record is None:
+            self.misses += 1
+            if self.on_miss == "stub":
+                return LLMMessage(REPLAY_MISS_CONTENT)
+            raise CassetteMiss(f"No recorded LLM response for prompt {key[:12]} (hint: {hint!r})")
+
+        self.hits += 1
+        if self.latency == "recorded":
+            time.sleep(record.get("latency_ms", 0) / 1000.0)
+        elif self.latency:
+            time.sleep(float(self.latency) / 1000.0)
+        return LLMMessage(record["content"])
+
+    def record_query(self, query):
+        pass
+
+class PromptMemo:
+    """
+    Disk-persistent memo of deterministic (temperature 0) model responses.
+
+    Keyed by (model, temperature, rendered prompt hash, JSON mode) salted with
+    MEMO_SCHEMA_VERSION, stored in a SQLite file that survives restarts and
+    deploys, and bounded to max_entries with least recently used eviction.
+    Storage errors are treated as misses.
+    """
+
+    def __init__(self, path=DEFAULT_MEMO_PATH, max_entries=MEMO_MAX_ENTRIES, salt=MEMO_SCHEMA_VERSION):
+        self.salt = salt
+        self._store = DiskBackend(path, max_entries=max_entries)
+
+    def key(self, model, temperature, prompt_text, json_mode=False):
+        return f"{self.salt}:{prompt_key(model, temperature, prompt_text)}" + (":json" if json_mode else "")
+
+    def get(self, key):
+        try:
+            content = self._store.get(key)
+        except Exception:
+            content = None
+        LLM_MEMO.inc(result="hit" if content is not None else "miss")
+        return content.decode("utf-8") if content is not None else None
+
+    def put(self, key, content):
+        if not content:
+            return
+        try:
+            self._store.set(key, content.encode("utf-8"))
+        except Exception:
+            LLM_MEMO.inc(result="error")
+
+_memo = None
+_memo_lock = threading.Lock()
+
+def get_memo():
+    """
+    Get the process-wide prompt memo, or None when LLM_MEMO is off or its file can't be opened.
+
+    LLM_MEMO_PATH sets the file (default data/llm_memo.sqlite), LLM_MEMO_SALT adds to the key salt.
+    """
+    global _memo
+    if _memo is None:
+        with _memo_lock:
+            if _memo is None:
+                load_env()
+                _memo = False
+                if env_flag("LLM_MEMO", default=True):
+                    try:
+                        _memo = PromptMemo(
+                            os.getenv("LLM_MEMO_PATH", DEFAULT_MEMO_PATH),
+                            salt=MEMO_SCHEMA_VERSION + os.getenv("LLM_MEMO_SALT", ""),
+                        )
+                    except Exception as e:
+                        print(f"Prompt memo disabled: {str(e)}")
+    return _memo or None
+
+def set_memo(memo):
+    """Install a prompt memo (None re-reads the environment on next use, False disables it)."""
+    global _memo
+    with _memo_lock:
+        _memo = memo
+
+_transport = None
+_transport_lock = threading.Lock()
+
+def transport_from_env():
+    """
+    Build the transport selected by LLM_TRANSPORT (live, record or replay).
+
+    LLM_CASSETTE sets the cassette path, LLM_REPLAY_LATENCY ("recorded" or milliseconds)
+    and LLM_REPLAY_ON_MISS ("error" or "stub") tune replay mode.
+    """
+    load_env()
+    mode = os.getenv("LLM_TRANSPORT", "live").lower()
+    if mode == "live":
+        return LiveTransport()
+
+    cassette = Cassette(os.getenv("LLM_CASSETTE", DEFAULT_CASSETTE_PATH))
+    if mode == "record":
+        return RecordTransport(LiveTransport(), cassette)
+    if mode == "replay":
+        return ReplayTransport(
+            cassette,
+            latency=os.getenv("LLM_REPLAY_LATENCY") or None,
+            on_miss=os.getenv("LLM_REPLAY_ON_MISS", "error")
+        )
+    raise ValueError(f"Unknown LLM_TRANSPORT '{mode}' (expected live, record or replay)")
+
+def get_transport():
+    """Get the process-wide transport (created from the environment on first use)."""
+    global _transport
+    if _transport is None:
+        with _transport_lock:
+            if _transport is None:
+                _transport = transport_from_env()
+    return _transport
+
+def set_transport(transport):
+    """Install a transport for all LLM calls (None re-reads the environment on next use)."""
+    global _transport
+    with _transport_lock:
+        _transport = transport
+
+def record_query(query):
+    """Add a /query request to the cassette when recording."""
+    get_transport().record_query(query)
+
+def warm_up_in_background():
+    """
+    Construct the model client on a background thread when LLM_WARMUP is enabled.
+
+    The service reports ready immediately; the first request only waits if it
+    arrives before the warm-up finishes.
+    """
+    transport = get_transport()
+    if not env_flag("LLM_WARMUP", default=True) or not hasattr(transport, "warm_up"):
+        return None
+    thread = threading.Thread(target=transport.warm_up, name="llm-warmup", daemon=True)
+    thread.start()
+    return thread
+
+class LLM:
+    """
+    Model handle held by the orchestrator and agents.
+
+    It only carries the call settings; every invoke goes through the LLM gateway
+    (rate limits, retries, deadlines) and then the active transport, so calls can
+    be recorded, replayed or stubbed in one place. Live calls at temperature 0 are
+    answered from the prompt memo when the same prompt was sent before.
+    """
+
+    def __init__(self, model=DEFAULT_MODEL, temperature=0, api_key=None, name=""):
+        self.model = model
+        self.temperature = temperature
+        self.api_key = api_key
+        self.name = name
+
+    def invoke(self, prompt, hint=None, deadline_s=None, json_mode=False):
+        """
+        Send a prompt (str or LangChain PromptValue) to the model.
+
+        json_mode asks the model for a bare JSON document (structured output).
+        """
+        prompt_text = prompt.to_string() if hasattr(prompt, "to_string") else str(prompt)
+        transport = get_transport()
+        key = prompt_key(self.model, self.temperature, prompt_text) + (":json" if json_mode else "")
+        # Recording needs every call to reach the model, and replayed or fake calls are free anyway
+        memo = get_memo() if self.temperature == 0 and isinstance(transport, LiveTransport) else None
+        with span("llm", component=self.name, model=self.model, prompt_chars=len(prompt_text)) as llm_span:
+            if memo is not None:
+                memo_key = memo.key(self.model, self.temperature, prompt_text, json_mode)
+                content = memo.get(memo_key)
+                if content is not None:
+                    llm_span.set(memo="hit")
+                    return LLMMessage(content)
+
+            response = get_gateway().call(
+                lambda: transport.complete(
+                    self.model, self.temperature, prompt_text, hint=hint, api_key=self.api_key, json_mode=json_mode
+                ),
+                key=key,
+                deadline_s=deadline_s,
+            )
+
+            usage = getattr(response, "usage_metadata", None) or {}
+            if usage:
+                llm_span.set(input_tokens=usage.get("input_tokens"), output_tokens=usage.get("output_tokens"))
+                LLM_TOKENS.inc(usage.get("input_tokens") or 0, model=self.model, direction="input")
+                LLM_TOKENS.inc(usage.get("output_tokens") or 0, model=self.model, direction="output")
+            if memo is not None:
+                memo.put(memo_key, response_text(response))
+        return response
+
+class PromptTemplate:
+    """
+    Lightweight replacement for LangChain's f-string PromptTemplate.
+
+    Same {variable} / {{literal}} semantics via str.format, without importing
+    langchain on the serving path.
+    """
+
+    def __init__(self, template, input_variables):
+        self.template = template
+        self.input_variables = list(input_variables)
+
+    def format(self, **kwargs):
+        return self.template.format(**kwargs)
+
+class PromptChain:
+    """
+    Renders a prompt template and sends it to an LLM handle (replaces RunnableSequence(prompt, llm)).
+
+    Chains whose output is parsed as JSON set json_mode so the model is asked for structured output.
+    """
+
+    def __init__(self, prompt, llm, json_mode=False):
+        self.prompt = prompt
+        self.llm = llm
+        self.json_mode = json_mode
+
+    def invoke(self, inputs):
+        # The user query identifies the call when replaying against changed data
+        return self.llm.invoke(self.prompt.format(**inputs), hint=inputs.get("query"), json_mode=self.json_mode)
@@ -0,0 +1,228 @@
+import os
+import random
+import re
+import threading
+import time
+from .metrics import REGISTRY, span
+
+# Upper bound on model calls in flight across the whole process
+MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+# Sustained calls per second and burst size of the token bucket (0 disables rate limiting)
+RATE_PER_S = float(os.getenv("LLM_RATE_PER_S", "20"))
+BURST = int(os.getenv("LLM_BURST", "20"))
+MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+BACKOFF_BASE_S = float(os.getenv("LLM_BACKOFF_BASE_S", "0.5"))
+BACKOFF_MAX_S = float(os.getenv("LLM_BACKOFF_MAX_S", "8"))
+# Total time budget for one call, including queueing and retries
+DEADLINE_S = float(os.getenv("LLM_DEADLINE_S", "60"))
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+_STATUS_RE = re.compile(r"\b(429|500|502|503|504)\b|RESOURCE_EXHAUSTED|UNAVAILABLE|DEADLINE_EXCEEDED")
+
+GATEWAY_RETRIES = REGISTRY.counter("tap_llm_retries_total", "LLM calls retried after a transient error", labelnames=("reason",))
+GATEWAY_COALESCED = REGISTRY.counter("tap_llm_coalesced_total", "LLM calls answered by an identical call already in flight")
+GATEWAY_REJECTED = REGISTRY.counter("tap_llm_deadline_exceeded_total", "LLM calls abandoned at their deadline", labelnames=("stage",))
+GATEWAY_IN_FLIGHT = REGISTRY.gauge("tap_llm_in_flight", "LLM calls currently being sent to the model")
+
+class LLMDeadlineExceeded(TimeoutError):
+    """Raised when a call could not complete within its deadline."""
+
+def _status_of(exc):
+    """HTTP-style status of a model client error, if one can be determined."""
+    for attr in ("status_code", "code", "status"):
+        value = getattr(exc, attr, None)
+        if isinstance(value, int):
+            return int(value)
+    response = getattr(exc, "response", None)
+    if isinstance(getattr(response, "status_code", None), int):
+        return response.status_code
+    return None
+
+def retry_reason(exc):
+    """
+    Classify an error from the model client.
+
+    Returns:
+        str or None: The retry reason ("429", "503", "timeout", ...) or None when the
+            error is permanent
+    """
+    status = _status_of(exc)
+    if status is not None:
+        return str(status) if status in RETRYABLE_STATUS else None
+    if isinstance(exc, (TimeoutError, ConnectionError)):
+        return "timeout" if isinstance(exc, TimeoutError) else "connection"
+    # Wrapped client errors (e.g. ChatGoogleGenerativeAIError) only carry the status in the message
+    match = _STATUS_RE.search(str(exc))
+    if match:
+        return match.group(1) or match.group(0).lower()
+    return None
+
+def _retry_after(exc):
+    """Server-suggested delay in seconds, when the error carries one."""
+    value = getattr(exc, "retry_after", None)
+    if value is None:
+        headers = getattr(getattr(exc, "response", None), "headers", None) or {}
+        value = headers.get("Retry-After") if hasattr(headers, "get") else None
+    try:
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+class TokenBucket:
+    """Token bucket refilled at `rate` tokens per second, holding at most `burst` tokens."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, deadline):
+        """Take one token, waiting until `deadline` (monotonic time). Returns False on timeout."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait = (1 - self._tokens) / self.rate
+            if now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+class _Flight:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class LLMGateway:
+    """
+    Single entry point for model calls.
+
+    Every call is subject to a process-wide concurrency cap and token-bucket rate
+    limit, is retried with exponential backoff and full jitter on 429/5xx and
+    timeouts, and must finish within its deadline. Calls with the same key that
+    arrive while an identical call is in flight wait for and share its result
+    instead of hitting the model again.
+
+    Args:
+        max_concurrency (int): Calls in flight at once, None for no cap
+        rate_per_s (float): Sustained calls per second, None/0 for no rate limit
+        burst (int): Token bucket size
+        max_retries (int): Retries after the first attempt
+        backoff_base_s (float): First backoff ceiling, doubled on every retry
+        backoff_max_s (float): Largest backoff ceiling
+        deadline_s (float): Default time budget per call
+    """
+
+    def __init__(self, max_concurrency=MAX_CONCURRENCY, rate_per_s=RATE_PER_S, burst=BURST, max_retries=MAX_RETRIES,
+                 backoff_base_s=BACKOFF_BASE_S, backoff_max_s=BACKOFF_MAX_S, deadline_s=DEADLINE_S):
+        self._slots = threading.BoundedSemaphore(max_concurrency) if max_concurrency else None
+        self._bucket = TokenBucket(rate_per_s, burst) if rate_per_s else None
+        self.max_retries = max_retries
+        self.backoff_base_s = backoff_base_s
+        self.backoff_max_s = backoff_max_s
+        self.deadline_s = deadline_s
+        self._flights = {}
+        self._flights_lock = threading.Lock()
+        self._random = random.Random()
+
+    def call(self, fn, key=None, deadline_s=None):
+        """
+        Run `fn()` (one model call) through the gateway.
+
+        Args:
+            fn (callable): Performs the call and returns the response
+            key (str): Identity of the call for in-flight coalescing, None to never coalesce
+            deadline_s (float): Time budget overriding the gateway default
+
+        Returns:
+            The response of `fn`, possibly produced by an identical concurrent call
+        """
+        deadline = time.monotonic() + (deadline_s or self.deadline_s)
+        if key is None:
+            return self._call_with_retries(fn, deadline)
+
+        with self._flights_lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if not leader:
+            GATEWAY_COALESCED.inc()
+            if not flight.done.wait(max(0.0, deadline - time.monotonic())):
+                GATEWAY_REJECTED.inc(stage="coalesced")
+                raise LLMDeadlineExceeded("Timed out waiting for an identical in-flight LLM call")
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = self._call_with_retries(fn, deadline)
+            return flight.result
+        except BaseException as exc:
+            flight.error = exc
+            raise
+        finally:
+            with self._flights_lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+
+    def _acquire(self, deadline):
+        with span("llm_queue"):
+            if self._bucket is not None and not self._bucket.acquire(deadline):
+                GATEWAY_REJECTED.inc(stage="rate_limit")
+                raise LLMDeadlineExceeded("LLM rate limit: no capacity before the call deadline")
+            if self._slots is not None and not self._slots.acquire(timeout=max(0.0, deadline - time.monotonic())):
+                GATEWAY_REJECTED.inc(stage="concurrency")
+                raise LLMDeadlineExceeded("LLM concurrency limit: no free slot before the call deadline")
+
+    def _call_with_retries(self, fn, deadline):
+        attempt = 0
+        while True:
+            self._acquire(deadline)
+            GATEWAY_IN_FLIGHT.inc()
+            try:
+                return fn()
+            except Exception as exc:
+                reason = retry_reason(exc)
+                if reason is None or attempt >= self.max_retries:
+                    raise
+                ceiling = min(self.backoff_max_s, self.backoff_base_s * (2 ** attempt))
+                delay = max(self._random.uniform(0, ceiling), _retry_after(exc) or 0.0)
+                if time.monotonic() + delay >= deadline:
+                    GATEWAY_REJECTED.inc(stage="retry")
+                    raise
+                GATEWAY_RETRIES.inc(reason=reason)
+            finally:
+                GATEWAY_IN_FLIGHT.inc(-1)
+                if self._slots is not None:
+                    self._slots.release()
+            # Back off outside the concurrency slot so other calls can use it
+            time.sleep(delay)
+            attempt += 1
+
+_gateway = None
+_gateway_lock = threading.Lock()
+
+def get_gateway():
+    """Get the process-wide gateway (configured from the LLM_* environment variables on first use)."""
+    global _gateway
+    if _gateway is None:
+        with _gateway_lock:
+            if _gateway is None:
+                _gateway = LLMGateway()
+    return _gateway
+
+def set_gateway(gateway):
+    """Install a gateway for all LLM calls (None rebuilds the default on next use)."""
+    global _gateway
+    with _gateway_lock:
+        _gateway = gateway
@@ -0,0 +1,232 @@
+import bisect
+import contextvars
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# Latency buckets in seconds, from sub-millisecond SQL up to slow LLM calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+ROW_BUCKETS = (0, 1, 5, 10, 50, 100, 500, 1000, 5000, 10000)
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+def _format_value(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+class Counter:
+    """Monotonic counter with optional labels."""
+
+    type_name = "counter"
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, labels, value) for labels, value in sorted(self._values.items())]
+
+    def render(self):
+        return [f"{name}{_format_labels(self.labelnames, labels)} {_format_value(value)}" for name, labels, value in self.samples()]
+
+class Gauge(Counter):
+    """Value that can be set to anything."""
+
+    type_name = "gauge"
+
+    def set(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            self._values[key] = value
+
+class Histogram:
+    """Cumulative-bucket histogram with optional labels."""
+
+    type_name = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def snapshot(self):
+        """Return {labels: (bucket counts, sum, count)}."""
+        with self._lock:
+            return {key: (list(counts), total, count) for key, (counts, total, count) in self._series.items()}
+
+    def render(self):
+        lines = []
+        for labels, (counts, total, count) in sorted(self.snapshot().items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, ('le', _format_value(bound)))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, ('le', '+Inf'))} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {count}")
+        return lines
+
+class Registry:
+    """Named collection of metrics rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name, help_text, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help_text, **kwargs)
+            return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._get_or_create(Counter, name, help_text, labelnames=labelnames)
+
+    def gauge(self, name, help_text, labelnames=()):
+        return self._get_or_create(Gauge, name, help_text, labelnames=labelnames)
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._get_or_create(Histogram, name, help_text, labelnames=labelnames, buckets=buckets)
+
+    def render(self):
+        lines = []
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda metric: metric.name)
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+SPAN_SECONDS = REGISTRY.histogram(
+    "tap_span_duration_seconds", "Duration of instrumented pipeline steps", labelnames=("span", "component")
+)
+SPAN_ERRORS = REGISTRY.counter(
+    "tap_span_errors_total", "Pipeline steps that raised an exception", labelnames=("span", "component")
+)
+REQUEST_SECONDS = REGISTRY.histogram("tap_request_duration_seconds", "End-to-end /query latency")
+LLM_TOKENS = REGISTRY.counter("tap_llm_tokens_total", "Tokens sent to and received from the LLM", labelnames=("model", "direction"))
+SQL_ROWS = REGISTRY.histogram("tap_sql_rows", "Rows returned per execute_query call", buckets=ROW_BUCKETS)
+
+class RequestTrace:
+    """Spans recorded while serving one request."""
+
+    def __init__(self, request_id=None):
+        self.request_id = request_id or uuid.uuid4().hex
+        self.started = time.perf_counter()
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, record):
+        with self._lock:
+            self.spans.append(record)
+
+    def breakdown(self):
+        """Per-request timing summary suitable for returning to the client."""
+        totals = {}
+        for record in self.spans:
+            entry = totals.setdefault(record["span"], {"count": 0, "total_ms": 0.0})
+            entry["count"] += 1
+            entry["total_ms"] = round(entry["total_ms"] + record["duration_ms"], 3)
+        return {
+            "request_id": self.request_id,
+            "total_ms": round((time.perf_counter() - self.started) * 1000, 3),
+            "by_span": totals,
+            "spans": list(self.spans),
+        }
+
+_current_trace = contextvars.ContextVar("tap_request_trace", default=None)
+
+def current_trace():
+    """The RequestTrace of the request being served, if any."""
+    return _current_trace.get()
+
+@contextmanager
+def request_trace(request_id=None):
+    """Collect spans for one request and record its overall latency."""
+    trace = RequestTrace(request_id)
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+        REQUEST_SECONDS.observe(time.perf_counter() - trace.started)
+
+class Span:
+    """Handle yielded by `span()`; attributes set on it end up in the request trace."""
+
+    __slots__ = ("attrs",)
+
+    def __init__(self, attrs):
+        self.attrs = attrs
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+@contextmanager
+def span(name, component="", **attrs):
+    """
+    Time a pipeline step.
+
+    The duration is added to the tap_span_duration_seconds histogram and, when
+    called inside request_trace(), to that request's span list together with
+    the request id and any attributes set on the yielded Span.
+    """
+    handle = Span(dict(attrs))
+    start = time.perf_counter()
+    failed = False
+    try:
+        yield handle
+    except BaseException:
+        failed = True
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        SPAN_SECONDS.observe(duration, span=name, component=component)
+        if failed:
+            SPAN_ERRORS.inc(span=name, component=component)
+
+        trace = _current_trace.get()
+        if trace is not None:
+            record = {"span": name, "duration_ms": round(duration * 1000, 3)}
+            if component:
+                record["component"] = component
+            if failed:
+                record["error"] = True
+            record.update(handle.attrs)
+            trace.add(record)
@@ -0,0 +1,132 @@
+import base64
+import binascii
+import hashlib
+from . import json_codec
+from .tidb_connector import execute_query
+
+DEFAULT_PAGE_SIZE = 10
+MAX_PAGE_SIZE = 100
+
+# Keyset sort columns per table; each has a (column, id) index so every page is an index range scan
+SORT_KEYS = {
+    "bond_details": ("isin", "maturity_date"),
+    "cashflows": ("cash_flow_date",),
+    "company_insights": ("company_name",),
+}
+DEFAULT_SORT = {
+    "bond_details": "isin",
+    "cashflows": "cash_flow_date",
+    "company_insights": "company_name",
+}
+
+# Helper columns selected to build the next cursor, removed from the returned rows
+_SORT_ALIAS = "__page_sort"
+_ID_ALIAS = "__page_id"
+
+class CursorError(ValueError):
+    """Raised for a malformed cursor or one issued for a different query."""
+
+def clamp_limit(limit, default=DEFAULT_PAGE_SIZE):
+    """Page size to use for a requested limit: missing means default, anything above MAX_PAGE_SIZE is capped."""
+    try:
+        limit = int(limit) if limit else default
+    except (TypeError, ValueError):
+        limit = default
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+def _query_fingerprint(table, sort, filters):
+    payload = json_codec.dumps_bytes({"table": table, "sort": sort, "filters": filters or {}})
+    return hashlib.sha1(payload).hexdigest()[:12]
+
+def encode_cursor(table, sort, filters, last_key):
+    """Opaque continuation token for the page after the row with sort key `last_key`."""
+    payload = {"q": _query_fingerprint(table, sort, filters), "k": list(last_key)}
+    return base64.urlsafe_b64encode(json_codec.dumps_bytes(payload)).rstrip(b"=").decode("ascii")
+
+def decode_cursor(token, table, sort, filters):
+    """
+    Read a continuation token.
+
+    Returns:
+        list: [last sort value, last id]
+
+    Raises:
+        CursorError: If the token is malformed or belongs to another query
+    """
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        payload = json_codec.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        last_key = payload["k"]
+        fingerprint = payload["q"]
+    except (ValueError, KeyError, TypeError, binascii.Error, UnicodeError):
+        raise CursorError("Invalid cursor")
+    if fingerprint != _query_fingerprint(table, sort, filters) or len(last_key) != 2:
+        raise CursorError("Cursor does not belong to this query (table, sort and filters must be unchanged)")
+    return last_key
+
+def fetch_page(table, sql_columns, conditions, params, filters=None, sort=None, cursor=None, limit=None,
+               select_params=(), sort_expr=None, sort_params=(), json_columns=None, cache=False):
+    """
+    Fetch one page of a query with keyset pagination.
+
+    Rows are ordered by (sort key, id) and the page after a cursor starts right after
+    its last row, so every page costs the same however deep it is. Rows whose sort
+    key is NULL can't be positioned and are left out.
+
+    Args:
+        table (str): Table name
+        sql_columns (list): SELECT expressions
+        conditions (list): WHERE conditions
+        params (list): Params for the conditions
+        filters (dict): The caller's filters; cursors are only valid for the same filters
+        sort (str): Sort key name (one of SORT_KEYS[table]), default DEFAULT_SORT[table]
+        cursor (str): Continuation token from a previous page
+        limit (int): Page size, capped at MAX_PAGE_SIZE
+        select_params (iterable): Params for placeholders in sql_columns
+        sort_expr (str): SQL expression to sort by instead of the `sort` column
+        sort_params (iterable): Params for placeholders in sort_expr
+        json_columns (iterable): Passed through to execute_query
+        cache (bool): Passed through to execute_query
+
+    Returns:
+        dict: {"count", "results", "next_cursor"} (next_cursor is None on the last page)
+            or an error dict
+    """
+    sort = sort or DEFAULT_SORT[table]
+    if sort_expr is None:
+        if sort not in SORT_KEYS[table]:
+            return {"error": f"Unsupported sort '{sort}' for {table} (expected one of {', '.join(SORT_KEYS[table])})"}
+        sort_expr = sort
+    limit = clamp_limit(limit)
+    sort_params = list(sort_params)
+
+    try:
+        last_key = decode_cursor(cursor, table, sort, filters) if cursor else None
+    except CursorError as e:
+        return {"error": str(e)}
+
+    query_params = list(select_params) + sort_params + list(params)
+    conditions = list(conditions) + [f"{sort_expr} IS NOT NULL"]
+    query_params += sort_params
+    if last_key is not None:
+        conditions.append(f"({sort_expr} > %s OR ({sort_expr} = %s AND id > %s))")
+        query_params += sort_params + [last_key[0]] + sort_params + [last_key[0], last_key[1]]
+
+    sql = (f"SELECT {', '.join(sql_columns)}, {sort_expr} AS {_SORT_ALIAS}, id AS {_ID_ALIAS} "
+           f"FROM tap_bonds.{table} WHERE {' AND '.join(conditions)} "
+           f"ORDER BY {_SORT_ALIAS}, {_ID_ALIAS} LIMIT {limit + 1}")
+    result = execute_query(sql, tuple(query_params), json_columns=json_columns, cache=cache)
+    if "error" in result:
+        return result
+
+    rows = result["results"]
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(table, sort, filters, [last[_SORT_ALIAS], last[_ID_ALIAS]])
+    for row in rows:
+        row.pop(_SORT_ALIAS, None)
+        row.pop(_ID_ALIAS, None)
+
+    return {"count": len(rows), "results": rows, "next_cursor": next_cursor}
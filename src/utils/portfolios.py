@@ -0,0 +1,300 @@
+"""
+Stored portfolios and their incrementally maintained valuations.
+
+A portfolio is a list of positions (ISIN, units, cost per unit, settlement
+date). Analytics for each position are computed from its bond's cash flows and
+stored in position_valuations together with a fingerprint of everything they
+depend on: the bond_details and cashflows rows of the ISIN, the position itself
+and the valuation date. revalue() recomputes only positions whose fingerprint
+changed, so a data reload touching a few bonds revalues only their positions,
+and dashboards read the stored values without recomputing anything.
+"""
+import hashlib
+import uuid
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+import numpy as np
+from . import json_codec
+from .filter_compiler import as_date
+from .scenarios import solve_yields
+from .tidb_connector import execute_query, execute_write
+
+ISIN_BATCH = 500
+MAX_POSITIONS = 5000
+
+class PortfolioError(ValueError):
+    """Raised for an invalid portfolio or position."""
+
+class PortfolioNotFound(LookupError):
+    """Raised when a portfolio id doesn't exist."""
+
+def _rows(sql, params=()):
+    result = execute_query(sql, tuple(params))
+    if "error" in result:
+        raise RuntimeError(result["error"])
+    return result["results"]
+
+def _batches(values):
+    for i in range(0, len(values), ISIN_BATCH):
+        batch = values[i:i + ISIN_BATCH]
+        yield batch, ", ".join(["%s"] * len(batch))
+
+def _decimal(value, name, i, required=True):
+    if value is None and not required:
+        return None
+    try:
+        number = Decimal(str(value))
+    except (InvalidOperation, ValueError):
+        raise PortfolioError(f"positions[{i}]: {name} must be a number")
+    if not number.is_finite() or number < 0:
+        raise PortfolioError(f"positions[{i}]: {name} must be a non-negative number")
+    return number
+
+def parse_positions(positions):
+    """Validate [{"isin", "units", "cost" (per unit, optional), "settlement_date" (optional)}]."""
+    if not isinstance(positions, list) or not positions:
+        raise PortfolioError("positions must be a non-empty list of {isin, units, cost, settlement_date}")
+    if len(positions) > MAX_POSITIONS:
+        raise PortfolioError(f"At most {MAX_POSITIONS} positions per portfolio")
+    parsed = []
+    for i, position in enumerate(positions):
+        if not isinstance(position, dict) or not isinstance(position.get("isin"), str):
+            raise PortfolioError(f"positions[{i}]: expected an object with an isin")
+        settlement = position.get("settlement_date")
+        try:
+            settlement = as_date(settlement) if settlement else None
+        except ValueError as e:
+            raise PortfolioError(f"positions[{i}]: settlement_date {e}")
+        parsed.append({
+            "isin": position["isin"],
+            "units": _decimal(position.get("units", 1), "units", i),
+            "cost": _decimal(position.get("cost"), "cost", i, required=False),
+            "settlement_date": settlement,
+        })
+    return parsed
+
+def create_portfolio(name, positions):
+    """Store a new portfolio, value its positions and return it."""
+    positions = parse_positions(positions)
+    portfolio_id = uuid.uuid4().hex
+    now = datetime.now().isoformat()
+    execute_write([
+        ("INSERT INTO tap_bonds.portfolios (id, name, created_at, updated_at) VALUES (%s, %s, %s, %s)",
+         [(portfolio_id, name, now, now)]),
+        _insert_positions(portfolio_id, positions),
+    ])
+    revalue(portfolio_ids=[portfolio_id])
+    return get_portfolio(portfolio_id)
+
+def replace_positions(portfolio_id, positions):
+    """Replace all positions of a portfolio, value the new ones and return it."""
+    positions = parse_positions(positions)
+    _require_portfolio(portfolio_id)
+    execute_write([
+        ("DELETE FROM tap_bonds.position_valuations WHERE portfolio_id = %s", [(portfolio_id,)]),
+        ("DELETE FROM tap_bonds.portfolio_positions WHERE portfolio_id = %s", [(portfolio_id,)]),
+        ("UPDATE tap_bonds.portfolios SET updated_at = %s WHERE id = %s", [(datetime.now().isoformat(), portfolio_id)]),
+        _insert_positions(portfolio_id, positions),
+    ])
+    revalue(portfolio_ids=[portfolio_id])
+    return get_portfolio(portfolio_id)
+
+def _insert_positions(portfolio_id, positions):
+    return (
+        "INSERT INTO tap_bonds.portfolio_positions (id, portfolio_id, isin, units, cost, settlement_date) "
+        "VALUES (%s, %s, %s, %s, %s, %s)",
+        [(uuid.uuid4().hex, portfolio_id, p["isin"], str(p["units"]), None if p["cost"] is None else str(p["cost"]),
+          p["settlement_date"]) for p in positions],
+    )
+
+def _require_portfolio(portfolio_id):
+    rows = _rows("SELECT id, name, created_at, updated_at FROM tap_bonds.portfolios WHERE id = %s", (portfolio_id,))
+    if not rows:
+        raise PortfolioNotFound(f"Portfolio {portfolio_id} not found")
+    return rows[0]
+
+def get_portfolio(portfolio_id):
+    """
+    A portfolio with its positions and their stored analytics; nothing is recomputed.
+
+    Positions not valued yet (e.g. while a revaluation is running) have "analytics": None.
+    """
+    portfolio = dict(_require_portfolio(portfolio_id))
+    rows = _rows(
+        "SELECT p.id, p.isin, p.units, p.cost, p.settlement_date, v.analytics, v.valued_at "
+        "FROM tap_bonds.portfolio_positions p LEFT JOIN tap_bonds.position_valuations v ON v.position_id = p.id "
+        "WHERE p.portfolio_id = %s ORDER BY p.isin, p.id",
+        (portfolio_id,)
+    )
+    positions = []
+    totals = {"cost_basis": 0.0, "carrying_value": 0.0, "remaining_interest": 0.0, "remaining_principal": 0.0}
+    for row in rows:
+        analytics = json_codec.loads(row["analytics"]) if row["analytics"] else None
+        positions.append({
+            "id": row["id"],
+            "isin": row["isin"],
+            "units": float(row["units"]),
+            "cost": None if row["cost"] is None else float(row["cost"]),
+            "settlement_date": None if row["settlement_date"] is None else str(row["settlement_date"])[:10],
+            "valued_at": row["valued_at"],
+            "analytics": analytics,
+        })
+        for key in totals:
+            if analytics and analytics.get(key) is not None:
+                totals[key] += analytics[key]
+    portfolio["positions"] = positions
+    portfolio["totals"] = {key: round(value, 4) for key, value in totals.items()}
+    return portfolio
+
+def _isin_fingerprints(isins):
+    """Digest per ISIN of the bond_details and cashflows rows that position analytics depend on."""
+    parts = {isin: [] for isin in isins}
+    for batch, placeholders in _batches(isins):
+        for row in _rows(
+            f"SELECT isin, updated_at, maturity_date FROM tap_bonds.bond_details WHERE isin IN ({placeholders})", batch
+        ):
+            parts[row["isin"]].append(f"b:{row['updated_at']}:{row['maturity_date']}")
+        # Content rather than timestamps, so regenerated but unchanged projected schedules don't count as changes
+        for row in _rows(
+            "SELECT isin, COUNT(*) AS flows, MIN(cash_flow_date) AS first_date, MAX(cash_flow_date) AS last_date, "
+            "SUM(cash_flow_amount) AS amount, SUM(principal_amount) AS principal, SUM(interest_amount) AS interest "
+            f"FROM tap_bonds.cashflows WHERE isin IN ({placeholders}) GROUP BY isin", batch
+        ):
+            parts[row["isin"]].append(
+                "c:" + ":".join(str(row[key]) for key in ("flows", "first_date", "last_date", "amount", "principal",
+                                                         "interest"))
+            )
+    return {isin: "|".join(sorted(values)) for isin, values in parts.items()}
+
+def _position_fingerprint(position, isin_fingerprint, as_of):
+    key = "|".join(str(value) for value in (
+        isin_fingerprint, position["units"], position["cost"], position["settlement_date"], as_of
+    ))
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+def _load_flows(isins):
+    """ISIN -> (dates, amounts, principal, interest) NumPy arrays ordered by date."""
+    flows = {}
+    for batch, placeholders in _batches(isins):
+        per_isin = {}
+        for row in _rows(
+            "SELECT isin, cash_flow_date, cash_flow_amount, principal_amount, interest_amount "
+            f"FROM tap_bonds.cashflows WHERE isin IN ({placeholders}) ORDER BY isin, cash_flow_date", batch
+        ):
+            if row["cash_flow_date"] is not None and row["cash_flow_amount"] is not None:
+                per_isin.setdefault(row["isin"], []).append(row)
+        for isin, rows in per_isin.items():
+            flows[isin] = (
+                np.array([str(row["cash_flow_date"])[:10] for row in rows], dtype="datetime64[D]"),
+                np.array([float(row["cash_flow_amount"]) for row in rows]),
+                np.array([float(row["principal_amount"] or 0) for row in rows]),
+                np.array([float(row["interest_amount"] or 0) for row in rows]),
+            )
+    return flows
+
+def _matrix(entries):
+    """Zero-padded (N, F) amount and time matrices from (times, amounts) pairs."""
+    width = max((len(times) for times, _ in entries), default=0)
+    amounts = np.zeros((len(entries), width))
+    times = np.zeros((len(entries), width))
+    for i, (entry_times, entry_amounts) in enumerate(entries):
+        times[i, :len(entry_times)] = entry_times
+        amounts[i, :len(entry_amounts)] = entry_amounts
+    return amounts, times
+
+def compute_analytics(positions, flows, as_of):
+    """
+    Analytics of each position (per-unit flows scaled by units).
+
+    cost_yield is the yield implied by the cost at the settlement date (or as_of
+    when none is given); carrying_value and the durations are at that yield as of as_of.
+    """
+    today = np.datetime64(as_of, "D")
+    cost_entries, remaining_entries, results = [], [], []
+    for position in positions:
+        dates, amounts, principal, interest = flows.get(
+            position["isin"], (np.array([], dtype="datetime64[D]"), np.array([]), np.array([]), np.array([]))
+        )
+        settlement = np.datetime64(position["settlement_date"], "D") if position["settlement_date"] else today
+        after_settlement = dates > settlement
+        upcoming = dates > today
+        cost_entries.append(((dates[after_settlement] - settlement).astype(np.int64) / 365.0,
+                             amounts[after_settlement]))
+        remaining_entries.append(((dates[upcoming] - today).astype(np.int64) / 365.0, amounts[upcoming]))
+        units = float(position["units"])
+        results.append({
+            "units": units,
+            "cost_basis": None if position["cost"] is None else round(float(position["cost"]) * units, 4),
+            "remaining_flows": int(upcoming.sum()),
+            "next_flow_date": str(dates[upcoming][0]) if upcoming.any() else None,
+            "next_flow_amount": round(float(amounts[upcoming][0]) * units, 4) if upcoming.any() else None,
+            "maturity_date": str(dates[-1]) if len(dates) else None,
+            "remaining_interest": round(float(interest[upcoming].sum()) * units, 4),
+            "remaining_principal": round(float(principal[upcoming].sum()) * units, 4),
+        })
+
+    cost_amounts, cost_times = _matrix(cost_entries)
+    costs = np.array([np.nan if p["cost"] is None else float(p["cost"]) for p in positions])
+    yields = solve_yields(cost_amounts, cost_times, np.nan_to_num(costs, nan=0.0))
+    amounts, times = _matrix(remaining_entries)
+    safe_yields = np.nan_to_num(yields, nan=0.0)
+    discount = (1 + safe_yields[:, None]) ** -times
+    value = (amounts * discount).sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        macaulay = (amounts * discount * times).sum(axis=1) / value
+
+    for i, result in enumerate(results):
+        priced = not np.isnan(yields[i]) and value[i] > 0
+        result["cost_yield"] = round(float(yields[i]) * 100, 6) if priced else None
+        result["carrying_value"] = round(float(value[i]) * result["units"], 4) if priced else None
+        result["macaulay_duration"] = round(float(macaulay[i]), 6) if priced else None
+        result["modified_duration"] = round(float(macaulay[i] / (1 + yields[i])), 6) if priced else None
+    return results
+
+def revalue(portfolio_ids=None, isins=None, as_of=None, force=False):
+    """
+    Recompute the analytics of positions whose inputs changed.
+
+    Args:
+        portfolio_ids (list): Limit to these portfolios (default all)
+        isins (list): Limit to positions in these ISINs, e.g. the bonds a load just touched
+        as_of (date): Valuation date (default today); a new date revalues every position once
+        force (bool): Recompute even positions whose fingerprint is unchanged
+
+    Returns:
+        dict: {"checked", "revalued", "as_of"}
+    """
+    as_of = as_of or date.today()
+    sql = ("SELECT p.id, p.portfolio_id, p.isin, p.units, p.cost, p.settlement_date, v.fingerprint "
+           "FROM tap_bonds.portfolio_positions p LEFT JOIN tap_bonds.position_valuations v ON v.position_id = p.id")
+    conditions, params = [], []
+    for column, values in (("p.portfolio_id", portfolio_ids), ("p.isin", isins)):
+        if values is not None:
+            if not values:
+                return {"checked": 0, "revalued": 0, "as_of": as_of.isoformat()}
+            conditions.append(f"{column} IN ({', '.join(['%s'] * len(values))})")
+            params.extend(values)
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    positions = [dict(row, settlement_date=None if row["settlement_date"] is None else str(row["settlement_date"])[:10])
+                 for row in _rows(sql, params)]
+
+    isin_fingerprints = _isin_fingerprints(sorted({p["isin"] for p in positions}))
+    stale = []
+    for position in positions:
+        position["new_fingerprint"] = _position_fingerprint(position, isin_fingerprints[position["isin"]], as_of)
+        if force or position["new_fingerprint"] != position["fingerprint"]:
+            stale.append(position)
+
+    if stale:
+        flows = _load_flows(sorted({p["isin"] for p in stale}))
+        now = datetime.now().isoformat()
+        rows = [
+            (p["id"], p["portfolio_id"], p["new_fingerprint"], now, json_codec.dumps(analytics))
+            for p, analytics in zip(stale, compute_analytics(stale, flows, as_of))
+        ]
+        execute_write([(
+            "REPLACE INTO tap_bonds.position_valuations (position_id, portfolio_id, fingerprint, valued_at, analytics) "
+            "VALUES (%s, %s, %s, %s, %s)", rows
+        )])
+    return {"checked": len(positions), "revalued": len(stale), "as_of": as_of.isoformat()}
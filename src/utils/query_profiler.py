@@ -0,0 +1,180 @@
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+
+# Statements slower than this get their plan captured
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "500"))
+# Re-capture a fingerprint's plan at most this often
+EXPLAIN_INTERVAL_S = float(os.getenv("SLOW_QUERY_EXPLAIN_INTERVAL_S", "600"))
+MAX_FINGERPRINTS = int(os.getenv("SLOW_QUERY_MAX_FINGERPRINTS", "1000"))
+RECENT_SAMPLES = 256
+
+_COMMENT_RE = re.compile(r"/\*.*?\*/|--[^\n]*", re.S)
+_STRING_RE = re.compile(r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.)*\"")
+_NUMBER_RE = re.compile(r"(?<![\w.$])-?\d+(?:\.\d+)?(?:e[+-]?\d+)?\b", re.I)
+_PLACEHOLDER_RE = re.compile(r"%s|\?")
+_IN_LIST_RE = re.compile(r"\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)", re.I)
+_FIELD_LIST_RE = re.compile(r"\bFIELD\s*\(\s*(\w+)\s*(?:,\s*\?\s*)+\)", re.I)
+_SPACE_RE = re.compile(r"\s+")
+
+def fingerprint(sql):
+    """
+    Normalize a statement so queries differing only in literals share a fingerprint.
+
+    String and numeric literals and placeholders become '?', IN/FIELD lists of any
+    length collapse to a single '?+', comments and whitespace runs are removed.
+
+    Returns:
+        tuple: (normalized text, short hash id)
+    """
+    text = _COMMENT_RE.sub(" ", sql)
+    text = _STRING_RE.sub("?", text)
+    text = _PLACEHOLDER_RE.sub("?", text)
+    text = _NUMBER_RE.sub("?", text)
+    text = _IN_LIST_RE.sub("IN (?+)", text)
+    text = _FIELD_LIST_RE.sub(lambda m: f"FIELD({m.group(1)}, ?+)", text)
+    text = _SPACE_RE.sub(" ", text).strip()
+    return text, hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+
+def redact(sql):
+    """The statement with its quoted literals replaced by '?' (plan text too: TiDB prints constants quoted)."""
+    return _STRING_RE.sub("?", sql)
+
+def describe_params(params):
+    """Type and length of each bound param, never the value (params hold ISINs, names and user filters)."""
+    if params is None:
+        return None
+    if not isinstance(params, (list, tuple)):
+        params = [params]
+    return [f"{type(value).__name__}({len(value)})" if isinstance(value, (str, bytes)) else type(value).__name__
+            for value in params]
+
+def _percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round((len(ordered) - 1) * fraction)))]
+
+class QueryStats:
+    """Rolling statistics for one fingerprint."""
+
+    def __init__(self, fingerprint_id, normalized):
+        self.fingerprint_id = fingerprint_id
+        self.normalized = normalized
+        self.count = 0
+        self.errors = 0
+        self.slow_count = 0
+        self.total_s = 0.0
+        self.max_s = 0.0
+        self.rows_total = 0
+        self.recent = deque(maxlen=RECENT_SAMPLES)
+        self.first_seen = time.time()
+        self.last_seen = self.first_seen
+        self.slowest_sql = None
+        self.slowest_params = None
+        self.explain = None
+        self.explain_captured_at = None
+
+    def to_dict(self):
+        recent = list(self.recent)
+        return {
+            "fingerprint": self.fingerprint_id,
+            "statement": self.normalized,
+            "count": self.count,
+            "errors": self.errors,
+            "slow_count": self.slow_count,
+            "total_ms": round(self.total_s * 1000, 3),
+            "mean_ms": round(self.total_s / self.count * 1000, 3) if self.count else 0.0,
+            "p50_ms": round(_percentile(recent, 0.50) * 1000, 3),
+            "p95_ms": round(_percentile(recent, 0.95) * 1000, 3),
+            "max_ms": round(self.max_s * 1000, 3),
+            "mean_rows": round(self.rows_total / self.count, 2) if self.count else 0.0,
+            "first_seen": self.first_seen,
+            "last_seen": self.last_seen,
+            "slowest_example": {"sql": self.slowest_sql, "params": self.slowest_params} if self.slowest_sql else None,
+            "explain": self.explain,
+            "explain_captured_at": self.explain_captured_at,
+        }
+
+class QueryProfiler:
+    """
+    Per-fingerprint timing statistics with automatic EXPLAIN capture for slow statements.
+
+    Only the most recently seen MAX_FINGERPRINTS fingerprints are kept.
+    """
+
+    def __init__(self, slow_ms=SLOW_QUERY_MS, explain_interval_s=EXPLAIN_INTERVAL_S, max_fingerprints=MAX_FINGERPRINTS):
+        self.slow_ms = slow_ms
+        self.explain_interval_s = explain_interval_s
+        self.max_fingerprints = max_fingerprints
+        self._stats = OrderedDict()
+        self._lock = threading.Lock()
+
+    def record(self, sql, params, duration_s, rows=0, error=False):
+        """
+        Add one execution to the statistics.
+
+        Returns:
+            QueryStats or None: The stats entry when its plan should be captured now, else None
+        """
+        normalized, fingerprint_id = fingerprint(sql)
+        now = time.time()
+        slow = duration_s * 1000 >= self.slow_ms
+
+        with self._lock:
+            stats = self._stats.get(fingerprint_id)
+            if stats is None:
+                stats = self._stats[fingerprint_id] = QueryStats(fingerprint_id, normalized)
+                while len(self._stats) > self.max_fingerprints:
+                    self._stats.popitem(last=False)
+            else:
+                self._stats.move_to_end(fingerprint_id)
+
+            stats.count += 1
+            stats.errors += int(bool(error))
+            stats.total_s += duration_s
+            stats.rows_total += rows
+            stats.recent.append(duration_s)
+            stats.last_seen = now
+            if duration_s >= stats.max_s:
+                stats.max_s = duration_s
+                stats.slowest_sql = redact(sql)
+                stats.slowest_params = describe_params(params)
+
+            if not slow or error:
+                return None
+            stats.slow_count += 1
+            explainable = normalized.split(" ", 1)[0].upper() in ("SELECT", "WITH")
+            due = stats.explain_captured_at is None or now - stats.explain_captured_at >= self.explain_interval_s
+            if not (explainable and due):
+                return None
+            # Claim the capture so concurrent slow executions don't all run EXPLAIN
+            stats.explain_captured_at = now
+            return stats
+
+    def attach_explain(self, stats, plan):
+        plan = [{key: redact(value) if isinstance(value, str) else value for key, value in row.items()} for row in plan]
+        with self._lock:
+            stats.explain = plan
+
+    def report(self, sort="total_ms", limit=50, slow_only=False):
+        """Fingerprint statistics, worst first."""
+        with self._lock:
+            entries = [stats.to_dict() for stats in self._stats.values()]
+        if slow_only:
+            entries = [entry for entry in entries if entry["slow_count"]]
+        entries.sort(key=lambda entry: entry.get(sort) or 0, reverse=True)
+        return {
+            "slow_threshold_ms": self.slow_ms,
+            "fingerprints": len(entries),
+            "statements": entries[:limit] if limit else entries,
+        }
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+PROFILER = QueryProfiler()
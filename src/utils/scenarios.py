@@ -0,0 +1,316 @@
+"""
+Yield-shift scenario grids for a list of holdings.
+
+Every holding is repriced under every scenario (a parallel shift plus optional
+key-rate bumps) in one broadcast NumPy computation over its future cash flows:
+
+    price[s, b] = sum_f amount[b, f] * (1 + y[b] + shift[s, b, f]) ** -t[b, f]
+
+with t in years (Actual/365) and annual compounding, the same convention as
+the yield calculator agent. Large grids are split by holdings across the
+compute pool.
+"""
+import os
+from datetime import date
+import numpy as np
+from .bond_queries import BOND_COLUMN_MAPPING
+from .compute_pool import get_compute_pool
+from .filter_compiler import as_date
+from .tidb_connector import execute_query
+
+PARALLEL_SHIFTS_BP = (-200, -100, -50, -25, 25, 50, 100, 200)
+KEY_RATE_TENORS = (1, 2, 3, 5, 7, 10)
+MAX_HOLDINGS = 20000
+MAX_SCENARIOS = 500
+# Grids with fewer (scenario, holding, cash flow) cells than this are priced inline, not on the compute pool
+PARALLEL_MIN_CELLS = int(os.getenv("SCENARIO_PARALLEL_MIN_CELLS", "2000000"))
+# Cells per chunk, bounding the (scenarios, holdings, flows) temporaries of one worker
+CHUNK_CELLS = 4000000
+ISIN_BATCH = 500
+
+class ScenarioError(ValueError):
+    """Raised for an invalid holdings list or scenario grid."""
+
+def build_scenarios(shifts_bp=PARALLEL_SHIFTS_BP, key_rate_tenors=KEY_RATE_TENORS, key_rate_bp=None, custom=()):
+    """
+    The scenario grid: one scenario per parallel shift, one per key-rate bump and any custom ones.
+
+    Args:
+        shifts_bp (iterable): Parallel shifts in basis points
+        key_rate_tenors (iterable): Tenors in years of the key rates
+        key_rate_bp (float): Size of the bump applied to each key rate in turn, None for no key-rate scenarios
+        custom (iterable): {"name", "parallel_bp", "key_rates_bp": {tenor: bp}} scenarios
+
+    Returns:
+        tuple: (names, tenors array, parallel shifts (S,), key-rate bumps (S, K)) with shifts as decimals
+    """
+    tenors = np.array(sorted(float(tenor) for tenor in key_rate_tenors), dtype=np.float64)
+    if len(tenors) == 0 or tenors[0] <= 0:
+        raise ScenarioError("key_rate_tenors must be positive years")
+    names, parallel, key_rates = [], [], []
+
+    for bp in shifts_bp:
+        names.append(f"parallel {float(bp):+g}bp")
+        parallel.append(float(bp))
+        key_rates.append(np.zeros(len(tenors)))
+    if key_rate_bp:
+        for k, tenor in enumerate(tenors):
+            bump = np.zeros(len(tenors))
+            bump[k] = float(key_rate_bp)
+            names.append(f"key rate {tenor:g}y {float(key_rate_bp):+g}bp")
+            parallel.append(0.0)
+            key_rates.append(bump)
+    for n, scenario in enumerate(custom):
+        bump = np.zeros(len(tenors))
+        for tenor, bp in (scenario.get("key_rates_bp") or {}).items():
+            matches = np.flatnonzero(tenors == float(tenor))
+            if not len(matches):
+                raise ScenarioError(f"Custom scenario key rate tenor {tenor} is not one of key_rate_tenors")
+            bump[matches[0]] = float(bp)
+        names.append(str(scenario.get("name") or f"custom {n + 1}"))
+        parallel.append(float(scenario.get("parallel_bp") or 0.0))
+        key_rates.append(bump)
+
+    if not names:
+        raise ScenarioError("The scenario grid is empty")
+    if len(names) > MAX_SCENARIOS:
+        raise ScenarioError(f"At most {MAX_SCENARIOS} scenarios per request")
+    return names, tenors, np.array(parallel) / 10000, np.array(key_rates).reshape(len(names), len(tenors)) / 10000
+
+def key_rate_weights(times, tenors):
+    """(..., K) triangular key-rate weights of each cash flow time; flat beyond the first and last tenor."""
+    eye = np.eye(len(tenors))
+    return np.stack([np.interp(times, tenors, eye[k]) for k in range(len(tenors))], axis=-1)
+
+def price_grid(amounts, times, base_yield, parallel, key_rates, tenors):
+    """
+    Prices of every holding under every scenario.
+
+    Args:
+        amounts (ndarray): (B, F) cash flow amounts per unit, zero padded
+        times (ndarray): (B, F) years from the valuation date to each flow
+        base_yield (ndarray): (B,) yields as decimals
+        parallel (ndarray): (S,) parallel shifts as decimals
+        key_rates (ndarray): (S, K) key-rate bumps as decimals
+        tenors (ndarray): (K,) key-rate tenors in years
+
+    Returns:
+        ndarray: (S, B) prices per unit
+    """
+    shift = parallel[:, None, None]
+    if np.any(key_rates):
+        shift = shift + np.einsum("bfk,sk->sbf", key_rate_weights(times, tenors), key_rates)
+    rate = base_yield[None, :, None] + shift
+    return (amounts[None] * (1 + rate) ** -times[None]).sum(axis=-1)
+
+def solve_yields(amounts, times, prices, guess=None, iterations=50, tolerance=1e-10):
+    """
+    Yields (annual compounding, as decimals) that discount each row of cash flows to its price.
+
+    Newton's method on all rows at once; rows that don't converge (or have no
+    flows or price) come back as NaN.
+
+    Args:
+        amounts (ndarray): (B, F) cash flow amounts, zero padded
+        times (ndarray): (B, F) years to each flow
+        prices (ndarray): (B,) target prices
+        guess (ndarray): (B,) starting yields, default 8%
+    """
+    rate = np.full(len(prices), 0.08) if guess is None else np.where(np.isnan(guess), 0.08, guess)
+    for _ in range(iterations):
+        discount = (1 + rate[:, None]) ** -times
+        error = (amounts * discount).sum(axis=1) - prices
+        slope = -(amounts * times * discount / (1 + rate[:, None])).sum(axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            step = np.where(slope != 0, error / slope, 0.0)
+        rate = np.maximum(rate - step, -0.99)
+        if np.all(np.abs(step) < tolerance):
+            break
+    price = (amounts * (1 + rate[:, None]) ** -times).sum(axis=1)
+    converged = np.abs(price - prices) <= 1e-6 * np.maximum(np.abs(prices), 1)
+    return np.where(converged & (prices > 0) & amounts.any(axis=1), rate, np.nan)
+
+def _price_chunk(arrays, parallel, key_rates, tenors):
+    return price_grid(arrays["amounts"], arrays["times"], arrays["base_yield"], parallel, key_rates, tenors)
+
+def parse_holdings(holdings):
+    """Validate a holdings list: [{"isin", "units", "yield" (optional, %)}]."""
+    if not isinstance(holdings, list) or not holdings:
+        raise ScenarioError("holdings must be a non-empty list of {isin, units}")
+    if len(holdings) > MAX_HOLDINGS:
+        raise ScenarioError(f"At most {MAX_HOLDINGS} holdings per request")
+    parsed = []
+    for i, holding in enumerate(holdings):
+        if not isinstance(holding, dict) or not isinstance(holding.get("isin"), str):
+            raise ScenarioError(f"holdings[{i}]: expected an object with an isin")
+        try:
+            units = float(holding.get("units", 1))
+            base_yield = float(holding["yield"]) / 100 if holding.get("yield") is not None else None
+        except (TypeError, ValueError):
+            raise ScenarioError(f"holdings[{i}]: units and yield must be numbers")
+        parsed.append({"isin": holding["isin"], "units": units, "yield": base_yield})
+    return parsed
+
+def load_flows(isins, as_of):
+    """
+    Future cash flows of each ISIN as zero-padded (B, F) amount and time matrices.
+
+    Returns:
+        tuple: (amounts, times, coupon rates as decimals (NaN when unknown))
+    """
+    index = {isin: i for i, isin in enumerate(isins)}
+    per_bond = [[] for _ in isins]
+    coupon = np.full(len(isins), np.nan)
+    coupon_sql = BOND_COLUMN_MAPPING["coupon_rate"]
+    for start in range(0, len(isins), ISIN_BATCH):
+        batch = isins[start:start + ISIN_BATCH]
+        placeholders = ", ".join(["%s"] * len(batch))
+        flows = execute_query(
+            f"SELECT isin, cash_flow_date, cash_flow_amount FROM tap_bonds.cashflows "
+            f"WHERE isin IN ({placeholders}) AND cash_flow_date > %s ORDER BY isin, cash_flow_date",
+            tuple(batch) + (as_of.isoformat(),), cache=True
+        )
+        terms = execute_query(
+            f"SELECT isin, {coupon_sql} FROM tap_bonds.bond_details WHERE isin IN ({placeholders})", tuple(batch),
+            cache=True
+        )
+        for result in (flows, terms):
+            if "error" in result:
+                raise RuntimeError(result["error"])
+        for row in flows["results"]:
+            if row["cash_flow_amount"] is not None:
+                per_bond[index[row["isin"]]].append((row["cash_flow_date"], float(row["cash_flow_amount"])))
+        for row in terms["results"]:
+            try:
+                coupon[index[row["isin"]]] = float(str(row["coupon_rate"]).strip('"')) / 100
+            except (TypeError, ValueError):
+                pass
+
+    width = max((len(flows) for flows in per_bond), default=0)
+    amounts = np.zeros((len(isins), width))
+    times = np.zeros((len(isins), width))
+    for b, flows in enumerate(per_bond):
+        if flows:
+            days = np.array([str(flow_date)[:10] for flow_date, _ in flows], dtype="datetime64[D]")
+            times[b, :len(flows)] = (days - np.datetime64(as_of, "D")).astype(np.int64) / 365.0
+            amounts[b, :len(flows)] = [amount for _, amount in flows]
+    return amounts, times, coupon
+
+class ScenarioGrid:
+    """
+    A validated grid with its cash flows loaded, ready to be priced.
+
+    The base (unshifted) price is computed as scenario 0 of the same grid.
+    """
+
+    def __init__(self, as_of, names, tenors, parallel, key_rates, priced, unpriced, amounts, times, base_yields, units):
+        self.as_of = as_of
+        self.names = names
+        self.tenors = tenors
+        self.parallel = np.concatenate([[0.0], parallel])
+        self.key_rates = np.vstack([np.zeros(len(tenors)), key_rates])
+        self.priced = priced
+        self.unpriced = unpriced
+        self.amounts = amounts
+        self.times = times
+        self.base_yields = base_yields
+        self.units = units
+
+    def submit(self, pool=None):
+        """
+        Start pricing on the compute pool, split by holdings.
+
+        Returns:
+            ChunkedJob: Its chunk results go to result()
+        """
+        pool = pool or get_compute_pool()
+        scenarios, flows = len(self.parallel), max(self.amounts.shape[1], 1)
+        cells = scenarios * len(self.amounts) * flows
+        return pool.submit(
+            _price_chunk,
+            {"amounts": self.amounts, "times": self.times, "base_yield": self.base_yields},
+            args=(self.parallel, self.key_rates, self.tenors),
+            chunk_rows=max(1, CHUNK_CELLS // (scenarios * flows)),
+            inline=cells < PARALLEL_MIN_CELLS,
+        )
+
+    def result(self, chunks):
+        """The P&L report from the chunk results of submit()."""
+        prices = np.concatenate(chunks, axis=1) if chunks else np.zeros((len(self.parallel), 0))
+        base_price = prices[0]
+        pnl = (prices[1:] - base_price) * self.units
+        return {
+            "as_of": self.as_of.isoformat(),
+            "scenarios": self.names,
+            "holdings": [
+                {
+                    "isin": holding["isin"],
+                    "units": holding["units"],
+                    "base_yield": round(float(self.base_yields[i]) * 100, 6),
+                    "base_price": round(float(base_price[i]), 6),
+                    "base_value": round(float(base_price[i] * self.units[i]), 4),
+                    "pnl": np.round(pnl[:, i], 4).tolist(),
+                }
+                for i, holding in enumerate(self.priced)
+            ],
+            "totals": {
+                "base_value": round(float(base_price @ self.units), 4),
+                "pnl": np.round(pnl.sum(axis=1), 4).tolist(),
+            },
+            "unpriced": self.unpriced,
+        }
+
+def prepare_grid(holdings, shifts_bp=PARALLEL_SHIFTS_BP, key_rate_tenors=KEY_RATE_TENORS, key_rate_bp=None,
+                 custom=(), as_of=None):
+    """
+    Validate a request and load the holdings' cash flows.
+
+    Each holding is valued at its own "yield" or, when none is given, at its
+    coupon rate; holdings without future cash flows or a base yield are
+    reported in "unpriced" and left out of the grid.
+
+    Returns:
+        ScenarioGrid
+    """
+    holdings = parse_holdings(holdings)
+    names, tenors, parallel, key_rates = build_scenarios(shifts_bp, key_rate_tenors, key_rate_bp, custom)
+    try:
+        as_of = date.fromisoformat(as_date(as_of)) if as_of else date.today()
+    except ValueError as e:
+        raise ScenarioError(f"as_of: {e}")
+
+    isins = list(dict.fromkeys(holding["isin"] for holding in holdings))
+    amounts, times, coupon = load_flows(isins, as_of)
+    row_of = {isin: i for i, isin in enumerate(isins)}
+
+    priced, rows, base_yields, unpriced = [], [], [], []
+    for holding in holdings:
+        row = row_of[holding["isin"]]
+        base_yield = holding["yield"] if holding["yield"] is not None else coupon[row]
+        if not amounts[row].any():
+            unpriced.append({"isin": holding["isin"], "reason": "no cash flows after as_of"})
+        elif np.isnan(base_yield):
+            unpriced.append({"isin": holding["isin"], "reason": "no yield given and no coupon rate on record"})
+        else:
+            priced.append(holding)
+            rows.append(row)
+            base_yields.append(base_yield)
+
+    rows = np.array(rows, dtype=np.int64)
+    return ScenarioGrid(
+        as_of, names, tenors, parallel, key_rates, priced, unpriced,
+        amounts[rows], times[rows], np.array(base_yields, dtype=np.float64),
+        np.array([holding["units"] for holding in priced], dtype=np.float64),
+    )
+
+def run_scenarios(holdings, shifts_bp=PARALLEL_SHIFTS_BP, key_rate_tenors=KEY_RATE_TENORS, key_rate_bp=None,
+                  custom=(), as_of=None):
+    """
+    P&L of every holding under every scenario, blocking until done (see prepare_grid).
+
+    Returns:
+        dict: {"as_of", "scenarios", "holdings": [{"isin", "units", "base_yield", "base_price",
+            "base_value", "pnl"}], "totals": {"base_value", "pnl"}, "unpriced"}
+    """
+    grid = prepare_grid(holdings, shifts_bp, key_rate_tenors, key_rate_bp, custom, as_of)
+    return grid.result(grid.submit().result())
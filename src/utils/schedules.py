@@ -0,0 +1,218 @@
+"""
+Projected cash-flow schedules from bond terms.
+
+Bonds without published cashflows rows get a schedule generated from their
+coupon rate, payment frequency and day-count basis, face value and allotment /
+maturity dates. Schedules are built for the whole universe at once with NumPy
+and stored in cashflows with source = 'projected'.
+
+Coupon dates roll back from maturity by the payment frequency, so a broken
+first period (a short stub from allotment) carries a prorated coupon; the face
+value is redeemed at maturity. Cumulative bonds pay interest compounded
+annually with the principal at maturity.
+"""
+import numpy as np
+
+# Days between the record date and the payment date
+RECORD_DATE_OFFSET_DAYS = 15
+
+# interestPaymentFrequency (normalized) -> months between coupons, 0 for cumulative / on maturity
+FREQUENCY_MONTHS = {
+    "monthly": 1,
+    "quarterly": 3,
+    "semi annual": 6,
+    "semiannual": 6,
+    "half yearly": 6,
+    "annual": 12,
+    "annually": 12,
+    "yearly": 12,
+    "cumulative": 0,
+    "on maturity": 0,
+    "at maturity": 0,
+    "zero coupon": 0,
+}
+
+ACT_ACT, ACT_365, ACT_360, THIRTY_360 = range(4)
+# couponBasis (normalized) -> day count convention; anything else is treated as Actual/Actual
+DAY_COUNT_BASIS = {
+    "actual/actual": ACT_ACT,
+    "act/act": ACT_ACT,
+    "actual/365": ACT_365,
+    "act/365": ACT_365,
+    "actual/365fixed": ACT_365,
+    "actual/360": ACT_360,
+    "act/360": ACT_360,
+    "30/360": THIRTY_360,
+}
+
+def _normalize(value):
+    if value is None:
+        return ""
+    # JSON_EXTRACT returns strings still quoted on MySQL
+    return str(value).strip().strip('"').lower().replace("-", " ").replace("_", " ")
+
+def frequency_months(value):
+    """Months between coupons for an interestPaymentFrequency value, or None if it isn't recognized."""
+    return FREQUENCY_MONTHS.get(_normalize(value))
+
+def day_count_basis(value):
+    return DAY_COUNT_BASIS.get(_normalize(value).replace(" ", ""), ACT_ACT)
+
+def _number(value):
+    try:
+        return float(str(value).strip().strip('"').replace(",", ""))
+    except (TypeError, ValueError):
+        return None
+
+def _day(value):
+    try:
+        return np.datetime64(str(value)[:10], "D")
+    except ValueError:
+        return None
+
+def _shift_months(dates, months):
+    """dates moved back by `months` months, clamped to the end of the target month."""
+    month_start = dates.astype("datetime64[M]")
+    day = dates - month_start.astype("datetime64[D]")
+    target = month_start - months.astype("timedelta64[M]")
+    last_day = (target + np.timedelta64(1, "M")).astype("datetime64[D]") - np.timedelta64(1, "D")
+    return np.minimum(target.astype("datetime64[D]") + day, last_day)
+
+def _days_30_360(start, end):
+    """30E/360 day counts."""
+    def parts(dates):
+        years = dates.astype("datetime64[Y]").astype(np.int64)
+        months = dates.astype("datetime64[M]").astype(np.int64) % 12
+        days = (dates - dates.astype("datetime64[M]").astype("datetime64[D]")).astype(np.int64) + 1
+        return years, months, np.minimum(days, 30)
+    y1, m1, d1 = parts(start)
+    y2, m2, d2 = parts(end)
+    return 360 * (y2 - y1) + 30 * (m2 - m1) + (d2 - d1)
+
+def prepare_terms(bonds):
+    """
+    Pick out the bonds whose terms are complete enough to project a schedule.
+
+    Args:
+        bonds (iterable): Dicts with isin, allotment_date, maturity_date, coupon_rate,
+            coupon_frequency, coupon_basis and face_value
+
+    Returns:
+        tuple: (terms dict of NumPy arrays, {isin: reason} for the bonds that were skipped)
+    """
+    isins, allotment, maturity, rate, months, basis, face = [], [], [], [], [], [], []
+    skipped = {}
+    for bond in bonds:
+        isin = bond.get("isin")
+        start, end = _day(bond.get("allotment_date")), _day(bond.get("maturity_date"))
+        coupon_rate, face_value = _number(bond.get("coupon_rate")), _number(bond.get("face_value"))
+        frequency = frequency_months(bond.get("coupon_frequency"))
+        if start is None or end is None or end <= start:
+            skipped[isin] = "missing or inconsistent allotment/maturity dates"
+        elif face_value is None or face_value <= 0:
+            skipped[isin] = "missing face value"
+        elif coupon_rate is None or coupon_rate < 0:
+            skipped[isin] = "missing coupon rate"
+        elif frequency is None:
+            skipped[isin] = f"unrecognized payment frequency {bond.get('coupon_frequency')!r}"
+        else:
+            isins.append(isin)
+            allotment.append(start)
+            maturity.append(end)
+            rate.append(coupon_rate / 100)
+            months.append(frequency if coupon_rate > 0 else 0)
+            basis.append(day_count_basis(bond.get("coupon_basis")))
+            face.append(face_value)
+    terms = {
+        "isin": np.array(isins, dtype=object),
+        "allotment": np.array(allotment, dtype="datetime64[D]"),
+        "maturity": np.array(maturity, dtype="datetime64[D]"),
+        "rate": np.array(rate, dtype=np.float64),
+        "months": np.array(months, dtype=np.int64),
+        "basis": np.array(basis, dtype=np.int64),
+        "face": np.array(face, dtype=np.float64),
+    }
+    return terms, skipped
+
+def build_schedules(terms):
+    """
+    Generate the cash flows of every bond in `terms` (see prepare_terms).
+
+    Returns:
+        dict: Flat NumPy arrays with one entry per cash flow: bond (index into terms),
+            number (0-based within the bond), date, record_date, interest, principal,
+            amount and remaining_principal
+    """
+    bonds = len(terms["isin"])
+    allotment, maturity, months = terms["allotment"], terms["maturity"], terms["months"]
+    cumulative = months == 0
+    step = np.where(cumulative, 1, months)
+
+    # Number of coupons: smallest n with maturity - n periods on or before allotment
+    elapsed = maturity.astype("datetime64[M]").astype(np.int64) - allotment.astype("datetime64[M]").astype(np.int64)
+    counts = np.maximum(elapsed // step, 1)
+    counts += _shift_months(maturity, counts * step) > allotment
+    counts = np.where(cumulative, 1, counts)
+
+    bond = np.repeat(np.arange(bonds), counts)
+    first = np.repeat(np.cumsum(counts) - counts, counts)
+    number = np.arange(len(bond)) - first
+    remaining = counts[bond] - 1 - number
+    flow_step = step[bond]
+    flow_maturity = maturity[bond]
+
+    end = _shift_months(flow_maturity, remaining * flow_step)
+    regular_start = _shift_months(flow_maturity, (remaining + 1) * flow_step)
+    start = np.maximum(regular_start, allotment[bond])
+    is_cumulative = cumulative[bond]
+    end = np.where(is_cumulative, flow_maturity, end)
+    start = np.where(is_cumulative, allotment[bond], start)
+
+    days = (end - start).astype(np.int64)
+    basis = terms["basis"][bond]
+    rate = terms["rate"][bond]
+    face = terms["face"][bond]
+
+    regular_days = np.maximum((end - regular_start).astype(np.int64), 1)
+    fraction = np.select(
+        [basis == ACT_365, basis == ACT_360, basis == THIRTY_360],
+        [days / 365.0, days / 360.0, _days_30_360(start, end) / 360.0],
+        default=(days / regular_days) * (flow_step / 12.0),
+    )
+    interest = np.where(
+        is_cumulative,
+        face * ((1 + rate) ** (days / 365.0) - 1),
+        face * rate * fraction,
+    )
+    last = remaining == 0
+    principal = np.where(last, face, 0.0)
+
+    return {
+        "bond": bond,
+        "number": number,
+        "date": end,
+        "record_date": end - np.timedelta64(RECORD_DATE_OFFSET_DAYS, "D"),
+        "interest": np.round(interest, 4),
+        "principal": principal,
+        "amount": np.round(interest + principal, 4),
+        "remaining_principal": np.where(last, 0.0, face),
+    }
+
+def schedule_rows(terms, schedule, created_at):
+    """
+    Rows for INSERT INTO cashflows (id, isin, cash_flow_date, cash_flow_amount, record_date,
+    principal_amount, interest_amount, tds_amount, remaining_principal, state, source,
+    created_at, updated_at).
+    """
+    isins = terms["isin"][schedule["bond"]]
+    dates = schedule["date"].astype(str).tolist()
+    record_dates = schedule["record_date"].astype(str).tolist()
+    return [
+        (f"proj-{isin}-{number}", isin, flow_date, amount, record_date, principal, interest, 0.0,
+         remaining, "active", "projected", created_at, created_at)
+        for isin, number, flow_date, amount, record_date, principal, interest, remaining in zip(
+            isins, schedule["number"].tolist(), dates, schedule["amount"].tolist(), record_dates,
+            schedule["principal"].tolist(), schedule["interest"].tolist(),
+            schedule["remaining_principal"].tolist(),
+        )
+    ]
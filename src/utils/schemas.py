@@ -0,0 +1,278 @@
+import re
+from . import json_codec
+from .filter_compiler import FilterError
+from .llm import response_text
+from .metrics import REGISTRY, span
+
+# Agents the orchestrator can route to
+AGENT_NAMES = ("bond_directory", "bond_screener", "bond_yield_calculator", "bond_finder")
+# Agents that only work on data produced by an earlier step
+DEPENDENT_AGENTS = ("bond_yield_calculator", "bond_finder")
+
+DEFAULT_COMPILATION_INSTRUCTIONS = "Summarise the agent results in a clear answer to the user's query."
+
+_FENCE_RE = re.compile(r"```(?:json)?\s*(.*?)```", re.S | re.I)
+
+JSON_REPAIRS = REGISTRY.counter(
+    "tap_llm_json_repairs_total", "Structured LLM outputs that needed a repair call", labelnames=("component", "outcome")
+)
+
+class SchemaError(ValueError):
+    """
+    Structured output that doesn't match its schema.
+
+    Attributes:
+        path (tuple): Location of the invalid fragment, () for the whole document
+        allowed (list): Accepted values at that location, when there is a closed set
+    """
+
+    def __init__(self, path, message, allowed=None):
+        super().__init__(f"{_format_path(path)}: {message}")
+        self.path = tuple(path)
+        self.message = message
+        self.allowed = sorted(allowed) if allowed else None
+
+def _format_path(path):
+    return "$" + "".join(f"[{part}]" if isinstance(part, int) else f".{part}" for part in path)
+
+def extract_json(text):
+    """
+    Parse the JSON document in a model response.
+
+    Handles Markdown fences and prose around the object, which JSON mode normally
+    prevents but older prompts and replayed cassettes can still contain.
+    """
+    text = text.strip()
+    fenced = _FENCE_RE.search(text)
+    if fenced:
+        text = fenced.group(1).strip()
+    elif not text.startswith(("{", "[")):
+        start, end = text.find("{"), text.rfind("}")
+        if start != -1 and end > start:
+            text = text[start:end + 1]
+    try:
+        return json_codec.loads(text)
+    except ValueError as e:
+        raise SchemaError((), f"not valid JSON ({e})")
+
+def _require_object(value, path):
+    if not isinstance(value, dict):
+        raise SchemaError(path, f"expected an object, got {type(value).__name__}")
+    return value
+
+def _coerce_bool(value, path):
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.lower() in ("true", "false"):
+        return value.lower() == "true"
+    raise SchemaError(path, f"expected true or false, got {value!r}")
+
+def _coerce_limit(value, path):
+    if isinstance(value, bool):
+        raise SchemaError(path, f"expected a positive integer, got {value!r}")
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        raise SchemaError(path, f"expected a positive integer, got {value!r}")
+    if limit < 1 or limit != float(value):
+        raise SchemaError(path, f"expected a positive integer, got {value!r}")
+    return limit
+
+def validate_plan(plan):
+    """
+    Check an orchestration plan and normalize it.
+
+    needs_previous_output is forced on for agents that depend on earlier steps and a
+    missing final_compilation_instructions gets a default, rather than failing.
+    """
+    _require_object(plan, ())
+    steps = plan.get("plan")
+    if not isinstance(steps, list) or not steps:
+        raise SchemaError(("plan",), "expected a non-empty array of agent calls")
+
+    for i, step in enumerate(steps):
+        _require_object(step, ("plan", i))
+        if step.get("agent") not in AGENT_NAMES:
+            raise SchemaError(("plan", i), f"unknown agent {step.get('agent')!r}", allowed=AGENT_NAMES)
+        if not isinstance(step.get("query"), str) or not step["query"].strip():
+            raise SchemaError(("plan", i), "query must be a non-empty string")
+        needs_previous = _coerce_bool(step.get("needs_previous_output", False), ("plan", i, "needs_previous_output"))
+        step["needs_previous_output"] = needs_previous or step["agent"] in DEPENDENT_AGENTS
+
+    instructions = plan.get("final_compilation_instructions")
+    if not isinstance(instructions, str) or not instructions.strip():
+        plan["final_compilation_instructions"] = DEFAULT_COMPILATION_INSTRUCTIONS
+    return plan
+
+class TableSchema:
+    """
+    Columns and filter keys an agent accepts for one table.
+
+    Args:
+        name (str): Table name
+        columns (iterable): Selectable column names
+        filters (iterable): Accepted filter keys, default the keys of filter_compiler
+        column_prefixes (iterable): Columns that may also be requested as "column.Key"
+        sort_keys (iterable): Accepted "sort" values for paginated results
+        filter_compiler (FilterCompiler): Registry used to type-check filter values
+    """
+
+    def __init__(self, name, columns, filters=None, column_prefixes=(), sort_keys=(), filter_compiler=None):
+        self.name = name
+        self.columns = frozenset(columns)
+        self.filters = frozenset(filters if filters is not None else filter_compiler or ())
+        self.filter_compiler = filter_compiler
+        self.column_prefixes = frozenset(column_prefixes)
+        self.sort_keys = frozenset(sort_keys)
+
+    def column_allowed(self, column):
+        if column in self.columns:
+            return True
+        return "." in column and column.split(".", 1)[0] in self.column_prefixes
+
+class QuerySchema:
+    """
+    Validates the query object an agent's model produces.
+
+        {"table": ..., "columns": [...], "filters": {...}, "limit": n, "sort": ..., "cursor": ...,
+         "compound": bool, "next_query": {...}}
+
+    Args:
+        tables (list): TableSchema per queryable table
+        default_table (str): Table used when the model omits "table"
+        allow_next_query (bool): Whether a compound follow-up query is accepted
+    """
+
+    def __init__(self, tables, default_table, allow_next_query=False):
+        self.tables = {table.name: table for table in tables}
+        self.default_table = default_table
+        self.allow_next_query = allow_next_query
+
+    def validate(self, query, path=()):
+        _require_object(query, path)
+        table_name = query.setdefault("table", self.default_table)
+        table = self.tables.get(table_name)
+        if table is None:
+            raise SchemaError(path + ("table",), f"unknown table {table_name!r}", allowed=self.tables)
+
+        columns = query.get("columns")
+        if columns is not None:
+            if not isinstance(columns, list) or not all(isinstance(column, str) for column in columns):
+                raise SchemaError(path + ("columns",), "expected an array of column names")
+            unknown = [column for column in columns if not table.column_allowed(column)]
+            if unknown:
+                raise SchemaError(path + ("columns",), f"unknown columns {unknown} for {table_name}",
+                                  allowed=table.columns)
+
+        filters = query.get("filters")
+        if filters is not None:
+            _require_object(filters, path + ("filters",))
+            unknown = sorted(key for key in filters if key not in table.filters)
+            if unknown:
+                raise SchemaError(path + ("filters",), f"unknown filter keys {unknown} for {table_name}",
+                                  allowed=table.filters)
+            if table.filter_compiler is not None:
+                for key, value in filters.items():
+                    if value is None:
+                        continue
+                    try:
+                        table.filter_compiler.coerce(key, value)
+                    except FilterError as e:
+                        raise SchemaError(path + ("filters", key), e.message)
+
+        if query.get("limit") is not None:
+            query["limit"] = _coerce_limit(query["limit"], path + ("limit",))
+
+        if query.get("sort") is not None and query["sort"] not in table.sort_keys:
+            raise SchemaError(path + ("sort",), f"unsupported sort {query['sort']!r} for {table_name}",
+                              allowed=table.sort_keys)
+        if query.get("cursor") is not None and not isinstance(query["cursor"], str):
+            raise SchemaError(path + ("cursor",), "expected the continuation token string from a previous page")
+
+        if "compound" in query:
+            query["compound"] = _coerce_bool(query["compound"], path + ("compound",))
+        if "next_query" in query:
+            if not self.allow_next_query:
+                raise SchemaError(path + ("next_query",), "follow-up queries are not supported here")
+            self.validate(query["next_query"], path + ("next_query",))
+        return query
+
+def _fragment_at(document, path):
+    for part in path:
+        document = document[part]
+    return document
+
+def _existing_path(document, path):
+    """Longest prefix of path that resolves in document (a missing key stops it)."""
+    for depth, part in enumerate(path):
+        try:
+            document = document[part]
+        except (KeyError, IndexError, TypeError):
+            return tuple(path[:depth])
+    return tuple(path)
+
+def _replace_at(document, path, value):
+    if not path:
+        return value
+    _fragment_at(document, path[:-1])[path[-1]] = value
+    return document
+
+def _repair_prompt(task, error, fragment_text, fragment_path):
+    lines = [
+        f"The {task} JSON below is invalid.",
+        f"Problem at {_format_path(error.path)}: {error.message}",
+    ]
+    if fragment_path != error.path:
+        lines.append(f"The fragment below is the value at {_format_path(fragment_path)}.")
+    if error.allowed:
+        lines.append(f"Allowed values: {', '.join(map(str, error.allowed))}")
+    lines.extend([
+        "",
+        fragment_text,
+        "",
+        "Return only the corrected JSON for this fragment, with the same structure, nothing else.",
+    ])
+    return "\n".join(lines)
+
+def parse_structured(text, validate, llm, component, task):
+    """
+    Parse and validate a structured model response, repairing it once if needed.
+
+    When parsing or validation fails, only the failing fragment (or the whole
+    text for a syntax error) is sent back to the model with the error, and the
+    corrected fragment is spliced in and validated again. A second failure raises.
+    For a missing key the fragment is its nearest existing parent.
+
+    Args:
+        text (str): Raw model output
+        validate (callable): Returns the normalized document or raises SchemaError
+        llm (LLM): Handle used for the repair call
+        component (str): Agent name, for spans and metrics
+        task (str): Short description of the document for the repair prompt
+
+    Returns:
+        dict: The validated document
+    """
+    with span("json_parse", component=component):
+        try:
+            document = extract_json(text)
+            return validate(document)
+        except SchemaError as e:
+            error = e
+
+    if error.path:
+        fragment_path = _existing_path(document, error.path)
+        fragment_text = json_codec.dumps(_fragment_at(document, fragment_path), indent=2)
+    else:
+        document, fragment_path, fragment_text = None, (), text
+
+    with span("json_repair", component=component, path=_format_path(fragment_path)):
+        repaired = llm.invoke(_repair_prompt(task, error, fragment_text, fragment_path), json_mode=True)
+        try:
+            fragment = extract_json(response_text(repaired))
+            result = validate(_replace_at(document, fragment_path, fragment))
+        except SchemaError:
+            JSON_REPAIRS.inc(component=component, outcome="failed")
+            raise
+    JSON_REPAIRS.inc(component=component, outcome="repaired")
+    return result
@@ -0,0 +1,269 @@
+"""
+Columnar snapshots of the bond tables.
+
+Materializes bond_details (its hot row with the typed summary fields; the
+compressed documents are not copied), cashflows and company_insights into
+Arrow IPC files, optionally with Parquet copies, under a versioned directory
+with a manifest. Readers memory-map the Arrow files, so loading the full
+universe is zero-copy and doesn't touch TiDB.
+
+    python -m src.utils.snapshot write [--dir data/snapshot] [--parquet]
+    python -m src.utils.snapshot info
+"""
+import argparse
+import hashlib
+import os
+import shutil
+import sys
+import threading
+import time
+from datetime import date, datetime, timezone
+from . import json_codec
+from .bond_queries import (BOND_DETAILS_COLUMNS, BOND_JSON_FIELDS, CASHFLOW_COLUMNS, COMPANY_COLUMNS,
+                           COMPANY_JSON_COLUMNS, NUMERIC_JSON_FIELDS)
+from .tidb_connector import stream_query
+
+DEFAULT_SNAPSHOT_DIR = os.getenv(
+    "SNAPSHOT_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "data", "snapshot")
+)
+# Older snapshot versions kept next to the current one
+KEEP_VERSIONS = 2
+CHUNK_ROWS = 5000
+
+DATE_COLUMNS = {"allotment_date", "maturity_date", "cash_flow_date", "record_date"}
+AMOUNT_COLUMNS = {"issue_size", "cash_flow_amount", "principal_amount", "interest_amount", "tds_amount",
+                  "remaining_principal"} | NUMERIC_JSON_FIELDS
+
+# table -> source columns selected from TiDB
+SNAPSHOT_TABLES = {
+    "bond_details": BOND_DETAILS_COLUMNS + list(BOND_JSON_FIELDS),
+    "cashflows": CASHFLOW_COLUMNS,
+    "company_insights": COMPANY_COLUMNS + COMPANY_JSON_COLUMNS,
+}
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc
+    except ImportError:
+        raise ImportError("Snapshots need pyarrow (pip install pyarrow)")
+    return pyarrow
+
+def _arrow_schema(table):
+    """Arrow schema of a snapshot table: dates as date32, amounts and numeric summary fields as float64, the rest as text."""
+    pa = _pyarrow()
+    fields = []
+    for column in SNAPSHOT_TABLES[table]:
+        if column in DATE_COLUMNS:
+            fields.append(pa.field(column, pa.date32()))
+        elif column in AMOUNT_COLUMNS:
+            fields.append(pa.field(column, pa.float64()))
+        else:
+            fields.append(pa.field(column, pa.string() if column in BOND_JSON_FIELDS else pa.large_string()))
+    return pa.schema(fields)
+
+def _to_date(value):
+    if value is None or isinstance(value, date):
+        return value.date() if isinstance(value, datetime) else value
+    try:
+        return date.fromisoformat(str(value)[:10])
+    except ValueError:
+        return None
+
+def _to_float(value):
+    if value is None or isinstance(value, bool):
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def _to_text(value):
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, (dict, list)):
+        return json_codec.dumps(value)
+    return str(value)
+
+def _record_batch(table, schema, rows):
+    """Convert row dicts into a RecordBatch of the table's snapshot schema."""
+    pa = _pyarrow()
+    columns = {field.name: [] for field in schema}
+    for row in rows:
+        for column in SNAPSHOT_TABLES[table]:
+            value = row.get(column)
+            if column in DATE_COLUMNS:
+                value = _to_date(value)
+            elif column in AMOUNT_COLUMNS:
+                value = _to_float(value)
+            else:
+                value = _to_text(value)
+            columns[column].append(value)
+    return pa.RecordBatch.from_arrays(
+        [pa.array(columns[field.name], type=field.type) for field in schema], schema=schema
+    )
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def write_snapshot(directory=None, parquet=False, chunk_rows=CHUNK_ROWS):
+    """
+    Write a new snapshot version and make it current.
+
+    Tables are streamed from the database chunk by chunk, so memory use is bounded
+    by one chunk regardless of table size. The CURRENT pointer is swapped only
+    after every file and the manifest are complete.
+
+    Args:
+        directory (str): Snapshot root (default SNAPSHOT_DIR)
+        parquet (bool): Also write zstd-compressed Parquet copies for external tools
+        chunk_rows (int): Rows per streamed chunk / Arrow record batch
+
+    Returns:
+        dict: The manifest of the new version
+    """
+    pa = _pyarrow()
+    directory = directory or DEFAULT_SNAPSHOT_DIR
+    version = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%fZ")
+    version_dir = os.path.join(directory, version)
+    os.makedirs(version_dir)
+
+    manifest = {"version": version, "created_at": datetime.now(timezone.utc).isoformat(), "tables": {}}
+    start = time.perf_counter()
+    for table, source_columns in SNAPSHOT_TABLES.items():
+        schema = _arrow_schema(table)
+        arrow_path = os.path.join(version_dir, f"{table}.arrow")
+        rows = 0
+        with pa.OSFile(arrow_path, "wb") as sink, pa.ipc.new_file(sink, schema) as writer:
+            sql = f"SELECT {', '.join(source_columns)} FROM tap_bonds.{table} ORDER BY id"
+            for chunk in stream_query(sql, chunk_size=chunk_rows):
+                writer.write_batch(_record_batch(table, schema, chunk))
+                rows += len(chunk)
+
+        entry = {
+            "file": f"{table}.arrow",
+            "rows": rows,
+            "bytes": os.path.getsize(arrow_path),
+            "sha256": _sha256(arrow_path),
+            "columns": [field.name for field in schema],
+        }
+        if parquet:
+            import pyarrow.parquet as pq
+            parquet_path = os.path.join(version_dir, f"{table}.parquet")
+            with pa.memory_map(arrow_path) as source:
+                pq.write_table(pa.ipc.open_file(source).read_all(), parquet_path, compression="zstd")
+            entry["parquet"] = f"{table}.parquet"
+        manifest["tables"][table] = entry
+    manifest["build_seconds"] = round(time.perf_counter() - start, 3)
+
+    with open(os.path.join(version_dir, "manifest.json"), "w") as f:
+        f.write(json_codec.dumps(manifest, indent=2))
+    pointer = os.path.join(directory, "CURRENT")
+    with open(pointer + ".tmp", "w") as f:
+        f.write(version)
+    os.replace(pointer + ".tmp", pointer)
+
+    _prune(directory, version)
+    return manifest
+
+def _prune(directory, current):
+    versions = sorted(name for name in os.listdir(directory)
+                      if os.path.isdir(os.path.join(directory, name)) and name != current)
+    for name in versions[:max(0, len(versions) - KEEP_VERSIONS)]:
+        shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+
+class Snapshot:
+    """
+    Read-only view of one snapshot version.
+
+    Tables are memory-mapped on first access: opening is O(1) and pages are only
+    read from disk when a scan touches them.
+    """
+
+    def __init__(self, version_dir):
+        self.path = version_dir
+        with open(os.path.join(version_dir, "manifest.json")) as f:
+            self.manifest = json_codec.loads(f.read())
+        self.version = self.manifest["version"]
+        self._tables = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def open(cls, directory=None):
+        """Open the current snapshot, or return None if none has been written."""
+        directory = directory or DEFAULT_SNAPSHOT_DIR
+        try:
+            with open(os.path.join(directory, "CURRENT")) as f:
+                version = f.read().strip()
+        except FileNotFoundError:
+            return None
+        return cls(os.path.join(directory, version))
+
+    def tables(self):
+        return list(self.manifest["tables"])
+
+    def table(self, name):
+        """The table as a pyarrow.Table backed by the memory-mapped file."""
+        table = self._tables.get(name)
+        if table is None:
+            pa = _pyarrow()
+            entry = self.manifest["tables"][name]
+            with self._lock:
+                table = self._tables.get(name)
+                if table is None:
+                    source = pa.memory_map(os.path.join(self.path, entry["file"]))
+                    table = self._tables[name] = pa.ipc.open_file(source).read_all()
+        return table
+
+    def verify(self):
+        """Check every file against the manifest checksums; returns the names of mismatching tables."""
+        return [name for name, entry in self.manifest["tables"].items()
+                if _sha256(os.path.join(self.path, entry["file"])) != entry["sha256"]]
+
+_snapshot = None
+_snapshot_version = None
+_snapshot_lock = threading.Lock()
+
+def get_snapshot(directory=None):
+    """
+    Get the current snapshot (reopened when a newer version is written), or None.
+    """
+    global _snapshot, _snapshot_version
+    directory = directory or DEFAULT_SNAPSHOT_DIR
+    try:
+        with open(os.path.join(directory, "CURRENT")) as f:
+            version = f.read().strip()
+    except FileNotFoundError:
+        return None
+    if version != _snapshot_version:
+        with _snapshot_lock:
+            if version != _snapshot_version:
+                _snapshot = Snapshot(os.path.join(directory, version))
+                _snapshot_version = version
+    return _snapshot
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write or inspect columnar snapshots of the bond tables")
+    parser.add_argument("command", choices=["write", "info"])
+    parser.add_argument("--dir", default=DEFAULT_SNAPSHOT_DIR, help="Snapshot root directory")
+    parser.add_argument("--parquet", action="store_true", help="Also write Parquet copies")
+    args = parser.parse_args(argv)
+
+    if args.command == "write":
+        manifest = write_snapshot(args.dir, parquet=args.parquet)
+    else:
+        snapshot = Snapshot.open(args.dir)
+        if snapshot is None:
+            parser.error(f"No snapshot in {args.dir}")
+        start = time.perf_counter()
+        rows = {name: snapshot.table(name).num_rows for name in snapshot.tables()}
+        manifest = dict(snapshot.manifest, load_ms=round((time.perf_counter() - start) * 1000, 3), loaded_rows=rows)
+    print(json_codec.dumps(manifest, indent=2))
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,307 @@
+"""
+Parquet staging area for the source files loaded by data_processing.
+
+A source (CSV or Excel) is split into chunks that are parsed in parallel by a
+pool of worker processes. Every worker normalizes its rows once (dates to ISO
+strings, JSON documents re-serialized compactly, every other value to its text
+form) and writes one Parquet part, so the parsed rows never travel back
+through the parent process. A manifest records the source checksum and the
+checksum of every part; staging a source whose checksum and normalization
+version are unchanged reuses the existing parts without parsing anything.
+
+CSV files are split at record boundaries found by tracking quote parity, so
+quoted fields containing newlines stay whole. .xlsx sheets are split by row
+range (each worker streams its rows with openpyxl); other Excel formats are
+parsed as one chunk.
+
+    python -m src.utils.staging bond_details data/bonds_details.xlsx
+"""
+import argparse
+import concurrent.futures
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import time
+from datetime import date, datetime, timezone
+import numpy as np
+import pandas as pd
+
+DEFAULT_STAGING_DIR = os.getenv(
+    "STAGING_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "data", "staging")
+)
+WORKERS = int(os.getenv("STAGING_WORKERS", "0")) or os.cpu_count() or 1
+# Bump when normalization changes, so unchanged sources are parsed again
+STAGING_VERSION = 1
+CSV_CHUNK_BYTES = 32 * 1024 * 1024
+EXCEL_CHUNK_ROWS = 5000
+_SCAN_BYTES = 8 * 1024 * 1024
+
+# table -> (date columns, whether ambiguous dates are day-first)
+DATE_FORMATS = {
+    "bond_details": (("allotment_date", "maturity_date"), True),
+    "cashflows": (("cash_flow_date", "record_date"), False),
+    "company_insights": ((), False),
+}
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("Staging needs pyarrow (pip install pyarrow)")
+    return pyarrow
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _text(value):
+    """Canonical text of one cell: None for blanks, compact JSON for documents."""
+    if value is None or (isinstance(value, float) and np.isnan(value)) or value is pd.NaT:
+        return None
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    text = str(value)
+    if text.strip().startswith("{"):
+        try:
+            return json.dumps(json.loads(text))
+        except ValueError:
+            # Left as is; validation reports it
+            return text
+    return None if text == "nan" else text
+
+def _dates(values, dayfirst):
+    """ISO date strings; values that can't be read as dates are kept as their raw text."""
+    raw = pd.Series(values, dtype=object)
+    # ISO first: dayfirst parsing would swap the month and day of "2025-03-04"
+    parsed = pd.to_datetime(raw, format="%Y-%m-%d", errors="coerce")
+    rest = parsed.isna() & raw.notna()
+    if rest.any():
+        parsed[rest] = pd.to_datetime(raw[rest], dayfirst=dayfirst, format="mixed", errors="coerce")
+    iso = parsed.dt.strftime("%Y-%m-%d")
+    # Built by hand: Series.where would turn a None from _text into NaN
+    return [text if ok else _text(value) for text, ok, value in zip(iso, parsed.notna(), raw)]
+
+def normalize_frame(df, table):
+    """
+    Normalize parsed source rows into text columns (see the module docstring).
+
+    Returns:
+        pd.DataFrame: Object columns holding str or None
+    """
+    date_columns, dayfirst = DATE_FORMATS.get(table, ((), False))
+    columns = {}
+    for column in df.columns:
+        values = df[column].tolist()
+        if column in date_columns:
+            columns[column] = _dates(values, dayfirst)
+        else:
+            columns[column] = [_text(value) for value in values]
+    return pd.DataFrame(columns, columns=list(df.columns), dtype=object)
+
+def _read_chunk(path, kind, columns, start, stop):
+    """Rows [start, stop) of a source: byte offsets for CSV, data row numbers for Excel."""
+    if kind == "csv":
+        with open(path, "rb") as f:
+            f.seek(start)
+            data = f.read(stop - start)
+        return pd.read_csv(io.BytesIO(data), header=None, names=columns, dtype=object)
+    if kind == "xlsx":
+        import openpyxl
+        workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+        try:
+            # Row 1 is the header
+            rows = workbook.active.iter_rows(min_row=start + 2, max_row=stop + 1, values_only=True)
+            return pd.DataFrame([row[:len(columns)] for row in rows], columns=columns, dtype=object)
+        finally:
+            workbook.close()
+    return pd.read_excel(path, dtype=object)
+
+def _stage_chunk(path, kind, table, columns, start, stop, part_path):
+    """Parse, normalize and write one Parquet part; returns its row count and checksum."""
+    pa = _pyarrow()
+    df = normalize_frame(_read_chunk(path, kind, columns, start, stop), table)
+    schema = pa.schema([pa.field(str(column), pa.large_string()) for column in df.columns])
+    arrays = [pa.array(df[column].tolist(), type=pa.large_string()) for column in df.columns]
+    pa.parquet.write_table(pa.Table.from_arrays(arrays, schema=schema), part_path, compression="zstd")
+    return len(df), _sha256(part_path)
+
+def _csv_chunks(path, chunk_bytes):
+    """(columns, [(start, stop)]) with every boundary at a newline outside quotes."""
+    columns = [str(column) for column in pd.read_csv(path, nrows=0).columns]
+    size = os.path.getsize(path)
+    boundaries = []
+    target = None
+    parity = 0
+    with open(path, "rb") as f:
+        offset = 0
+        while True:
+            block = f.read(_SCAN_BYTES)
+            if not block:
+                break
+            buf = np.frombuffer(block, dtype=np.uint8)
+            # '"' toggles quoting; an escaped quote ("") toggles twice
+            inside = (np.cumsum(buf == 34) + parity) & 1
+            ends = np.flatnonzero((buf == 10) & (inside == 0)) + offset + 1
+            if target is None and len(ends):
+                # The first record boundary closes the header
+                boundaries.append(int(ends[0]))
+                target = boundaries[0] + chunk_bytes
+            while target is not None and len(ends):
+                i = np.searchsorted(ends, target)
+                if i == len(ends):
+                    break
+                boundaries.append(int(ends[i]))
+                target = boundaries[-1] + chunk_bytes
+            parity = int(inside[-1])
+            offset += len(block)
+    if not boundaries:
+        return columns, []
+    if boundaries[-1] < size:
+        boundaries.append(size)
+    return columns, [(start, stop) for start, stop in zip(boundaries, boundaries[1:]) if stop > start]
+
+def _xlsx_chunks(path, chunk_rows):
+    import openpyxl
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        sheet = workbook.active
+        header = next(sheet.iter_rows(min_row=1, max_row=1, values_only=True), ())
+        columns = [str(column) for column in header if column is not None]
+        rows = sheet.max_row
+        if rows is None:
+            # No dimension record in the file: count the rows
+            sheet.reset_dimensions()
+            rows = sum(1 for _ in sheet.iter_rows(values_only=True))
+    finally:
+        workbook.close()
+    data_rows = max(0, rows - 1)
+    return columns, [(start, min(start + chunk_rows, data_rows)) for start in range(0, data_rows, chunk_rows)]
+
+def _plan(path, chunk_bytes, chunk_rows):
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".csv":
+        return ("csv",) + _csv_chunks(path, chunk_bytes)
+    if extension in (".xlsx", ".xlsm"):
+        return ("xlsx",) + _xlsx_chunks(path, chunk_rows)
+    return "excel", None, [(0, 0)]
+
+def _verify(table_dir, manifest):
+    return all(
+        os.path.exists(os.path.join(table_dir, part["file"]))
+        and _sha256(os.path.join(table_dir, part["file"])) == part["sha256"]
+        for part in manifest["parts"]
+    )
+
+def read_manifest(table, staging_dir=None):
+    """The manifest of a staged table, or None if it was never staged."""
+    path = os.path.join(staging_dir or DEFAULT_STAGING_DIR, table, "manifest.json")
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def stage_source(path, table, staging_dir=None, workers=WORKERS, chunk_bytes=CSV_CHUNK_BYTES,
+                 chunk_rows=EXCEL_CHUNK_ROWS, force=False):
+    """
+    Stage a source file as Parquet parts under staging_dir/table, unless it already is.
+
+    Args:
+        path (str): CSV or Excel source
+        table (str): Target table (selects the date formats)
+        workers (int): Parser processes; 1 parses in this process
+        force (bool): Parse even if the source is unchanged
+
+    Returns:
+        dict: The manifest, with "reused" true when nothing was parsed
+    """
+    staging_dir = staging_dir or DEFAULT_STAGING_DIR
+    table_dir = os.path.join(staging_dir, table)
+    source_sha256 = _sha256(path)
+    manifest = read_manifest(table, staging_dir)
+    if (not force and manifest is not None and manifest["source_sha256"] == source_sha256
+            and manifest["version"] == STAGING_VERSION and _verify(table_dir, manifest)):
+        return dict(manifest, reused=True)
+
+    start_time = time.perf_counter()
+    kind, columns, chunks = _plan(path, chunk_bytes, chunk_rows)
+    work_dir = f"{table_dir}.tmp-{os.getpid()}"
+    shutil.rmtree(work_dir, ignore_errors=True)
+    os.makedirs(work_dir)
+    jobs = [(path, kind, table, columns, start, stop, os.path.join(work_dir, f"part-{i:05d}.parquet"))
+            for i, (start, stop) in enumerate(chunks)]
+    try:
+        if workers > 1 and len(jobs) > 1:
+            # spawn: the parent may hold a database connection and threads
+            with concurrent.futures.ProcessPoolExecutor(
+                max_workers=min(workers, len(jobs)), mp_context=multiprocessing.get_context("spawn")
+            ) as pool:
+                results = list(pool.map(_stage_chunk, *zip(*jobs)))
+        else:
+            results = [_stage_chunk(*job) for job in jobs]
+    except BaseException:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        raise
+
+    manifest = {
+        "table": table,
+        "version": STAGING_VERSION,
+        "source": os.path.abspath(path),
+        "source_sha256": source_sha256,
+        "source_bytes": os.path.getsize(path),
+        "staged_at": datetime.now(timezone.utc).isoformat(),
+        "rows": sum(rows for rows, _ in results),
+        "parts": [{"file": os.path.basename(job[-1]), "rows": rows, "sha256": sha256}
+                  for job, (rows, sha256) in zip(jobs, results)],
+        "parse_seconds": round(time.perf_counter() - start_time, 3),
+    }
+    with open(os.path.join(work_dir, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+    shutil.rmtree(table_dir, ignore_errors=True)
+    os.replace(work_dir, table_dir)
+    return dict(manifest, reused=False)
+
+def read_staged(table, staging_dir=None):
+    """
+    The staged rows of a table as one DataFrame of text columns (None for NULL).
+
+    Raises:
+        FileNotFoundError: If the table was never staged
+    """
+    pa = _pyarrow()
+    table_dir = os.path.join(staging_dir or DEFAULT_STAGING_DIR, table)
+    manifest = read_manifest(table, staging_dir)
+    if manifest is None:
+        raise FileNotFoundError(f"{table} has not been staged in {os.path.dirname(table_dir)}")
+    parts = [pa.parquet.read_table(os.path.join(table_dir, part["file"])) for part in manifest["parts"]]
+    if not parts:
+        return pd.DataFrame()
+    return pa.concat_tables(parts).to_pandas().astype(object).where(lambda df: df.notna(), None)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stage a source file as Parquet parts")
+    parser.add_argument("table", choices=sorted(DATE_FORMATS))
+    parser.add_argument("path", help="CSV or Excel source file")
+    parser.add_argument("--dir", default=DEFAULT_STAGING_DIR, help="Staging root directory")
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--force", action="store_true", help="Parse even if the source is unchanged")
+    args = parser.parse_args(argv)
+    print(json.dumps(stage_source(args.path, args.table, args.dir, workers=args.workers, force=args.force), indent=2))
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
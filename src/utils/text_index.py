@@ -0,0 +1,315 @@
+import json
+import math
+import os
+import re
+import threading
+
+# Text columns of company_insights that are indexed, keyed by the screener filter that targets them
+TEXT_FILTER_FIELDS = {
+    "description_contains": "description",
+    "news_contains": "news_and_events",
+    "pros_contains": "pros",
+    "cons_contains": "cons",
+}
+
+DEFAULT_INDEX_PATH = os.getenv(
+    "TEXT_INDEX_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "data", "text_index.json")
+)
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:[.'&][a-z0-9]+)*")
+_PHRASE_RE = re.compile(r'"([^"]*)"')
+
+def tokenize(text):
+    """Split text into lowercase word tokens."""
+    if not text:
+        return []
+    return _TOKEN_RE.findall(str(text).lower())
+
+def parse_query(query):
+    """
+    Parse a search string into clauses.
+
+    Quoted segments become phrase clauses, every other word becomes a term clause.
+    A trailing '*' on a word turns it into a prefix match (e.g. "renew*").
+
+    Returns:
+        list: Clauses as (kind, tokens) tuples where kind is "term", "prefix" or "phrase"
+    """
+    clauses = []
+    for phrase in _PHRASE_RE.findall(query):
+        tokens = tokenize(phrase)
+        if len(tokens) == 1:
+            clauses.append(("term", tokens))
+        elif tokens:
+            clauses.append(("phrase", tokens))
+
+    for word in _PHRASE_RE.sub(" ", query).split():
+        tokens = tokenize(word)
+        if not tokens:
+            continue
+        if word.endswith("*") and len(tokens) == 1:
+            clauses.append(("prefix", tokens))
+        else:
+            clauses.extend(("term", [token]) for token in tokens)
+    return clauses
+
+class TextIndex:
+    """Positional inverted index with BM25 ranking over company text columns."""
+
+    def __init__(self, fields=None, k1=1.2, b=0.75):
+        self.fields = list(fields or TEXT_FILTER_FIELDS.values())
+        self.k1 = k1
+        self.b = b
+        # field -> term -> doc_id -> [positions]
+        self._postings = {field: {} for field in self.fields}
+        # field -> doc_id -> token count
+        self._doc_lengths = {field: {} for field in self.fields}
+        self._total_lengths = {field: 0 for field in self.fields}
+        # field -> doc_id -> terms, so removals don't scan the vocabulary
+        self._doc_terms = {field: {} for field in self.fields}
+        # doc_id -> version marker (updated_at) of the indexed row
+        self._versions = {}
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._versions)
+
+    def __contains__(self, doc_id):
+        return doc_id in self._versions
+
+    def version(self, doc_id):
+        """Return the version the document was indexed at, or None if it is not indexed."""
+        return self._versions.get(doc_id)
+
+    def doc_ids(self):
+        return set(self._versions)
+
+    def upsert(self, doc_id, texts, version=None):
+        """
+        Index (or re-index) a document.
+
+        Args:
+            doc_id (str): company_insights id
+            texts (dict): Column name -> text for the indexed columns
+            version (str, optional): Version marker such as updated_at
+        """
+        with self._lock:
+            self._remove_unlocked(doc_id)
+            for field in self.fields:
+                tokens = tokenize(texts.get(field))
+                postings = self._postings[field]
+                for position, token in enumerate(tokens):
+                    postings.setdefault(token, {}).setdefault(doc_id, []).append(position)
+                self._doc_terms[field][doc_id] = set(tokens)
+                self._doc_lengths[field][doc_id] = len(tokens)
+                self._total_lengths[field] += len(tokens)
+            self._versions[doc_id] = version
+
+    def remove(self, doc_id):
+        """Drop a document from the index."""
+        with self._lock:
+            self._remove_unlocked(doc_id)
+
+    def _remove_unlocked(self, doc_id):
+        if doc_id not in self._versions:
+            return
+        for field in self.fields:
+            postings = self._postings[field]
+            for term in self._doc_terms[field].pop(doc_id, ()):
+                del postings[term][doc_id]
+                if not postings[term]:
+                    del postings[term]
+            self._total_lengths[field] -= self._doc_lengths[field].pop(doc_id, 0)
+        del self._versions[doc_id]
+
+    def _bm25(self, field, doc_freq, matches):
+        """Score {doc_id: term_frequency} matches for one clause."""
+        doc_count = len(self._versions)
+        doc_lengths = self._doc_lengths[field]
+        avg_length = (self._total_lengths[field] / doc_count) if doc_count else 0.0
+        idf = math.log(1 + (doc_count - doc_freq + 0.5) / (doc_freq + 0.5))
+
+        scores = {}
+        for doc_id, tf in matches.items():
+            norm = 1 - self.b + self.b * (doc_lengths.get(doc_id, 0) / avg_length if avg_length else 0.0)
+            scores[doc_id] = idf * tf * (self.k1 + 1) / (tf + self.k1 * norm)
+        return scores
+
+    def _match_clause(self, field, kind, tokens):
+        """Return {doc_id: frequency} for a single clause."""
+        postings = self._postings[field]
+        if kind == "term":
+            return {doc_id: len(positions) for doc_id, positions in postings.get(tokens[0], {}).items()}
+
+        if kind == "prefix":
+            matches = {}
+            for term, docs in postings.items():
+                if term.startswith(tokens[0]):
+                    for doc_id, positions in docs.items():
+                        matches[doc_id] = matches.get(doc_id, 0) + len(positions)
+            return matches
+
+        # Phrase: every token must appear at consecutive positions
+        candidate_lists = [postings.get(token) for token in tokens]
+        if not all(candidate_lists):
+            return {}
+        candidates = set.intersection(*(set(docs) for docs in candidate_lists))
+        matches = {}
+        for doc_id in candidates:
+            following = [set(docs[doc_id]) for docs in candidate_lists[1:]]
+            count = sum(
+                1 for start in candidate_lists[0][doc_id]
+                if all(start + offset + 1 in positions for offset, positions in enumerate(following))
+            )
+            if count:
+                matches[doc_id] = count
+        return matches
+
+    def search(self, field, query, limit=None):
+        """
+        Search one column. All clauses must match; documents are ranked by BM25.
+
+        Args:
+            field (str): Indexed column name (e.g. "description")
+            query (str): Search string, see parse_query
+            limit (int, optional): Maximum number of hits to return
+
+        Returns:
+            list: (doc_id, score) tuples, best first
+        """
+        return self.search_many([(field, query)], limit=limit)
+
+    def search_many(self, field_queries, limit=None, candidates=None):
+        """
+        Search several columns at once (AND across all of them), summing BM25 scores.
+
+        Args:
+            field_queries (list): (field, query) tuples
+            limit (int, optional): Maximum number of hits to return
+            candidates (set, optional): Only these doc ids can be returned; applied before `limit`
+
+        Returns:
+            list: (doc_id, score) tuples, best first
+        """
+        with self._lock:
+            totals = None
+            for field, query in field_queries:
+                if field not in self._postings:
+                    raise KeyError(f"Field '{field}' is not indexed")
+                for kind, tokens in parse_query(query):
+                    matches = self._match_clause(field, kind, tokens)
+                    scores = self._bm25(field, len(matches), matches)
+                    if totals is None:
+                        totals = scores
+                    else:
+                        totals = {doc_id: totals[doc_id] + score for doc_id, score in scores.items() if doc_id in totals}
+                    if not totals:
+                        return []
+
+        if totals is None:
+            return []
+        if candidates is not None:
+            totals = {doc_id: score for doc_id, score in totals.items() if doc_id in candidates}
+        ranked = sorted(totals.items(), key=lambda item: (-item[1], item[0]))
+        return ranked[:limit] if limit else ranked
+
+    def save(self, path=DEFAULT_INDEX_PATH):
+        """Persist the index atomically to a JSON file."""
+        with self._lock:
+            payload = {
+                "k1": self.k1,
+                "b": self.b,
+                "fields": self.fields,
+                "postings": self._postings,
+                "doc_lengths": self._doc_lengths,
+                "versions": self._versions,
+            }
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(payload, f, separators=(",", ":"))
+            os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path=DEFAULT_INDEX_PATH):
+        """Load an index from disk, returning an empty index if the file is missing."""
+        if not os.path.exists(path):
+            return cls()
+        with open(path) as f:
+            payload = json.load(f)
+
+        index = cls(fields=payload["fields"], k1=payload["k1"], b=payload["b"])
+        index._postings = payload["postings"]
+        index._doc_lengths = payload["doc_lengths"]
+        index._versions = payload["versions"]
+        index._total_lengths = {field: sum(lengths.values()) for field, lengths in index._doc_lengths.items()}
+        index._doc_terms = {field: {} for field in index.fields}
+        for field, postings in index._postings.items():
+            for term, docs in postings.items():
+                for doc_id in docs:
+                    index._doc_terms[field].setdefault(doc_id, set()).add(term)
+        return index
+
+_index = None
+_index_mtime = None
+_index_lock = threading.Lock()
+
+def get_text_index(path=DEFAULT_INDEX_PATH):
+    """Get the process-wide text index, reloading it when the file on disk has been rebuilt."""
+    global _index, _index_mtime
+    mtime = os.path.getmtime(path) if os.path.exists(path) else None
+    if _index is None or mtime != _index_mtime:
+        with _index_lock:
+            if _index is None or mtime != _index_mtime:
+                _index = TextIndex.load(path)
+                _index_mtime = mtime
+    return _index
+
+def refresh_text_index(connection, path=DEFAULT_INDEX_PATH):
+    """
+    Bring the on-disk index in line with company_insights.
+
+    Only rows whose updated_at differs from the indexed version are re-read and
+    re-indexed; rows that disappeared from the table are dropped.
+
+    Args:
+        connection: Open DB-API connection
+        path (str): Where the index is persisted
+
+    Returns:
+        dict: Counts of upserted and removed documents
+    """
+    global _index, _index_mtime
+    index = TextIndex.load(path)
+    fields = index.fields
+
+    cursor = connection.cursor()
+    cursor.execute("SELECT id, updated_at FROM company_insights")
+    current = {row[0]: row[1] for row in cursor.fetchall()}
+
+    stale_ids = [doc_id for doc_id, version in current.items() if doc_id not in index or index.version(doc_id) != version]
+    removed_ids = index.doc_ids() - set(current)
+
+    batch_size = 500
+    for start in range(0, len(stale_ids), batch_size):
+        batch = stale_ids[start:start+batch_size]
+        placeholders = ', '.join(['%s'] * len(batch))
+        cursor.execute(
+            f"SELECT id, updated_at, {', '.join(fields)} FROM company_insights WHERE id IN ({placeholders})",
+            batch
+        )
+        for row in cursor.fetchall():
+            index.upsert(row[0], dict(zip(fields, row[2:])), version=row[1])
+    cursor.close()
+
+    for doc_id in removed_ids:
+        index.remove(doc_id)
+
+    index.save(path)
+    with _index_lock:
+        _index = index
+        _index_mtime = os.path.getmtime(path)
+
+    print(f"Text index refreshed: {len(stale_ids)} upserted, {len(removed_ids)} removed, {len(index)} total")
+    return {"upserted": len(stale_ids), "removed": len(removed_ids), "total": len(index)}
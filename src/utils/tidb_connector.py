@@ -1,15 +1,40 @@
 import pymysql
 import os
-from dotenv import load_dotenv
+import pickle
+import re
+import threading
+import time
+from collections import OrderedDict
+from .cache import CACHE_ERRORS, get_cache
+from .config import load_env
+from .json_codec import LazyJSONRow
+from .metrics import REGISTRY, SQL_ROWS, span
+from .query_profiler import PROFILER
 
-# Load environment variables from .env file
-load_dotenv()
+# Budget of the in-process result cache, in pickled bytes of the cached rows (0 disables it)
+RESULT_CACHE_MAX_BYTES = int(os.getenv("SQL_RESULT_CACHE_BYTES", str(64 * 1024 * 1024)))
+
+SQL_CACHE_REQUESTS = REGISTRY.counter("tap_sql_cache_requests_total", "execute_query result cache lookups",
+                                      labelnames=("result",))
+SQL_CACHE_BYTES = REGISTRY.gauge("tap_sql_cache_bytes", "Pickled bytes held by the execute_query result cache")
+SQL_CACHE_EVICTIONS = REGISTRY.counter("tap_sql_cache_evictions_total", "Results evicted to stay within the byte budget")
+
+# Tables a statement reads (FROM/JOIN, including subqueries) or writes
+_READ_TABLES_RE = re.compile(r"\b(?:FROM|JOIN)\s+(?:`?\w+`?\.)?`?(\w+)", re.IGNORECASE)
+_WRITE_TABLE_RE = re.compile(r"^\s*(?:INSERT\s+(?:IGNORE\s+)?INTO|REPLACE\s+INTO|UPDATE|DELETE\s+FROM)\s+(?:`?\w+`?\.)?`?(\w+)",
+                             re.IGNORECASE)
 
 class TiDBConnector:
-    """Singleton class for TiDB database connection."""
+    """
+    Singleton class for TiDB database connections.
+
+    pymysql connections are not thread-safe, and requests run on worker threads
+    (asyncio.to_thread, Starlette's threadpool), so every thread gets its own
+    connection, opened on first use and reused by that thread afterwards.
+    """
     
     _instance = None
-    _connection = None
+    _local = threading.local()
     
     def __new__(cls):
         if cls._instance is None:
@@ -17,53 +42,329 @@ class TiDBConnector:
         return cls._instance
     
     def get_connection(self):
-        """Get the database connection (create if doesn't exist)."""
-        if self._connection is None or not self._connection.open:
-            self._connection = pymysql.connect(
-                host=os.getenv("TIDB_HOST"),
-                port=int(os.getenv("TIDB_PORT", "4000")),
-                user=os.getenv("TIDB_USER"),
-                password=os.getenv("TIDB_PASSWORD"),
-                database=os.getenv("TIDB_DATABASE", "test"),
-                ssl_verify_cert=True,
-                ssl_verify_identity=True,
-                ssl_ca=os.getenv("TIDB_SSL_CA", "/home/deep/Desktop/work/web/hackathon/src/utils/isrgrootx1.pem")
-            )
-        return self._connection
+        """Get this thread's database connection (create if doesn't exist)."""
+        connection = getattr(self._local, "connection", None)
+        if connection is None or not connection.open:
+            connection = self._local.connection = self.connect()
+        return connection
+    
+    def connect(self, **kwargs):
+        """Open a new, unshared connection with the configured settings."""
+        load_env()
+        return pymysql.connect(
+            host=os.getenv("TIDB_HOST"),
+            port=int(os.getenv("TIDB_PORT", "4000")),
+            user=os.getenv("TIDB_USER"),
+            password=os.getenv("TIDB_PASSWORD"),
+            database=os.getenv("TIDB_DATABASE", "test"),
+            ssl_verify_cert=True,
+            ssl_verify_identity=True,
+            ssl_ca=os.getenv("TIDB_SSL_CA", "/home/deep/Desktop/work/web/hackathon/src/utils/isrgrootx1.pem"),
+            **kwargs
+        )
     
     def close(self):
-        """Close the connection if it exists."""
-        if self._connection and self._connection.open:
-            self._connection.close()
-            self._connection = None
+        """Close this thread's connection if it exists."""
+        connection = getattr(self._local, "connection", None)
+        if connection is not None and connection.open:
+            connection.close()
+        self._local.connection = None
 
-# Helper function to get the singleton instance
+# Helper function to get the calling thread's connection
 def get_db():
     return TiDBConnector().get_connection()
 
-def execute_query(sql, params=None):
+# Optional replacement for the TiDB round trip, e.g. a local stand-in database
+_query_backend = None
+
+def set_query_backend(backend):
+    """
+    Route execute_query through another backend.
+    
+    Args:
+        backend (callable): Called as backend(sql, params) and returning a list of row dicts,
+            or None to go back to TiDB. If it also has a stream(sql, params, chunk_size)
+            method, stream_query uses that.
+    """
+    global _query_backend
+    _query_backend = backend
+    # Results cached from the previous backend don't describe the new one
+    RESULT_CACHE.clear()
+
+def fetch_rows(sql, params=None):
+    """Run a statement on TiDB and return all rows as dicts."""
+    connection = get_db()
+    with connection.cursor(pymysql.cursors.DictCursor) as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+def _fetch_rows(sql, params):
+    """Run a statement on the active backend."""
+    if _query_backend is not None:
+        return _query_backend(sql, params)
+    return fetch_rows(sql, params)
+
+def stream_rows(sql, params=None, chunk_size=1000):
+    """
+    Run a statement on TiDB with an unbuffered server-side cursor, yielding lists of row dicts.
+    
+    The cursor gets its own connection because an unbuffered result blocks the
+    connection until it is fully read. If the consumer stops early, the connection
+    is dropped rather than drained.
+    """
+    connection = TiDBConnector().connect(cursorclass=pymysql.cursors.SSDictCursor)
+    try:
+        cursor = connection.cursor()
+        cursor.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows
+        cursor.close()
+    finally:
+        try:
+            connection.close()
+        except Exception:
+            # The server may still be sending rows of an abandoned result
+            pass
+
+def _stream_rows(sql, params, chunk_size):
+    """Stream a statement from the active backend."""
+    if _query_backend is None:
+        return stream_rows(sql, params, chunk_size)
+    if hasattr(_query_backend, "stream"):
+        return _query_backend.stream(sql, params, chunk_size)
+    rows = _query_backend(sql, params)
+    return (rows[i:i + chunk_size] for i in range(0, len(rows), chunk_size))
+
+def stream_query(sql, params=None, chunk_size=1000):
+    """
+    Execute a query and yield its rows in chunks, holding at most one chunk in memory.
+    
+    Meant for exports of arbitrarily large results; errors propagate to the caller
+    instead of being returned as an error dict. The profiled duration covers the
+    whole stream, including time spent by the consumer between chunks.
+    
+    Args:
+        sql (str): SQL query to execute
+        params (tuple, optional): Parameters for the SQL query
+        chunk_size (int): Rows fetched from the server per chunk
+        
+    Yields:
+        list: Row dicts
+    """
+    total = 0
+    failed = False
+    start = time.perf_counter()
+    try:
+        for rows in _stream_rows(sql, params, chunk_size):
+            total += len(rows)
+            yield rows
+    except Exception:
+        failed = True
+        raise
+    finally:
+        PROFILER.record(sql, params, time.perf_counter() - start, rows=total, error=failed)
+        SQL_ROWS.observe(total)
+
+def execute_write(statements):
+    """
+    Run write statements in one transaction.
+    
+    Errors roll the transaction back and propagate to the caller.
+    
+    Args:
+        statements (list): (sql, list of params tuples) pairs, each run with executemany
+        
+    Returns:
+        int: Rows affected
+    """
+    affected = 0
+    start = time.perf_counter()
+    failed = False
+    try:
+        with span("sql", statement="WRITE"):
+            if _query_backend is not None and hasattr(_query_backend, "write"):
+                affected = _query_backend.write(statements)
+            else:
+                connection = get_db()
+                try:
+                    with connection.cursor() as cursor:
+                        for sql, rows in statements:
+                            if rows:
+                                affected += cursor.executemany(sql, rows) or 0
+                    connection.commit()
+                except Exception:
+                    connection.rollback()
+                    raise
+    except Exception:
+        failed = True
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        for sql, rows in statements:
+            PROFILER.record(sql, rows[0] if rows else None, duration / len(statements), rows=len(rows), error=failed)
+    _bump_written_tables(sql for sql, rows in statements if rows)
+    return affected
+
+def _bump_written_tables(statements):
+    """Invalidate cached results reading the tables a committed write touched."""
+    tables = sorted({match.group(1).lower() for match in map(_WRITE_TABLE_RE.match, statements) if match})
+    try:
+        get_cache().bump_table_generation(*tables)
+    except Exception:
+        # The write itself succeeded; cached results still expire with the cache TTL
+        CACHE_ERRORS.inc(operation="generation")
+
+def _capture_explain(stats, sql, params):
+    """Store the plan of a slow statement on its profiler entry."""
+    try:
+        plan = [dict(row) for row in _fetch_rows(f"EXPLAIN {sql}", params)]
+    except Exception as e:
+        plan = [{"error": f"EXPLAIN failed: {str(e)}"}]
+    PROFILER.attach_explain(stats, plan)
+
+def _profiled_fetch(sql, params):
+    """Run a statement under a span and feed its timing to the slow-query profiler."""
+    rows = None
+    start = time.perf_counter()
+    try:
+        with span("sql", statement=sql.split(None, 1)[0].upper() if sql.strip() else "") as sql_span:
+            rows = _fetch_rows(sql, params)
+            sql_span.set(rows=len(rows))
+    finally:
+        duration = time.perf_counter() - start
+        stats = PROFILER.record(sql, params, duration, rows=len(rows) if rows is not None else 0, error=rows is None)
+        if stats is not None:
+            _capture_explain(stats, sql, params)
+    
+    SQL_ROWS.observe(len(rows))
+    return rows
+
+def _cache_key(sql, params):
+    """Statements differing only in whitespace, or params passed as list vs tuple, share an entry."""
+    return (" ".join(sql.split()), tuple(params) if isinstance(params, (list, tuple)) else params)
+
+def _statement_tables(sql):
+    """Lower-cased names of the tables a SELECT reads, sorted."""
+    return sorted({table.lower() for table in _READ_TABLES_RE.findall(sql)})
+
+class ResultCache:
+    """
+    In-process LRU of execute_query results, bounded by the pickled size of the rows.
+
+    Each entry is tagged with the generations of the data it was read from (see
+    Cache.table_generations); looked up under other generations, it is stale and
+    dropped. Rows are kept pickled, so every hit returns a private copy.
+
+    Args:
+        max_bytes (int): Budget for all entries; a result larger than this is not cached
+    """
+
+    def __init__(self, max_bytes=RESULT_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        # key -> (generations, payload, monotonic expiry or None)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _drop(self, key):
+        _, payload, _ = self._entries.pop(key)
+        self.bytes -= len(payload)
+
+    def get(self, key, generations):
+        """The cached rows, or None on a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                result = "miss"
+            elif entry[0] != generations or (entry[2] is not None and entry[2] <= time.monotonic()):
+                self._drop(key)
+                result = "stale"
+            else:
+                self._entries.move_to_end(key)
+                result = "hit"
+            SQL_CACHE_BYTES.set(self.bytes)
+        SQL_CACHE_REQUESTS.inc(result=result)
+        return pickle.loads(entry[1]) if result == "hit" else None
+
+    def put(self, key, generations, rows, ttl_s=None):
+        payload = pickle.dumps(rows, pickle.HIGHEST_PROTOCOL)
+        if len(payload) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (generations, payload, time.monotonic() + ttl_s if ttl_s else None)
+            self.bytes += len(payload)
+            while self.bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                SQL_CACHE_EVICTIONS.inc()
+            SQL_CACHE_BYTES.set(self.bytes)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+            SQL_CACHE_BYTES.set(0)
+
+RESULT_CACHE = ResultCache()
+
+def _cached_fetch(sql, params):
+    """
+    Rows of a SELECT from the in-process result cache, then the shared cache, then the database.
+
+    Entries are keyed by the normalized statement and params under the generations
+    of the tables it reads, so a load or write of one table leaves results of
+    the other tables cached; between data loads, repeated lookups stay in the process.
+    """
+    cache = get_cache()
+    generations = cache.table_generations(_statement_tables(sql))
+    if generations is None:
+        return _profiled_fetch(sql, params)
+    key = _cache_key(sql, params)
+    if RESULT_CACHE.max_bytes > 0:
+        rows = RESULT_CACHE.get(key, generations)
+        if rows is not None:
+            return rows
+    rows = cache.get_or_compute("sql", (key, generations), lambda: _profiled_fetch(sql, params))
+    if RESULT_CACHE.max_bytes > 0:
+        RESULT_CACHE.put(key, generations, rows, cache.ttl_s)
+    return rows
+
+def execute_query(sql, params=None, json_columns=None, cache=False):
     """
     Execute a query and return the results as a dictionary.
     
     Args:
         sql (str): SQL query to execute
         params (tuple, optional): Parameters for the SQL query
+        json_columns (iterable, optional): Columns holding JSON text; rows are returned
+            as LazyJSONRow objects that decode these columns on first access
+        cache (bool): Serve the rows from the in-process result cache or the shared cache
+            (utils.cache) when present there for the current generations of the tables
+            the statement reads
         
     Returns:
         dict: Dictionary containing results and count
     """
-    connection = get_db()
     try:
-        with connection.cursor(pymysql.cursors.DictCursor) as cursor:
-            cursor.execute(sql, params)
-            results = cursor.fetchall()
-            
-            # Convert results to list of dicts (if needed)
-            result_list = [dict(row) for row in results]
-            
-            return {
-                "count": len(result_list),
-                "results": result_list
-            }
+        if cache:
+            results = _cached_fetch(sql, params)
+        else:
+            results = _profiled_fetch(sql, params)
+        
+        # DictCursor rows are already dicts; only wrap them when JSON columns are decoded lazily
+        if json_columns:
+            json_columns = frozenset(json_columns)
+            result_list = [LazyJSONRow(row, json_columns) for row in results]
+        else:
+            result_list = results if isinstance(results, list) else list(results)
+        
+        return {
+            "count": len(result_list),
+            "results": result_list
+        }
     except Exception as e:
         return {"error": f"Error executing query: {str(e)}"}
\ No newline at end of file
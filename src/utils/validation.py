@@ -0,0 +1,159 @@
+"""
+Column-wise validation of staged rows before they are inserted.
+
+Each table has a registry of rules; a rule checks one or two whole columns at
+once and returns the mask of failing rows. Rows failing any rule are split off
+with the reasons of every rule they failed, to be stored in the quarantine
+table, so the remaining rows can be inserted in large batches that don't fail
+on a single bad record.
+"""
+import json
+import numpy as np
+import pandas as pd
+from .bond_queries import BOND_DOCUMENT_SECTIONS, COMPANY_JSON_COLUMNS
+
+# MEDIUMTEXT holds at most 16 MiB
+MAX_TEXT_BYTES = 16 * 1024 * 1024 - 1
+
+def _column(df, name):
+    if name in df.columns:
+        return df[name]
+    return pd.Series([None] * len(df), index=df.index, dtype=object)
+
+def _present(values):
+    return values.notna().to_numpy() & (values.astype(str).str.strip() != "").to_numpy()
+
+class Rule:
+    """
+    One check over whole columns.
+
+    Args:
+        reason (str): Stored for every failing row
+        check (callable): Called with the DataFrame, returns a boolean array that is
+            True for failing rows
+    """
+
+    def __init__(self, reason, check):
+        self.reason = reason
+        self.check = check
+
+def required(column):
+    return Rule(f"{column}: missing", lambda df: ~_present(_column(df, column)))
+
+def unique(column):
+    """Rows repeating an earlier row's value (the first occurrence is kept)."""
+    return Rule(f"{column}: duplicate", lambda df: _column(df, column).duplicated(keep="first").to_numpy()
+                & _present(_column(df, column)))
+
+def iso_date(column):
+    def check(df):
+        values = _column(df, column)
+        parsed = pd.to_datetime(values, format="%Y-%m-%d", errors="coerce")
+        return _present(values) & parsed.isna().to_numpy()
+    return Rule(f"{column}: not a date", check)
+
+def date_order(first, second):
+    def check(df):
+        start = pd.to_datetime(_column(df, first), format="%Y-%m-%d", errors="coerce")
+        end = pd.to_datetime(_column(df, second), format="%Y-%m-%d", errors="coerce")
+        return (end < start).to_numpy()
+    return Rule(f"{second}: before {first}", check)
+
+def number(column, minimum=None):
+    def check(df):
+        values = _column(df, column)
+        numbers = pd.to_numeric(values.astype(str).str.replace(",", "", regex=False), errors="coerce")
+        invalid = _present(values) & numbers.isna().to_numpy()
+        if minimum is not None:
+            invalid |= (numbers < minimum).to_numpy()
+        return invalid
+    return Rule(f"{column}: not a number" + (f" >= {minimum}" if minimum is not None else ""), check)
+
+_ISIN_VALUES = np.full(256, -1, dtype=np.int64)
+_ISIN_VALUES[ord("0"):ord("9") + 1] = np.arange(10)
+_ISIN_VALUES[ord("A"):ord("Z") + 1] = np.arange(10, 36)
+
+def isin_checksums(values):
+    """
+    Validate ISINs: 2 letters, 9 alphanumerics and a Luhn check digit over the digits
+    of the letter-expanded code (A=10 ... Z=35), computed for all values at once.
+
+    Returns:
+        np.ndarray: True where the value is a well-formed ISIN
+    """
+    text = pd.Series(values, dtype=object).fillna("").astype(str).str.strip().str.upper()
+    well_formed = text.str.fullmatch(r"[A-Z]{2}[A-Z0-9]{9}[0-9]").to_numpy()
+    codes = np.zeros((len(text), 12), dtype=np.uint8)
+    if well_formed.any():
+        codes[well_formed] = np.frombuffer("".join(text[well_formed]).encode("ascii"), dtype=np.uint8).reshape(-1, 12)
+    char_values = _ISIN_VALUES[codes]
+    # Two digit slots per character, tens first; letters fill both, digits only the ones slot
+    digits = np.stack([np.where(char_values >= 10, char_values // 10, -1), char_values % 10], axis=2).reshape(len(text), 24)
+    present = digits >= 0
+    # Luhn: counting the check digit as position 0 from the right, odd positions are doubled
+    position = np.cumsum(present[:, ::-1], axis=1)[:, ::-1] - 1
+    doubled = np.where(position % 2 == 1, digits * 2, digits)
+    doubled = np.where(doubled > 9, doubled - 9, doubled)
+    total = np.where(present, doubled, 0).sum(axis=1)
+    return well_formed & (total % 10 == 0)
+
+def isin(column):
+    def check(df):
+        values = _column(df, column)
+        return _present(values) & ~isin_checksums(values)
+    return Rule(f"{column}: invalid ISIN (format or check digit)", check)
+
+def json_document(column, max_bytes=MAX_TEXT_BYTES):
+    """JSON text that parses and, unless max_bytes is None, fits in max_bytes of UTF-8."""
+    def check(df):
+        invalid = np.zeros(len(df), dtype=bool)
+        for i, value in enumerate(_column(df, column).tolist()):
+            if not isinstance(value, str) or not value.strip():
+                continue
+            if max_bytes is not None and len(value) > max_bytes // 4 and len(value.encode("utf-8")) > max_bytes:
+                invalid[i] = True
+            elif value.lstrip()[:1] in ("{", "["):
+                try:
+                    json.loads(value)
+                except ValueError:
+                    invalid[i] = True
+        return invalid
+    return Rule(f"{column}: malformed or oversized JSON" if max_bytes is not None else f"{column}: malformed JSON", check)
+
+_AMOUNTS = ("cash_flow_amount", "principal_amount", "interest_amount", "tds_amount", "remaining_principal")
+
+TABLE_RULES = {
+    "bond_details": [
+        required("id"), unique("id"), required("isin"), isin("isin"),
+        iso_date("allotment_date"), iso_date("maturity_date"), date_order("allotment_date", "maturity_date"),
+        number("issue_size", minimum=0),
+    # Sections are stored compressed in a LONGBLOB, so their size isn't capped here;
+    # insert_bond_documents quarantines any the database rejects
+    ] + [json_document(column, max_bytes=None) for column in BOND_DOCUMENT_SECTIONS],
+    "cashflows": [
+        required("id"), unique("id"), required("isin"), isin("isin"),
+        required("cash_flow_date"), iso_date("cash_flow_date"), iso_date("record_date"),
+    ] + [number(column, minimum=0) for column in _AMOUNTS],
+    "company_insights": [
+        required("id"), unique("id"), required("company_name"),
+    ] + [json_document(column) for column in COMPANY_JSON_COLUMNS],
+}
+
+def validate_rows(df, table):
+    """
+    Split rows into valid and quarantined ones.
+
+    Returns:
+        tuple: (DataFrame of valid rows, DataFrame of failing rows with an added
+            "reasons" column listing every failed rule)
+    """
+    reasons = [[] for _ in range(len(df))]
+    failed = np.zeros(len(df), dtype=bool)
+    for rule in TABLE_RULES[table]:
+        mask = np.asarray(rule.check(df), dtype=bool)
+        for i in np.flatnonzero(mask):
+            reasons[i].append(rule.reason)
+        failed |= mask
+    quarantined = df[failed].copy()
+    quarantined["reasons"] = ["; ".join(reasons[i]) for i in np.flatnonzero(failed)]
+    return df[~failed], quarantined
@@ -0,0 +1,94 @@
+"""Fake pymysql connections for tests that run SQL through src.utils.tidb_connector."""
+import threading
+import time
+import pytest
+from src.utils import tidb_connector as tc
+from src.utils.cache import Cache, NullBackend, set_cache
+
+class FakeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+        self.rowcount = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _statement(self):
+        self.connection.enter()
+        try:
+            # Long enough for requests on other threads to overlap with this one
+            time.sleep(0.005)
+        finally:
+            self.connection.leave()
+
+    def execute(self, sql, params=None):
+        self._statement()
+        self.rows = [{"thread": threading.get_ident(), "sql": sql}]
+        return 1
+
+    def executemany(self, sql, rows):
+        for params in rows:
+            if params is None:
+                raise ValueError("missing params")
+            self._statement()
+            self.connection.pending.append((sql, params))
+        return len(rows)
+
+    def fetchall(self):
+        return self.rows
+
+    def close(self):
+        pass
+
+class FakeConnection:
+    """Stands in for a pymysql connection and fails on any use from two threads at once."""
+
+    def __init__(self, log):
+        self.open = True
+        self.thread = threading.get_ident()
+        self.pending = []
+        self.log = log
+        self._busy = threading.Lock()
+
+    def enter(self):
+        if not self._busy.acquire(blocking=False):
+            raise AssertionError("connection used by two threads at once")
+        if threading.get_ident() != self.thread:
+            self._busy.release()
+            raise AssertionError("connection used by another thread than the one that opened it")
+
+    def leave(self):
+        self._busy.release()
+
+    def cursor(self, cursorclass=None):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.log.extend(self.pending)
+        self.pending = []
+
+    def rollback(self):
+        self.pending = []
+
+    def close(self):
+        self.open = False
+
+@pytest.fixture
+def connections(monkeypatch):
+    opened = []
+    committed = []
+
+    def connect(self, **kwargs):
+        connection = FakeConnection(committed)
+        opened.append(connection)
+        return connection
+
+    monkeypatch.setattr(tc.TiDBConnector, "connect", connect)
+    monkeypatch.setattr(tc.TiDBConnector, "_local", threading.local())
+    tc.set_query_backend(None)
+    set_cache(Cache(NullBackend()))
+    yield opened, committed
+    set_cache(None)
@@ -0,0 +1,26 @@
+from concurrent.futures import ThreadPoolExecutor
+from fastapi.testclient import TestClient
+from src.app import app
+
+def test_threadpool_endpoints_use_a_connection_per_thread(connections):
+    opened, _ = connections
+    client = TestClient(app)
+    requests = [
+        ("/bonds", {"table": "bond_details", "columns": ["isin"], "filters": {"secured": "Secured"}}),
+        ("/bonds", {"table": "cashflows", "columns": ["isin", "cash_flow_date"]}),
+        ("/companies", {"table": "company_insights", "columns": ["company_name"]}),
+    ] * 8
+
+    def post(request):
+        path, payload = request
+        return client.post(path, json=payload)
+
+    with ThreadPoolExecutor(max_workers=6) as pool:
+        responses = list(pool.map(post, requests))
+
+    assert [response.status_code for response in responses] == [200] * len(requests), \
+        [response.json() for response in responses if response.status_code != 200]
+    # Sync endpoints run in Starlette's threadpool; the fake connections fail any request
+    # that uses a connection from a thread other than the one that opened it
+    threads = {row["thread"] for response in responses for row in response.json()["results"]}
+    assert len(threads) > 1 and len(opened) >= len(threads)
@@ -0,0 +1,21 @@
+from src.utils.schemas import parse_structured, validate_plan
+
+class RepairLLM:
+    """Answers every repair prompt with a fixed response and keeps the prompts."""
+
+    def __init__(self, response):
+        self.response = response
+        self.prompts = []
+
+    def invoke(self, prompt, json_mode=False):
+        self.prompts.append(prompt)
+        return self.response
+
+def test_missing_key_is_repaired_from_its_parent():
+    llm = RepairLLM('{"plan": [{"agent": "bond_directory", "query": "Find bond INE002A01018"}]}')
+    plan = parse_structured('{"steps": []}', validate_plan, llm, component="orchestrator", task="orchestration plan")
+
+    assert len(llm.prompts) == 1
+    assert "Problem at $.plan" in llm.prompts[0] and '"steps"' in llm.prompts[0]
+    assert plan["plan"][0]["agent"] == "bond_directory"
+    assert plan["final_compilation_instructions"]
@@ -0,0 +1,18 @@
+from src.utils.staging import read_staged, stage_source
+
+def test_blank_date_and_multiline_field(tmp_path):
+    source = tmp_path / "cashflows.csv"
+    source.write_text(
+        'isin,cash_flow_date,record_date,notes\n'
+        'INE002A01018,2025-03-04,,"{""a"": 1,\n ""b"": 2}"\n'
+        'INE002A01018,04/09/2025,not a date,\n'
+    )
+    manifest = stage_source(str(source), "cashflows", staging_dir=str(tmp_path), workers=1)
+    rows = read_staged("cashflows", staging_dir=str(tmp_path)).to_dict("records")
+
+    assert manifest["rows"] == 2 and len(rows) == 2
+    # A blank date stages as NULL, and the quoted multi-line JSON stays one row
+    assert rows[0]["cash_flow_date"] == "2025-03-04" and rows[0]["record_date"] is None
+    assert rows[0]["notes"] == '{"a": 1, "b": 2}'
+    assert rows[1]["cash_flow_date"] == "2025-04-09" and rows[1]["record_date"] == "not a date"
+    assert rows[1]["notes"] is None
@@ -0,0 +1,31 @@
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from src.utils import tidb_connector as tc
+
+def test_concurrent_requests_get_their_own_connection(connections):
+    opened, committed = connections
+
+    def request(i):
+        result = tc.execute_query("SELECT isin FROM tap_bonds.bond_details WHERE id = %s", (i,))
+        assert "error" not in result, result
+        if i % 3 == 0:
+            tc.execute_write([("UPDATE position_valuations SET stale = 1 WHERE id = %s", [(i,)])])
+        else:
+            # A failed write rolls back only this thread's transaction
+            with pytest.raises(ValueError):
+                tc.execute_write([("UPDATE position_valuations SET stale = 1 WHERE id = %s", [(i,), None])])
+        return result["results"][0]["thread"]
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        threads = set(pool.map(request, range(48)))
+
+    assert len(opened) == len(threads) <= 8
+    assert sorted(params[0] for _, params in committed) == list(range(0, 48, 3))
+
+def test_thread_reuses_its_connection(connections):
+    opened, _ = connections
+    first = tc.get_db()
+    assert tc.get_db() is first
+    tc.TiDBConnector().close()
+    assert not first.open
+    assert tc.get_db() is not first and len(opened) == 2
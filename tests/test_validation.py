@@ -0,0 +1,16 @@
+import pandas as pd
+from src.utils.validation import MAX_TEXT_BYTES, validate_rows
+
+def _bond(**values):
+    return dict({"id": 1, "isin": "INE002A01018", "allotment_date": "2020-01-01", "maturity_date": "2030-01-01"},
+                **values)
+
+def test_oversized_bond_section_is_kept():
+    document = '{"text": "' + "a" * MAX_TEXT_BYTES + '"}'
+    valid, quarantined = validate_rows(pd.DataFrame([_bond(issuer_details=document)], dtype=object), "bond_details")
+    assert len(valid) == 1 and quarantined.empty
+
+def test_malformed_bond_section_is_quarantined():
+    valid, quarantined = validate_rows(pd.DataFrame([_bond(issuer_details="{bad")], dtype=object), "bond_details")
+    assert valid.empty
+    assert quarantined["reasons"].tolist() == ["issuer_details: malformed JSON"]